@@ -0,0 +1,126 @@
+"""
+Chunk graph write time for one document: the previous three UNWIND queries versus the
+batched chunk writer used by create_relation_between_chunks.
+
+Needs a disposable local Neo4j, e.g.
+    docker run --rm -p 7687:7687 -e NEO4J_AUTH=neo4j/password -e NEO4J_PLUGINS='["apoc"]' neo4j:5
+
+Embeddings are disabled (IS_EMBEDDING=false) so only the Neo4j writes are measured.
+Every run deletes the benchmark documents and their chunks first.
+
+Run from the backend folder:
+    python -m benchmarks.chunk_writer_benchmark --uri neo4j://localhost:7687 --password password
+"""
+import argparse
+import os
+import time
+from langchain.docstore.document import Document
+from langchain_community.graphs import Neo4jGraph
+from src.make_relationships import create_relation_between_chunks
+
+LEGACY_CHUNK_QUERY = """
+    UNWIND $batch_data AS data
+    MERGE (c:Chunk {id: data.id})
+    SET c.text = data.pg_content, c.position = data.position, c.length = data.length, c.fileName=data.f_name, c.content_offset=data.content_offset
+    WITH data, c
+    MATCH (d:Document {fileName: data.f_name})
+    MERGE (c)-[:PART_OF]->(d)
+"""
+LEGACY_FIRST_CHUNK_QUERY = """
+    UNWIND $relationships AS relationship
+    MATCH (d:Document {fileName: $f_name})
+    MATCH (c:Chunk {id: relationship.chunk_id})
+    FOREACH(r IN CASE WHEN relationship.type = 'FIRST_CHUNK' THEN [1] ELSE [] END |
+            MERGE (d)-[:FIRST_CHUNK]->(c))
+"""
+LEGACY_NEXT_CHUNK_QUERY = """
+    UNWIND $relationships AS relationship
+    MATCH (c:Chunk {id: relationship.current_chunk_id})
+    WITH c, relationship
+    MATCH (pc:Chunk {id: relationship.previous_chunk_id})
+    FOREACH(r IN CASE WHEN relationship.type = 'NEXT_CHUNK' THEN [1] ELSE [] END |
+            MERGE (c)<-[:NEXT_CHUNK]-(pc))
+"""
+# The embedding step MERGEd every chunk and its PART_OF relationship a second time
+LEGACY_EMBEDDING_QUERY = """
+    UNWIND $data AS row
+    MATCH (d:Document {fileName: $fileName})
+    MERGE (c:Chunk {id: row.chunkId})
+    MERGE (c)-[:PART_OF]->(d)
+"""
+
+
+class CountingGraph:
+    def __init__(self, graph):
+        self.graph = graph
+        self._driver = graph._driver
+        self._database = graph._database
+        self.round_trips = 0
+
+    def query(self, query, params={}):
+        self.round_trips += 1
+        return self.graph.query(query, params)
+
+
+def make_chunks(file_name, number_of_chunks):
+    return [Document(page_content=f"{file_name} chunk {i} " + "lorem ipsum dolor sit amet " * 40, metadata={})
+            for i in range(number_of_chunks)]
+
+
+def reset_document(graph, file_name):
+    graph.query("MATCH (c:Chunk {fileName: $f}) DETACH DELETE c", {"f": file_name})
+    graph.query("MERGE (d:Document {fileName: $f})", {"f": file_name})
+
+
+def write_legacy(graph, file_name, chunks, update_graph_chunks_processed):
+    import hashlib
+    batch_data, relationships, previous_id = [], [], ""
+    for i, chunk in enumerate(chunks):
+        chunk_id = hashlib.sha1(chunk.page_content.encode()).hexdigest()
+        batch_data.append({"id": chunk_id, "pg_content": chunk.page_content, "position": i + 1,
+                           "length": len(chunk.page_content), "f_name": file_name, "content_offset": 0})
+        if i == 0:
+            relationships.append({"type": "FIRST_CHUNK", "chunk_id": chunk_id})
+        else:
+            relationships.append({"type": "NEXT_CHUNK", "previous_chunk_id": previous_id, "current_chunk_id": chunk_id})
+        previous_id = chunk_id
+    graph.query(LEGACY_CHUNK_QUERY, {"batch_data": batch_data})
+    graph.query(LEGACY_FIRST_CHUNK_QUERY, {"f_name": file_name, "relationships": relationships})
+    graph.query(LEGACY_NEXT_CHUNK_QUERY, {"relationships": relationships})
+    for i in range(0, len(batch_data), update_graph_chunks_processed):
+        rows = [{"chunkId": data["id"]} for data in batch_data[i:i + update_graph_chunks_processed]]
+        graph.query(LEGACY_EMBEDDING_QUERY, {"fileName": file_name, "data": rows})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="neo4j://localhost:7687")
+    parser.add_argument("--username", default="neo4j")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--database", default="neo4j")
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--update-graph-chunks-processed", type=int, default=20)
+    args = parser.parse_args()
+    os.environ["IS_EMBEDDING"] = "false"
+
+    graph = Neo4jGraph(url=args.uri, username=args.username, password=args.password, database=args.database,
+                       refresh_schema=False)
+    print(f"{'writer':>8} {'chunks':>7} {'round trips':>12} {'seconds':>8} {'chunks/s':>9}")
+    for name in ("legacy", "batched"):
+        file_name = f"chunk-writer-benchmark-{name}"
+        reset_document(graph, file_name)
+        chunks = make_chunks(file_name, args.chunks)
+        counting_graph = CountingGraph(graph)
+        start = time.perf_counter()
+        if name == "legacy":
+            write_legacy(counting_graph, file_name, chunks, args.update_graph_chunks_processed)
+        else:
+            create_relation_between_chunks(counting_graph, file_name, chunks)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>8} {args.chunks:>7} {counting_graph.round_trips:>12} {elapsed:>8.2f} {args.chunks / elapsed:>9.0f}")
+        reset_document(graph, file_name)
+        graph.query("MATCH (d:Document {fileName: $f}) DETACH DELETE d", {"f": file_name})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Peak Python memory of cleaning, chunking and preparing the chunk writes of one large
+document: the previous list-at-every-stage path versus the generator pipeline
+(clean_pages -> CreateChunksofDocument.iter_chunk_records -> write_chunk_batches).
+
+Neo4j is replaced by a graph object that discards the queries, and embeddings are
+disabled (IS_EMBEDDING=false), so only the pipeline's own allocations are measured.
+Pages are generated lazily, as get_pdf_pages yields them.
+
+Run from the backend folder:
+    python -m benchmarks.chunking_memory_benchmark --pages 2000
+"""
+import argparse
+import hashlib
+import os
+import time
+import tracemalloc
+from langchain.docstore.document import Document
+from src.create_chunks import CreateChunksofDocument, clean_pages
+from src.make_relationships import write_chunk_batches
+
+PARAGRAPH = ("The supplier shall deliver the goods described in schedule \"A\" to the buyer's warehouse\n"
+             "within thirty days of the order date, and the buyer shall pay within sixty days. ")
+
+
+class DiscardingDriver:
+    pass
+
+
+class DiscardingGraph:
+    def __init__(self):
+        self._driver = DiscardingDriver()
+        self._database = "neo4j"
+        self.queries = 0
+
+    def query(self, query, params={}):
+        self.queries += 1
+        return []
+
+
+def generate_pages(number_of_pages):
+    for page_number in range(number_of_pages):
+        yield Document(page_content=f"Page {page_number}. " + PARAGRAPH * 30,
+                       metadata={'source': 'contract.pdf', 'page': page_number, 'total_pages': number_of_pages})
+
+
+def run_list_pipeline(number_of_pages):
+    # the stages of processing_source before the chunk stream: every stage materialises the document
+    pages = list(generate_pages(number_of_pages))
+    bad_chars = ['"', "\n", "'"]
+    for i in range(0, len(pages)):
+        text = pages[i].page_content
+        for j in bad_chars:
+            text = text.replace(j, ' ') if j == '\n' else text.replace(j, '')
+        pages[i] = Document(page_content=str(text), metadata=pages[i].metadata)
+    chunks = CreateChunksofDocument(pages, None).split_file_into_chunks()
+    batch_data, relationships, lst_chunks_including_hash = [], [], []
+    current_chunk_id = ""
+    for i, chunk in enumerate(chunks):
+        previous_chunk_id = current_chunk_id
+        current_chunk_id = hashlib.sha1(chunk.page_content.encode()).hexdigest()
+        batch_data.append({"id": current_chunk_id, "pg_content": chunk.page_content, "position": i + 1,
+                           "length": len(chunk.page_content), "f_name": "contract.pdf", "previous_id": previous_chunk_id})
+        relationships.append({"type": "NEXT_CHUNK", "previous_chunk_id": previous_chunk_id, "current_chunk_id": current_chunk_id})
+        lst_chunks_including_hash.append({'chunk_id': current_chunk_id, 'chunk_doc': chunk})
+    return len(lst_chunks_including_hash)
+
+
+def run_generator_pipeline(number_of_pages):
+    chunk_records = CreateChunksofDocument(clean_pages(generate_pages(number_of_pages)), None).iter_chunk_records()
+    number_of_chunks = 0
+    for batch in write_chunk_batches(DiscardingGraph(), "contract.pdf", chunk_records):
+        # extraction consumes each batch; nothing else keeps the chunk text
+        number_of_chunks += len(batch)
+    return number_of_chunks
+
+
+def measure(pipeline, number_of_pages):
+    tracemalloc.start()
+    start = time.perf_counter()
+    number_of_chunks = pipeline(number_of_pages)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return number_of_chunks, elapsed, peak / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=2000)
+    args = parser.parse_args()
+    os.environ["IS_EMBEDDING"] = "false"
+
+    print(f"{'pipeline':>10} {'chunks':>7} {'seconds':>8} {'peak MB':>8}")
+    for name, pipeline in (("lists", run_list_pipeline), ("generator", run_generator_pipeline)):
+        number_of_chunks, elapsed, peak_mb = measure(pipeline, args.pages)
+        print(f"{name:>10} {number_of_chunks:>7} {elapsed:>8.2f} {peak_mb:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Chunk embedding throughput: per-chunk embed_query versus batched embed_documents.
+
+Uses a local stand-in for SentenceTransformerEmbeddings so the numbers can be
+reproduced offline. The stand-in models the two costs that matter for
+all-MiniLM-L6-v2 on CPU: a fixed overhead per model call (tokenizer setup,
+tensor allocation, forward-pass dispatch) and a smaller cost per text.
+
+Run from the backend folder:
+    python -m benchmarks.embedding_benchmark
+"""
+import argparse
+import hashlib
+import time
+from src.shared.common_fn import embed_documents_in_batches
+
+DIMENSION = 384
+
+
+class SentenceTransformerStandIn:
+    def __init__(self, call_overhead_seconds=0.001, per_text_seconds=0.00005):
+        self.call_overhead_seconds = call_overhead_seconds
+        self.per_text_seconds = per_text_seconds
+
+    def _vector(self, text):
+        digest = hashlib.sha1(text.encode()).digest()
+        return [digest[i % len(digest)] / 255 for i in range(DIMENSION)]
+
+    def _simulate_forward_pass(self, number_of_texts):
+        time.sleep(self.call_overhead_seconds + self.per_text_seconds * number_of_texts)
+
+    def embed_query(self, text):
+        self._simulate_forward_pass(1)
+        return self._vector(text)
+
+    def embed_documents(self, texts):
+        self._simulate_forward_pass(len(texts))
+        return [self._vector(text) for text in texts]
+
+
+def make_chunks(number_of_chunks):
+    return [f"chunk {i} " + "lorem ipsum dolor sit amet " * 30 for i in range(number_of_chunks)]
+
+
+def benchmark_per_chunk(embeddings, texts):
+    start = time.perf_counter()
+    for text in texts:
+        embeddings.embed_query(text)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def benchmark_batched(embeddings, texts, batch_size):
+    start = time.perf_counter()
+    embed_documents_in_batches(embeddings, texts, batch_size)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    embeddings = SentenceTransformerStandIn()
+    print(f"{'chunks':>8} {'embed_query chunks/s':>22} {'batched chunks/s':>18} {'speedup':>8}")
+    for size in args.sizes:
+        texts = make_chunks(size)
+        per_chunk = benchmark_per_chunk(embeddings, texts)
+        batched = benchmark_batched(embeddings, texts, args.batch_size)
+        print(f"{size:>8} {per_chunk:>22.1f} {batched:>18.1f} {batched / per_chunk:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
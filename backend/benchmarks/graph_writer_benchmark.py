@@ -0,0 +1,71 @@
+"""
+Entity write throughput: Neo4jGraph.add_graph_documents versus the batched writer used by
+save_graphDocuments_in_neo4j, with graph documents that share entities the way
+documents of one mailbox or project do.
+
+Needs a disposable local Neo4j with APOC (add_graph_documents uses it), e.g.
+    docker run --rm -p 7687:7687 -e NEO4J_AUTH=neo4j/password -e NEO4J_PLUGINS='["apoc"]' neo4j:5
+
+Every run deletes the benchmark labels first.
+
+Run from the backend folder:
+    python -m benchmarks.graph_writer_benchmark --uri neo4j://localhost:7687 --password password
+"""
+import argparse
+import random
+import time
+from langchain.docstore.document import Document
+from langchain_community.graphs import Neo4jGraph
+from langchain_community.graphs.graph_document import GraphDocument, Node, Relationship
+from src.shared.common_fn import save_graphDocuments_in_neo4j
+
+LABELS = ("BenchPerson", "BenchOrganization", "BenchProject")
+RELATIONSHIP_TYPES = ("WORKS_FOR", "MENTIONS", "OWNS")
+
+
+def make_graph_documents(number_of_documents, nodes_per_document, distinct_entities, seed=7):
+    random.seed(seed)
+    graph_documents = []
+    for i in range(number_of_documents):
+        nodes = [Node(id=f"entity-{random.randrange(distinct_entities)}", type=random.choice(LABELS))
+                 for _ in range(nodes_per_document)]
+        relationships = [Relationship(source=nodes[j], target=nodes[j + 1], type=random.choice(RELATIONSHIP_TYPES))
+                         for j in range(len(nodes) - 1)]
+        graph_documents.append(GraphDocument(nodes=nodes, relationships=relationships,
+                                             source=Document(page_content=f"document {i}")))
+    return graph_documents
+
+
+def reset(graph):
+    for label in LABELS:
+        graph.query(f"MATCH (n:{label}) DETACH DELETE n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="neo4j://localhost:7687")
+    parser.add_argument("--username", default="neo4j")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--database", default="neo4j")
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--nodes-per-document", type=int, default=25)
+    parser.add_argument("--distinct-entities", type=int, default=2000)
+    args = parser.parse_args()
+
+    graph = Neo4jGraph(url=args.uri, username=args.username, password=args.password, database=args.database,
+                       refresh_schema=False)
+    graph_documents = make_graph_documents(args.documents, args.nodes_per_document, args.distinct_entities)
+    rows = sum(len(document.nodes) + len(document.relationships) for document in graph_documents)
+    print(f"{'writer':>22} {'rows':>7} {'seconds':>8} {'rows/s':>8}")
+    for name, write in (("add_graph_documents", graph.add_graph_documents),
+                        ("batched writer", lambda documents: save_graphDocuments_in_neo4j(graph, documents))):
+        reset(graph)
+        start = time.perf_counter()
+        write(graph_documents)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>22} {rows:>7} {elapsed:>8.2f} {rows / elapsed:>8.0f}")
+    reset(graph)
+
+
+if __name__ == "__main__":
+    main()
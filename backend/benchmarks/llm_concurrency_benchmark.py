@@ -0,0 +1,114 @@
+"""
+LLM extraction throughput under provider rate limits: fixed thread pool versus the
+shared adaptive concurrency limiter.
+
+Uses a local stand-in for a chat model API so the numbers can be reproduced offline.
+The stand-in serves a fixed number of concurrent requests, slows down as it gets busy,
+and answers 429 when more requests are in flight than it accepts or when its
+tokens-per-minute budget is spent. Several files are extracted at the same time, as
+with parallel /extract requests.
+
+Run from the backend folder:
+    python -m benchmarks.llm_concurrency_benchmark
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from src.llm_concurrency import AdaptiveConcurrencyLimiter, is_rate_limit_error
+
+
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+
+class RateLimitedLLMStandIn:
+    def __init__(self, max_concurrency, tokens_per_minute, base_latency_seconds=0.05, time_scale=60):
+        self.max_concurrency = max_concurrency
+        # time_scale shrinks the one minute token window so a run takes seconds
+        self.tokens_per_window = tokens_per_minute
+        self.window_seconds = 60 / time_scale
+        self.base_latency_seconds = base_latency_seconds
+        self.in_flight = 0
+        self.requests = 0
+        self.rate_limited = 0
+        self._window_start = time.monotonic()
+        self._window_tokens = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, tokens):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= self.window_seconds:
+                self._window_start, self._window_tokens = now, 0
+            self.requests += 1
+            if self.in_flight >= self.max_concurrency or self._window_tokens + tokens > self.tokens_per_window:
+                self.rate_limited += 1
+                raise FakeRateLimitError("429 Too Many Requests")
+            self._window_tokens += tokens
+            self.in_flight += 1
+            load = self.in_flight / self.max_concurrency
+        try:
+            time.sleep(self.base_latency_seconds * (1 + load))
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def extract_with_fixed_pool(llm, chunks, tokens, max_workers, retry_sleep_seconds):
+    def call(chunk):
+        while True:
+            try:
+                return llm.invoke(tokens)
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                time.sleep(retry_sleep_seconds)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(call, chunks))
+
+
+def extract_with_limiter(llm, chunks, tokens, limiter):
+    with ThreadPoolExecutor(max_workers=limiter.max_limit) as executor:
+        list(executor.map(lambda chunk: limiter.run(llm.invoke, tokens, estimated_tokens=tokens, max_retries=100), chunks))
+
+
+def run_files(extract, files, chunks_per_file):
+    start = time.perf_counter()
+    threads = [threading.Thread(target=extract, args=(range(chunks_per_file),)) for _ in range(files)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--chunks-per-file", type=int, default=100)
+    parser.add_argument("--tokens-per-request", type=int, default=3000)
+    parser.add_argument("--provider-concurrency", type=int, default=8)
+    parser.add_argument("--provider-tokens-per-minute", type=int, default=60000)
+    args = parser.parse_args()
+
+    total = args.files * args.chunks_per_file
+    print(f"{'strategy':>16} {'seconds':>8} {'requests/s':>11} {'API calls':>10} {'429s':>6}")
+
+    llm = RateLimitedLLMStandIn(args.provider_concurrency, args.provider_tokens_per_minute)
+    elapsed = run_files(lambda chunks: extract_with_fixed_pool(llm, chunks, args.tokens_per_request, 10, 0.05),
+                        args.files, args.chunks_per_file)
+    print(f"{'fixed pool (10)':>16} {elapsed:>8.2f} {total / elapsed:>11.1f} {llm.requests:>10} {llm.rate_limited:>6}")
+
+    llm = RateLimitedLLMStandIn(args.provider_concurrency, args.provider_tokens_per_minute)
+    # The stand-in compresses a minute to one second, so the limiter's windows are scaled the same way
+    limiter = AdaptiveConcurrencyLimiter("stand-in", max_limit=10, tokens_per_minute=args.provider_tokens_per_minute,
+                                         min_backoff_seconds=1 / 60, max_backoff_seconds=1, token_window_seconds=1)
+    elapsed = run_files(lambda chunks: extract_with_limiter(llm, chunks, args.tokens_per_request, limiter),
+                        args.files, args.chunks_per_file)
+    print(f"{'adaptive':>16} {elapsed:>8.2f} {total / elapsed:>11.1f} {llm.requests:>10} {llm.rate_limited:>6}")
+
+
+if __name__ == "__main__":
+    main()
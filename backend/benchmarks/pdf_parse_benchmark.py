@@ -0,0 +1,71 @@
+"""
+Time to first chunk and total chunking time of a long PDF: PyMuPDFLoader.load() followed by
+chunking versus the page-parallel get_pdf_pages generator feeding CreateChunksofDocument.
+
+A synthetic PDF of --pages text pages is generated with PyMuPDF unless --pdf is given.
+
+Run from the backend folder:
+    python -m benchmarks.pdf_parse_benchmark --pages 300
+"""
+import argparse
+import os
+import tempfile
+import time
+import fitz
+from langchain_community.document_loaders import PyMuPDFLoader
+from src.create_chunks import CreateChunksofDocument
+from src.document_sources.local_file import get_pdf_pages
+
+PARAGRAPH = ("The supplier shall deliver the goods described in schedule A to the buyer's warehouse within "
+             "thirty days of the order date, and the buyer shall pay the invoice within sixty days of delivery. ")
+
+
+def make_pdf(path, number_of_pages):
+    with fitz.open() as pdf:
+        for page_number in range(number_of_pages):
+            page = pdf.new_page()
+            page.insert_textbox(fitz.Rect(40, 40, 560, 800), f"Clause {page_number + 1}. " + PARAGRAPH * 12, fontsize=9)
+        pdf.save(path)
+
+
+def time_chunking(pages):
+    start = time.perf_counter()
+    first_chunk_seconds = None
+    number_of_chunks = 0
+    for chunk in CreateChunksofDocument(pages, None).iter_chunks():
+        if first_chunk_seconds is None:
+            first_chunk_seconds = time.perf_counter() - start
+        number_of_chunks += 1
+    return first_chunk_seconds, time.perf_counter() - start, number_of_chunks
+
+
+def time_chunking_loaded(pdf_path):
+    # the whole file is parsed before the first chunk, as the previous loader did
+    def load_pages():
+        yield from PyMuPDFLoader(pdf_path).load()
+    return time_chunking(load_pages())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--pdf", help="existing PDF to parse instead of a generated one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        pdf_path = args.pdf or os.path.join(directory, "contract.pdf")
+        if not args.pdf:
+            make_pdf(pdf_path, args.pages)
+        # start the shared parser processes once, as a running server already has them
+        time_chunking(get_pdf_pages(pdf_path))
+        print(f"{'parser':>14} {'first chunk s':>14} {'total s':>8} {'chunks':>7}")
+        results = [
+            ("PyMuPDFLoader", time_chunking_loaded(pdf_path)),
+            ("page parallel", time_chunking(get_pdf_pages(pdf_path))),
+        ]
+        for name, (first_chunk_seconds, total_seconds, number_of_chunks) in results:
+            print(f"{name:>14} {first_chunk_seconds:>14.2f} {total_seconds:>8.2f} {number_of_chunks:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Chunk timestamp alignment for a long video transcript: the previous all-pairs
+SequenceMatcher search versus the offset index used by get_chunks_with_timestamps.
+
+A synthetic lecture transcript is used and chunked by characters with overlap, so the
+benchmark runs offline.
+
+Run from the backend folder:
+    python -m benchmarks.youtube_alignment_benchmark --segments 3000
+"""
+import argparse
+import random
+import time
+from difflib import SequenceMatcher
+from langchain_core.documents import Document
+from src.document_sources import youtube
+from src.shared.constants import PAGE_TEXT_TRANSLATION
+
+WORDS = ("gradient", "descent", "converges", "when", "the", "learning", "rate", "is", "small", "enough",
+         "and", "loss", "surface", "convex", "so", "we", "take", "a", "step", "along", "negative")
+
+
+def make_transcript(number_of_segments, seed=3):
+    random.seed(seed)
+    return tuple({'text': " ".join(random.choice(WORDS) for _ in range(8)), 'start': i * 3.0, 'duration': 3.0}
+                 for i in range(number_of_segments))
+
+
+def make_chunks(transcript, chunk_size=800, overlap=80):
+    text = " ".join(segment['text'].strip(" ") for segment in transcript).translate(PAGE_TEXT_TRANSLATION)
+    return [Document(page_content=text[i:i + chunk_size], metadata={})
+            for i in range(0, len(text), chunk_size - overlap)]
+
+
+def align_all_pairs(chunks, transcript):
+    for chunk in chunks:
+        max_start_similarity = max_end_similarity = 0
+        for segment in transcript:
+            start_similarity = SequenceMatcher(None, chunk.page_content[:40], segment['text']).ratio()
+            end_similarity = SequenceMatcher(None, chunk.page_content[-40:], segment['text']).ratio()
+            if start_similarity > max_start_similarity:
+                max_start_similarity, chunk.metadata['start_time'] = start_similarity, segment['start']
+            if end_similarity > max_end_similarity:
+                max_end_similarity, chunk.metadata['end_time'] = end_similarity, segment['start'] + segment['duration']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--segments", type=int, default=3000)
+    args = parser.parse_args()
+
+    transcript = make_transcript(args.segments)
+    youtube.get_youtube_transcript = lambda youtube_id, translate_to_english=False: transcript
+    print(f"{'alignment':>12} {'chunks':>7} {'seconds':>8}")
+    for name, align in (("all pairs", lambda chunks: align_all_pairs(chunks, transcript)),
+                        ("offset index", lambda chunks: youtube.get_chunks_with_timestamps(chunks, "benchmark"))):
+        chunks = make_chunks(transcript)
+        start = time.perf_counter()
+        align(chunks)
+        print(f"{name:>12} {len(chunks):>7} {time.perf_counter() - start:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,9 @@ from src.graphDB_dataAccess import graphDBdataAccess
 from src.graph_query import get_graph_results
 from src.chunkid_entities import get_entities_from_chunkids
 from src.post_processing import create_fulltext, create_entity_embedding
+from src.shared.status_events import document_status_event_bus, get_status_event_key
+from src.shared.schema_profiles import get_schema_profiles, resolve_allowed_schema
+from src.job_queue import is_job_queue_enabled, start_extract_job_queue, get_extract_job_queue, ResubmitRequired
 from sse_starlette.sse import EventSourceResponse
 import json
 from typing import List, Mapping
@@ -68,6 +71,18 @@ app.add_api_route("/health", health([healthy_condition, healthy]))
 
 app.add_middleware(SessionMiddleware, secret_key=os.urandom(24))
 
+@app.on_event("startup")
+async def warm_up_models():
+    is_warmup_enabled = os.environ.get("EMBEDDING_MODEL_WARMUP", "False").lower() in ("true", "1", "yes")
+    if is_warmup_enabled:
+        stats = await asyncio.to_thread(warm_up_embedding_models, [os.environ.get('EMBEDDING_MODEL')])
+        logging.info(f'Embedding models warmed up: {stats}')
+
+@app.on_event("startup")
+async def load_schema_profiles():
+    # The ontology files are parsed once, not on the first request naming a profile
+    await asyncio.to_thread(get_schema_profiles)
+
 
 @app.post("/url/scan")
 async def create_source_knowledge_graph_url(
@@ -148,7 +163,10 @@ async def extract_knowledge_graph_from_file(
     allowedNodes=Form(None),
     allowedRelationship=Form(None),
     language=Form(None),
-    access_token=Form(None)
+    access_token=Form(None),
+    priority=Form(None),
+    folder_mode=Form(None),
+    schema_profile=Form(None)
 ):
     """
     Calls 'extract_graph_from_file' in a new thread to create Neo4jGraph from a
@@ -160,40 +178,90 @@ async def extract_knowledge_graph_from_file(
           password: Password to use for graph creation
           file: File object containing the PDF file
           model: Type of model to use ('Diffbot'or'OpenAI GPT')
+          folder_mode: 'true' to extract every PDF of the S3 prefix or GCS bucket folder
+          schema_profile: id of a server side schema profile ('taxonomy', 'ontology') used
+              instead of allowedNodes and allowedRelationship
 
     Returns:
-          Nodes and Relations created in Neo4j databse for the pdf file
+          Nodes and Relations created in Neo4j databse for the pdf file, or the queued
+          job id when EXTRACT_JOB_QUEUE_ENABLED is set
+    """
+    params = {'uri':uri, 'userName':userName, 'password':password, 'model':model, 'database':database,
+              'source_url':source_url, 'aws_access_key_id':aws_access_key_id, 'aws_secret_access_key':aws_secret_access_key,
+              'wiki_query':wiki_query, 'max_sources':max_sources, 'gcs_project_id':gcs_project_id,
+              'gcs_bucket_name':gcs_bucket_name, 'gcs_bucket_folder':gcs_bucket_folder, 'gcs_blob_filename':gcs_blob_filename,
+              'source_type':source_type, 'file_name':file_name, 'allowedNodes':allowedNodes,
+              'allowedRelationship':allowedRelationship, 'language':language, 'access_token':access_token,
+              'folder_mode':folder_mode, 'schema_profile':schema_profile}
+    if not is_accepted_source(source_type, source_url, wiki_query, gcs_bucket_name):
+        return create_api_response('Failed',message='source_type is other than accepted source')
+    if is_job_queue_enabled():
+        try:
+            priority = int(priority or 0)
+        except ValueError:
+            return create_api_response('Failed', message=f'priority must be an integer, got {priority}')
+        job_id = start_extract_job_queue(run_extract_job).submit(params, priority=priority)
+        return create_api_response('Success', data={'job_id':job_id, 'fileName':file_name, 'status':'Queued'}, file_source=source_type)
+    try:
+        result = await asyncio.to_thread(run_extraction, params)
+        return create_api_response('Success', data=result, file_source= source_type)
+    except Exception as e:
+        message=f"Failed To Process File:{file_name} or LLM Unable To Parse Content "
+        error_message = str(e)
+        return create_api_response('Failed', message=message + error_message[:100], error=error_message, file_name = file_name)
+
+def is_accepted_source(source_type, source_url, wiki_query, gcs_bucket_name):
+    return (source_type in ('local file', 'web-url')
+            or (source_type in ('s3 bucket', 'youtube') and bool(source_url))
+            or (source_type == 'Wikipedia' and bool(wiki_query))
+            or (source_type == 'gcs bucket' and bool(gcs_bucket_name)))
+
+def is_folder_request(params):
+    return params['source_type'] in ('s3 bucket', 'gcs bucket') and str(params.get('folder_mode')).lower() == 'true'
+
+def run_extraction(params, is_final_attempt=True):
     """
+    Extract the graph of one source; shared by /extract and the extract job workers.
+
+    Failure bookkeeping (failed file copy, uploaded file removal) only happens on the final
+    attempt so a queued job can be retried with its uploaded file; earlier attempts leave
+    the Document in Retrying status.
+    """
+    uri, userName, password, database = params['uri'], params['userName'], params['password'], params['database']
+    model, source_type, source_url = params['model'], params['source_type'], params['source_url']
+    file_name, wiki_query = params['file_name'], params['wiki_query']
+    allowedNodes, allowedRelationship = resolve_allowed_schema(params.get('schema_profile'), params['allowedNodes'], params['allowedRelationship'])
+    graph = None
+    merged_file_path = None
     try:
         graph = create_graph_database_connection(uri, userName, password, database)   
         graphDb_data_Access = graphDBdataAccess(graph)
-        if source_type == 'local file':
+        if is_folder_request(params):
+            result = extract_graph_from_folder(graph, model, source_type, allowedNodes, allowedRelationship, source_url,
+                                               params['aws_access_key_id'], params['aws_secret_access_key'], params['gcs_project_id'],
+                                               params['gcs_bucket_name'], params['gcs_bucket_folder'], params['access_token'])
+
+        elif source_type == 'local file':
             merged_file_path = os.path.join(MERGED_DIR,file_name)
             logging.info(f'File path:{merged_file_path}')
-            result = await asyncio.to_thread(
-                extract_graph_from_file_local_file, graph, model, merged_file_path, file_name, allowedNodes, allowedRelationship, uri)
+            result = extract_graph_from_file_local_file(graph, model, merged_file_path, file_name, allowedNodes, allowedRelationship, uri)
 
         elif source_type == 's3 bucket' and source_url:
-            result = await asyncio.to_thread(
-                extract_graph_from_file_s3, graph, model, source_url, aws_access_key_id, aws_secret_access_key, allowedNodes, allowedRelationship)
+            result = extract_graph_from_file_s3(graph, model, source_url, params['aws_access_key_id'], params['aws_secret_access_key'], allowedNodes, allowedRelationship)
         
         elif source_type == 'web-url':
-            result = await asyncio.to_thread(
-                extract_graph_from_web_page, graph, model, source_url, allowedNodes, allowedRelationship)
+            result = extract_graph_from_web_page(graph, model, source_url, allowedNodes, allowedRelationship)
 
         elif source_type == 'youtube' and source_url:
-            result = await asyncio.to_thread(
-                extract_graph_from_file_youtube, graph, model, source_url, allowedNodes, allowedRelationship)
+            result = extract_graph_from_file_youtube(graph, model, source_url, allowedNodes, allowedRelationship)
 
         elif source_type == 'Wikipedia' and wiki_query:
-            result = await asyncio.to_thread(
-                extract_graph_from_file_Wikipedia, graph, model, wiki_query, max_sources, language, allowedNodes, allowedRelationship)
+            result = extract_graph_from_file_Wikipedia(graph, model, wiki_query, params['max_sources'], params['language'], allowedNodes, allowedRelationship)
 
-        elif source_type == 'gcs bucket' and gcs_bucket_name:
-            result = await asyncio.to_thread(
-                extract_graph_from_file_gcs, graph, model, gcs_project_id, gcs_bucket_name, gcs_bucket_folder, gcs_blob_filename, access_token, allowedNodes, allowedRelationship)
+        elif source_type == 'gcs bucket' and params['gcs_bucket_name']:
+            result = extract_graph_from_file_gcs(graph, model, params['gcs_project_id'], params['gcs_bucket_name'], params['gcs_bucket_folder'], params['gcs_blob_filename'], params['access_token'], allowedNodes, allowedRelationship)
         else:
-            return create_api_response('Failed',message='source_type is other than accepted source')
+            raise Exception('source_type is other than accepted source')
         if result is not None:
             result['db_url'] = uri
             result['api_name'] = 'extract'
@@ -202,11 +270,18 @@ async def extract_knowledge_graph_from_file(
             result['source_type'] = source_type
             result['logging_time'] = formatted_time(datetime.now(timezone.utc))
         logger.log_struct(result)
-        return create_api_response('Success', data=result, file_source= source_type)
+        return result
     except Exception as e:
+        # Files of a folder record their own failures
+        if graph is None or is_folder_request(params):
+            raise
         message=f"Failed To Process File:{file_name} or LLM Unable To Parse Content "
         error_message = str(e)
-        graphDb_data_Access.update_exception_db(file_name,error_message)
+        # processing_source skips a Document left in Processing status, so a retried one is reset to Retrying
+        job_status = graphDb_data_Access.update_exception_db(file_name,error_message,'Failed' if is_final_attempt else 'Retrying')
+        is_cancelled = job_status == 'Cancelled'
+        if not is_final_attempt and not is_cancelled:
+            raise
         gcs_file_cache = os.environ.get('GCS_FILE_CACHE')
         if source_type == 'local file':
             if gcs_file_cache == 'True':
@@ -217,14 +292,43 @@ async def extract_knowledge_graph_from_file(
             else:
                 logging.info(f'Deleted File Path: {merged_file_path} and Deleted File Name : {file_name}')
                 delete_uploaded_local_file(merged_file_path,file_name)
+        if is_cancelled and not is_final_attempt:
+            # a cancelled Document is not retried
+            return {'fileName': file_name, 'status': 'Cancelled'}
         josn_obj = {'message':message,'error_message':error_message, 'file_name': file_name,'status':'Failed','db_url':uri,'failed_count':1, 'source_type': source_type, 'source_url':source_url, 'wiki_query':wiki_query, 'logging_time': formatted_time(datetime.now(timezone.utc))}
         logger.log_struct(josn_obj)
         logging.exception(f'File Failed in extraction: {josn_obj}')
-        return create_api_response('Failed', message=message + error_message[:100], error=error_message, file_name = file_name)
+        raise
     finally:
         gc.collect()
         if graph is not None:
             close_db_connection(graph, 'extract')
+
+def run_extract_job(params, is_final_attempt):
+    # Secrets are not persisted with the job, so a job recovered after a restart only runs
+    # against the configured database, with its NEO4J_* credentials
+    missing_secrets = [name for name in params.get('secret_params', ['password']) if params.get(name) is None]
+    if 'password' in missing_secrets and params.get('uri') == os.environ.get('NEO4J_URI'):
+        params = {**params, 'userName': params.get('userName') or os.environ.get('NEO4J_USERNAME'),
+                  'password': os.environ.get('NEO4J_PASSWORD')}
+        missing_secrets.remove('password')
+    if missing_secrets:
+        raise ResubmitRequired(f"{', '.join(missing_secrets)} of file {params.get('file_name')} lost by a restart, resubmit the extraction")
+    return run_extraction(params, is_final_attempt)
+
+@app.on_event("startup")
+async def start_extract_workers():
+    if is_job_queue_enabled():
+        # Resume jobs left in the queue by a previous run
+        start_extract_job_queue(run_extract_job)
+
+@app.get("/extract_job_status/{job_id}")
+async def extract_job_status(job_id):
+    job_queue = get_extract_job_queue()
+    job = job_queue.get_job(job_id) if job_queue is not None else None
+    if job is None:
+        return create_api_response('Failed', message=f'Extract job {job_id} not found')
+    return create_api_response('Success', data=job)
             
 @app.get("/sources_list")
 async def get_source_list(uri:str, userName:str, password:str, database:str=None):
@@ -285,11 +389,11 @@ async def post_processing(uri=Form(None), userName=Form(None), password=Form(Non
 async def chat_bot(uri=Form(None),model=Form(None),userName=Form(None), password=Form(None), database=Form(None),question=Form(None), document_names=Form(None),session_id=Form(None),mode=Form(None)):
     logging.info(f"QA_RAG called at {datetime.now()}")
     qa_rag_start_time = time.time()
+    graph = None
     try:
+        graph = create_graph_database_connection(uri, userName, password, database)
         if mode == "graph":
-            graph = Neo4jGraph( url=uri,username=userName,password=password,database=database,sanitize = True, refresh_schema=True)
-        else:
-            graph = create_graph_database_connection(uri, userName, password, database)
+            await asyncio.to_thread(graph.refresh_schema)
         result = await asyncio.to_thread(QA_RAG,graph=graph,model=model,question=question,document_names=document_names,session_id=session_id,mode=mode)
 
         total_call_time = time.time() - qa_rag_start_time
@@ -307,6 +411,8 @@ async def chat_bot(uri=Form(None),model=Form(None),userName=Form(None), password
         return create_api_response(job_status, message=message, error=error_message)
     finally:
         gc.collect()
+        if graph is not None:
+            close_db_connection(graph, 'chat_bot')
 
 @app.post("/chunk_entities")
 async def chunk_entities(uri=Form(None),userName=Form(None), password=Form(None), chunk_ids=Form(None)):
@@ -373,6 +479,7 @@ async def clear_chat_bot(uri=Form(None),userName=Form(None), password=Form(None)
             
 @app.post("/connect")
 async def connect(uri=Form(None), userName=Form(None), password=Form(None), database=Form(None)):
+    graph = None
     try:
         graph = create_graph_database_connection(uri, userName, password, database)
         result = await asyncio.to_thread(connection_check, graph)
@@ -385,6 +492,9 @@ async def connect(uri=Form(None), userName=Form(None), password=Form(None), data
         error_message = str(e)
         logging.exception(f'Connection failed to connect Neo4j database:{error_message}')
         return create_api_response(job_status, message=message, error=error_message)
+    finally:
+        if graph is not None:
+            close_db_connection(graph, 'connect')
 
 @app.post("/upload")
 async def upload_large_file_into_chunks(file:UploadFile = File(...), chunkNumber=Form(None), totalChunks=Form(None), 
@@ -395,7 +505,8 @@ async def upload_large_file_into_chunks(file:UploadFile = File(...), chunkNumber
         result = await asyncio.to_thread(upload_file, graph, model, file, chunkNumber, totalChunks, originalname, uri, CHUNK_DIR, MERGED_DIR)
         josn_obj = {'api_name':'upload','db_url':uri, 'logging_time': formatted_time(datetime.now(timezone.utc))}
         logger.log_struct(josn_obj)
-        if int(chunkNumber) == int(totalChunks):
+        # the part that completes the file returns the source node data
+        if isinstance(result, dict):
             return create_api_response('Success',data=result, message='Source Node Created Successfully')
         else:
             return create_api_response('Success', message=result)
@@ -411,6 +522,45 @@ async def upload_large_file_into_chunks(file:UploadFile = File(...), chunkNumber
         if graph is not None:
             close_db_connection(graph, 'upload')
             
+@app.post("/ingest_text")
+async def ingest_text(uri=Form(None), userName=Form(None), password=Form(None), database=Form(None), model=Form(None),
+                      file_name=Form(None), text=Form(None), metadata=Form(None), allowedNodes=Form(None),
+                      allowedRelationship=Form(None), schema_profile=Form(None)):
+    """
+    Creates the Document node of a text and extracts its graph in one request, in place
+    of /upload followed by /extract for small text documents such as emails.
+
+    Args:
+          file_name: name of the Document node
+          text: content of the document
+          metadata: optional JSON object stored as properties of the Document node
+          schema_profile: id of a server side schema profile, as for /extract
+    """
+    graph = None
+    try:
+        allowedNodes, allowedRelationship = resolve_allowed_schema(schema_profile, allowedNodes, allowedRelationship)
+        graph = create_graph_database_connection(uri, userName, password, database)
+        result = await asyncio.to_thread(ingest_text_document, graph, model, file_name, text, allowedNodes, allowedRelationship,
+                                         json.loads(metadata) if metadata else None)
+        if result is not None:
+            result['db_url'] = uri
+            result['api_name'] = 'ingest_text'
+            result['source_type'] = 'text'
+            result['logging_time'] = formatted_time(datetime.now(timezone.utc))
+        logger.log_struct(result)
+        return create_api_response('Success', data=result, file_source='text')
+    except Exception as e:
+        message=f"Failed To Process File:{file_name} or LLM Unable To Parse Content "
+        error_message = str(e)
+        if graph is not None:
+            graphDBdataAccess(graph).update_exception_db(file_name, error_message)
+        logging.exception(f'Exception in ingest_text: {error_message}')
+        return create_api_response('Failed', message=message + error_message[:100], error=error_message, file_name=file_name)
+    finally:
+        gc.collect()
+        if graph is not None:
+            close_db_connection(graph, 'ingest_text')
+
 @app.post("/schema")
 async def get_structured_schema(uri=Form(None), userName=Form(None), password=Form(None), database=Form(None)):
     try:
@@ -438,39 +588,68 @@ def decode_password(pwd):
 
 @app.get("/update_extract_status/{file_name}")
 async def update_extract_status(request:Request, file_name, url, userName, password, database):
+    """
+    Streams the status of a Document. Progress is pushed as it is published when the
+    extraction runs in this worker process; the event bus is per process, so under several
+    gunicorn workers the stream usually re-reads the Document node every
+    STATUS_STREAM_FALLBACK_SECONDS instead. Sub-second updates need a single worker process.
+    """
     async def generate():
-        status = ''
         decoded_password = decode_password(password)
         uri = url
         if " " in url:
             uri= url.replace(" ","+")
-        while True:
-            if await request.is_disconnected():
-                logging.info("Request disconnected")
-                break
-            #get the current status of document node
-            graph = create_graph_database_connection(uri, userName, decoded_password, database)
-            graphDb_data_Access = graphDBdataAccess(graph)
-            result = graphDb_data_Access.get_current_status_document_node(file_name)
-            if result is not None:
-                status = json.dumps({'fileName':file_name, 
-                'status':result[0]['Status'],
-                'processingTime':result[0]['processingTime'],
-                'nodeCount':result[0]['nodeCount'],
-                'relationshipCount':result[0]['relationshipCount'],
-                'model':result[0]['model'],
-                'total_chunks':result[0]['total_chunks'],
-                'total_pages':result[0]['total_pages'],
-                'fileSize':result[0]['fileSize'],
-                'processed_chunk':result[0]['processed_chunk'],
-                'fileSource':result[0]['fileSource']
-                })
-            else:
-                status = json.dumps({'fileName':file_name, 'status':'Failed'})
-            yield status
+        fallback_seconds = float(os.environ.get('STATUS_STREAM_FALLBACK_SECONDS', 2))
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        event_key = get_status_event_key(uri, database, file_name)
+
+        def on_status_event(event):
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        # Subscribe before reading Neo4j so no progress published in between is lost
+        document_status_event_bus.subscribe(event_key, on_status_event)
+        try:
+            status = await asyncio.to_thread(get_document_status_from_graph, uri, userName, decoded_password, database, file_name)
+            yield json.dumps(status)
+            while True:
+                if await request.is_disconnected():
+                    logging.info("Request disconnected")
+                    break
+                try:
+                    event = await asyncio.wait_for(events.get(), timeout=fallback_seconds)
+                    status.update(event)
+                except asyncio.TimeoutError:
+                    # No event within the window, e.g. the file is processed by another worker process
+                    status = await asyncio.to_thread(get_document_status_from_graph, uri, userName, decoded_password, database, file_name)
+                yield json.dumps(status)
+        finally:
+            document_status_event_bus.unsubscribe(event_key, on_status_event)
     
     return EventSourceResponse(generate(),ping=60)
 
+def get_document_status_from_graph(uri, userName, password, database, file_name):
+    graph = create_graph_database_connection(uri, userName, password, database)
+    try:
+        graphDb_data_Access = graphDBdataAccess(graph)
+        result = graphDb_data_Access.get_current_status_document_node(file_name)
+    finally:
+        close_db_connection(graph, 'update_extract_status')
+    if result is None:
+        return {'fileName':file_name, 'status':'Failed'}
+    return {'fileName':file_name, 
+            'status':result[0]['Status'],
+            'processingTime':result[0]['processingTime'],
+            'nodeCount':result[0]['nodeCount'],
+            'relationshipCount':result[0]['relationshipCount'],
+            'model':result[0]['model'],
+            'total_chunks':result[0]['total_chunks'],
+            'total_pages':result[0]['total_pages'],
+            'fileSize':result[0]['fileSize'],
+            'processed_chunk':result[0]['processed_chunk'],
+            'fileSource':result[0]['fileSource']
+            }
+
 @app.post("/delete_document_and_entities")
 async def delete_document_and_entities(uri=Form(), 
                                        userName=Form(), 
@@ -502,7 +681,7 @@ async def delete_document_and_entities(uri=Form(),
 @app.get('/document_status/{file_name}')
 async def get_document_status(file_name, url, userName, password, database):
     decoded_password = decode_password(password)
-   
+    graph = None
     try:
         if " " in url:
             uri= url.replace(" ","+")
@@ -532,11 +711,17 @@ async def get_document_status(file_name, url, userName, password, database):
         error_message = str(e)
         logging.exception(f'{message}:{error_message}')
         return create_api_response('Failed',message=message)
-    
+    finally:
+        if graph is not None:
+            close_db_connection(graph, 'document_status')
+
 @app.post("/cancelled_job")
 async def cancelled_job(uri=Form(None), userName=Form(None), password=Form(None), database=Form(None), filenames=Form(None), source_types=Form(None)):
     try:
         graph = create_graph_database_connection(uri, userName, password, database)
+        job_queue = get_extract_job_queue()
+        if job_queue is not None:
+            job_queue.cancel_queued_jobs(uri, database, list(map(str.strip, json.loads(filenames))))
         result = manually_cancelled_job(graph,filenames, source_types, MERGED_DIR, uri)
         
         return create_api_response('Success',message=result)
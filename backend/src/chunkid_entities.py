@@ -1,6 +1,7 @@
 import logging
 from neo4j import graph
 from src.graph_query import *
+from src.shared.graph_pool import borrowed_driver
 
 CHUNK_QUERY = """
 match (chunk:Chunk) where chunk.id IN $chunksIds
@@ -104,8 +105,8 @@ def get_entities_from_chunkids(uri, username, password, chunk_ids):
         logging.info(f"Starting graph query process for chunk ids")
         if chunk_ids:
             chunk_ids_list = chunk_ids.split(",")
-            driver = get_graphDB_driver(uri, username, password)
-            records, summary, keys = driver.execute_query(CHUNK_QUERY, chunksIds=chunk_ids_list)
+            with borrowed_driver(uri, username, password) as driver:
+                records, summary, keys = driver.execute_query(CHUNK_QUERY, chunksIds=chunk_ids_list)
             result = process_records(records)
             logging.info(f"Nodes and relationships are processed")
             result["chunk_data"] = process_chunk_data(records)
@@ -3,13 +3,34 @@ from langchain.docstore.document import Document
 from langchain_community.graphs import Neo4jGraph
 import logging
 import os
+import hashlib
+import itertools
+from typing import Iterable
 from src.document_sources.youtube import get_chunks_with_timestamps
+from src.shared.constants import PAGE_TEXT_TRANSLATION
 
 logging.basicConfig(format="%(asctime)s - %(message)s", level="INFO")
 
 
+def clean_pages(pages: Iterable[Document]):
+    for page in pages:
+        yield Document(page_content=page.page_content.translate(PAGE_TEXT_TRANSLATION), metadata=page.metadata)
+
+
+def get_chunk_records(chunks: Iterable[Document]):
+    """
+    Yield {'chunk_id', 'chunk_doc', 'position', 'content_offset'} for every chunk; the id is
+    the sha1 of the chunk text and the offset counts the characters of the chunks before it.
+    """
+    content_offset = 0
+    for i, chunk in enumerate(chunks):
+        yield {'chunk_id': hashlib.sha1(chunk.page_content.encode()).hexdigest(), 'chunk_doc': chunk,
+               'position': i + 1, 'content_offset': content_offset}
+        content_offset += len(chunk.page_content)
+
+
 class CreateChunksofDocument:
-    def __init__(self, pages: list[Document], graph: Neo4jGraph):
+    def __init__(self, pages: Iterable[Document], graph: Neo4jGraph):
         self.pages = pages
         self.graph = graph
 
@@ -23,19 +44,33 @@ class CreateChunksofDocument:
         Returns:
             A list of chunks each of which is a langchain Document.
         """
+        return list(self.iter_chunks())
+
+    def iter_chunks(self):
+        """
+        Yield the chunks of the pages in order. Pages may be a generator; PDF pages are
+        chunked as they arrive, so the first chunks are ready before the last page is read.
+        """
         logging.info("Split file into smaller chunks")
         # number_of_chunks_allowed = int(os.environ.get('NUMBER_OF_CHUNKS_ALLOWED'))
         text_splitter = TokenTextSplitter(chunk_size=200, chunk_overlap=20)
-        if 'page' in self.pages[0].metadata:
-            chunks = []
-            for i, document in enumerate(self.pages):
+        pages = iter(self.pages)
+        first_page = next(pages, None)
+        if first_page is None:
+            return
+        pages = itertools.chain([first_page], pages)
+        if 'page' in first_page.metadata:
+            for i, document in enumerate(pages):
                 page_number = i + 1
                 for chunk in text_splitter.split_documents([document]):
-                    chunks.append(Document(page_content=chunk.page_content, metadata={'page_number':page_number}))    
+                    yield Document(page_content=chunk.page_content, metadata={'page_number':page_number})
         
-        elif 'length' in self.pages[0].metadata:
-            chunks_without_timestamps = text_splitter.split_documents(self.pages)
-            chunks = get_chunks_with_timestamps(chunks_without_timestamps, self.pages[0].metadata['source'])
+        elif 'length' in first_page.metadata:
+            pages = list(pages)
+            chunks_without_timestamps = text_splitter.split_documents(pages)
+            yield from get_chunks_with_timestamps(chunks_without_timestamps, first_page.metadata['source'])
         else:
-            chunks = text_splitter.split_documents(self.pages)
-        return chunks
\ No newline at end of file
+            yield from text_splitter.split_documents(list(pages))
+
+    def iter_chunk_records(self):
+        return get_chunk_records(self.iter_chunks())
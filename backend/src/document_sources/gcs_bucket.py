@@ -86,45 +86,36 @@ def upload_file_to_gcs(file_chunk, chunk_number, original_file_name, bucket_name
   
     file_name = f'{original_file_name}_part_{chunk_number}'
     bucket = storage_client.bucket(bucket_name)
-    file_data = file_chunk.file.read()
     file_name_with__hashed_folder = folder_name_sha1_hashed +'/'+file_name
     logging.info(f'GCS folder pathin upload: {file_name_with__hashed_folder}')
     blob = bucket.blob(file_name_with__hashed_folder)
-    file_io = io.BytesIO(file_data)
-    blob.upload_from_file(file_io)
-    time.sleep(1)
+    # streamed from the request's spooled file instead of read into memory first
+    blob.upload_from_file(file_chunk.file, rewind=True)
     logging.info('Chunk uploaded successfully in gcs')
   except Exception as e:
     raise Exception('Error in while uploading the file chunks on GCS')
-  
+
+# GCS compose accepts at most 32 source objects per request
+GCS_COMPOSE_MAX_SOURCES = 32
+
 def merge_file_gcs(bucket_name, original_file_name: str, folder_name_sha1_hashed, total_chunks):
+  """Concatenate the uploaded parts server side with GCS compose; no part is downloaded."""
   try:
       storage_client = storage.Client()
       bucket = storage_client.bucket(bucket_name)
-      # Retrieve chunks from GCS
-      # blobs = storage_client.list_blobs(bucket_name, prefix=folder_name_sha1_hashed)
-      # print(f'before sorted blobs: {blobs}')
-      chunks = []
-      for i in range(1,total_chunks+1):
-        blob_name = folder_name_sha1_hashed + '/' + f"{original_file_name}_part_{i}"
-        blob = bucket.blob(blob_name) 
-        if blob.exists():
-          print(f'Blob Name: {blob.name}')
-          chunks.append(blob.download_as_bytes())
-        blob.delete()
-      
-      merged_file = b"".join(chunks)
+      part_blobs = [bucket.blob(folder_name_sha1_hashed + '/' + f"{original_file_name}_part_{i}") for i in range(1,total_chunks+1)]
       file_name_with__hashed_folder = folder_name_sha1_hashed +'/'+original_file_name
       logging.info(f'GCS folder path in merge: {file_name_with__hashed_folder}')
-      blob = storage_client.bucket(bucket_name).blob(file_name_with__hashed_folder)
+      merged_blob = bucket.blob(file_name_with__hashed_folder)
+      merged_blob.compose(part_blobs[:GCS_COMPOSE_MAX_SOURCES])
+      # the merged object is the first source of every following compose
+      for i in range(GCS_COMPOSE_MAX_SOURCES, len(part_blobs), GCS_COMPOSE_MAX_SOURCES - 1):
+        merged_blob.compose([merged_blob] + part_blobs[i:i + GCS_COMPOSE_MAX_SOURCES - 1])
+      for part_blob in part_blobs:
+        part_blob.delete()
+      merged_blob.reload()
       logging.info('save the merged file from chunks in gcs')
-      file_io = io.BytesIO(merged_file)
-      blob.upload_from_file(file_io)
-      # pdf_reader = PdfReader(file_io)
-      file_size = len(merged_file)
-      # total_pages = len(pdf_reader.pages)
-      
-      return file_size
+      return merged_blob.size
   except Exception as e:
     raise Exception('Error in while merge the files chunks on GCS')
   
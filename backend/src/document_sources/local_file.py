@@ -1,11 +1,17 @@
 import logging
+import multiprocessing
+import os
 import shutil
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from tempfile import NamedTemporaryFile
 # from langchain_community.document_loaders import PyPDFLoader
 from langchain_community.document_loaders import PyMuPDFLoader
 from langchain_community.document_loaders import UnstructuredFileLoader
 from langchain_core.documents import Document
+import fitz
 
 # def get_documents_from_file_by_bytes(file):
 #     file_name = file.filename
@@ -26,17 +32,95 @@ def load_document_content(file_path):
         print("in else")
         return UnstructuredFileLoader(file_path, encoding="utf-8", mode="elements")
     
+def get_total_pages(file_path):
+    """Page count from the PDF page tree, without extracting any text; 'N/A' for other file types."""
+    if Path(file_path).suffix.lower() != '.pdf':
+        return 'N/A'
+    try:
+        with fitz.open(file_path) as pdf:
+            return pdf.page_count
+    except Exception as e:
+        raise Exception('Error while reading the file content or metadata')
+
+_pdf_parse_executor = None
+_pdf_parse_executor_lock = threading.Lock()
+
+def get_pdf_parse_executor(workers):
+    """Process pool shared by every PDF being parsed, created on first use."""
+    global _pdf_parse_executor
+    with _pdf_parse_executor_lock:
+        if _pdf_parse_executor is None:
+            # spawn, as forking the threaded API server can copy locks held by other threads
+            _pdf_parse_executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return _pdf_parse_executor
+
+def extract_pdf_page_range(file_path, start_page, end_page):
+    # Runs in a worker process; each worker opens its own handle on the file
+    with fitz.open(file_path) as pdf:
+        return [pdf[page_number].get_text() for page_number in range(start_page, end_page)]
+
+def get_pdf_pages(file_path):
+    """
+    Yield the pages of a PDF in order as Documents, with the metadata PyMuPDFLoader sets.
+
+    Page ranges of PDF_PARSE_PAGES_PER_TASK pages are parsed by PDF_PARSE_WORKERS processes,
+    at most two ranges per worker ahead of the consumer, so chunking of the first pages
+    starts while the rest of the file is still being parsed.
+    """
+    file_path = str(file_path)
+    workers = int(os.environ.get('PDF_PARSE_WORKERS', min(4, os.cpu_count() or 1)))
+    pages_per_task = int(os.environ.get('PDF_PARSE_PAGES_PER_TASK', 16))
+    with fitz.open(file_path) as pdf:
+        total_pages = pdf.page_count
+    page_ranges = iter([(start_page, min(start_page + pages_per_task, total_pages))
+                        for start_page in range(0, total_pages, pages_per_task)])
+    if workers <= 1 or total_pages <= pages_per_task:
+        parsed_ranges = ((start_page, extract_pdf_page_range(file_path, start_page, end_page))
+                         for start_page, end_page in page_ranges)
+    else:
+        parsed_ranges = iter_parsed_page_ranges(get_pdf_parse_executor(workers), file_path, page_ranges, workers * 2)
+    for start_page, texts in parsed_ranges:
+        for page_offset, text in enumerate(texts):
+            yield Document(page_content=text, metadata={'source': file_path, 'file_path': file_path,
+                                                        'page': start_page + page_offset, 'total_pages': total_pages})
+
+def iter_parsed_page_ranges(executor, file_path, page_ranges, max_pending):
+    pending = deque()
+    for start_page, end_page in page_ranges:
+        pending.append((start_page, executor.submit(extract_pdf_page_range, file_path, start_page, end_page)))
+        if len(pending) >= max_pending:
+            start_page, future = pending.popleft()
+            yield start_page, future.result()
+    while pending:
+        start_page, future = pending.popleft()
+        yield start_page, future.result()
+
+def iter_pdf_pages(first_page, pages):
+    """The pages of get_pdf_pages, with parsing errors of later pages reported like those of the first."""
+    if first_page is None:
+        return
+    yield first_page
+    try:
+        yield from pages
+    except Exception as e:
+        logging.exception(f'Error while parsing PDF pages: {e}')
+        raise Exception('Error while reading the file content or metadata')
+
 def get_documents_from_file_by_path(file_path,file_name):
+    """PDF pages are returned as a generator that parses them on demand, see get_pdf_pages."""
     file_path = Path(file_path)
     if file_path.exists():
         logging.info(f'file {file_name} processing')
         # loader = PyPDFLoader(str(file_path))
         file_extension = file_path.suffix.lower()
         try:
-            loader = load_document_content(file_path)
             if file_extension == ".pdf":
-                pages = loader.load()
+                pdf_pages = get_pdf_pages(file_path)
+                # the first page range is parsed here so an unreadable PDF fails before the pages are returned
+                first_page = next(pdf_pages, None)
+                pages = iter_pdf_pages(first_page, pdf_pages)
             else:
+                loader = load_document_content(file_path)
                 unstructured_pages = loader.load()   
                 pages= get_pages_with_page_numbers(unstructured_pages)      
         except Exception as e:
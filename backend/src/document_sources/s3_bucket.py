@@ -14,15 +14,16 @@ def get_s3_files_info(s3_url,aws_access_key_id=None,aws_secret_access_key=None):
         # Connect to S3
         s3 = boto3.client('s3',aws_access_key_id=aws_access_key_id,aws_secret_access_key=aws_secret_access_key)
 
-        # List objects in the specified directory
-        response = s3.list_objects_v2(Bucket=bucket_name, Prefix=directory)
+        # List objects in the specified directory, list_objects_v2 returns at most 1000 per page
+        pages = s3.get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=directory)
+        objects = [obj for page in pages for obj in page.get('Contents', [])]
       except Exception as e:
          raise Exception("Invalid AWS credentials")
       
       files_info = []
 
       # Check each object for file size and type
-      for obj in response.get('Contents', []):
+      for obj in objects:
           file_key = obj['Key']
           file_name = os.path.basename(file_key)
           logging.info(f'file_name : {file_name}  and file key : {file_key}')
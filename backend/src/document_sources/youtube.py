@@ -1,15 +1,37 @@
-from langchain_community.document_loaders import YoutubeLoader
+from langchain_core.documents import Document
 from pytube import YouTube
-from youtube_transcript_api import YouTubeTranscriptApi 
+from youtube_transcript_api import YouTubeTranscriptApi, NoTranscriptFound
+import bisect
 import logging
+from functools import lru_cache
 from urllib.parse import urlparse,parse_qs
 from difflib import SequenceMatcher
 from datetime import timedelta
+from src.shared.constants import PAGE_TEXT_TRANSLATION
 
-def get_youtube_transcript(youtube_id):
+TRANSCRIPT_LANGUAGES = ["en-US", "en-gb", "en-ca", "en-au","zh-CN", "zh-Hans", "zh-TW", "fr-FR","de-DE","it-IT","ja-JP","pt-BR","ru-RU","es-ES"]
+# transcript segments searched on each side of the expected position when a chunk is not found verbatim
+FUZZY_ALIGNMENT_WINDOW = 40
+
+@lru_cache(maxsize=32)
+def get_youtube_transcript(youtube_id, translate_to_english=False):
+  """
+  Transcript segments of a video in the first available TRANSCRIPT_LANGUAGES language. With
+  translate_to_english, as YoutubeLoader(translation="en") loaded it, a transcript in another
+  language is translated when YouTube can. Cached so loading and timestamp alignment fetch it once.
+  """
   try:
-    transcript = YouTubeTranscriptApi.get_transcript(youtube_id)
-    return transcript
+    transcript_list = YouTubeTranscriptApi.list_transcripts(youtube_id)
+    try:
+      transcript = transcript_list.find_transcript(TRANSCRIPT_LANGUAGES)
+    except NoTranscriptFound:
+      transcript = transcript_list.find_transcript(["en"])
+    if translate_to_english and not transcript.language_code.startswith("en") and transcript.is_translatable:
+      try:
+        return tuple(transcript.translate("en").fetch())
+      except Exception as e:
+        logging.info(f"Youtube transcript of {youtube_id} could not be translated, using {transcript.language_code}: {e}")
+    return tuple(transcript.fetch())
   except Exception as e:
     message = f"Youtube transcript is not available for youtube Id: {youtube_id}"
     raise Exception(message)
@@ -38,42 +60,103 @@ def create_youtube_url(url):
       return you_tu_url + pth[-1].strip()
 
   
+def get_youtube_id(url):
+    u_pars = urlparse(url)
+    quer_v = parse_qs(u_pars.query).get('v')
+    if quer_v:
+      return quer_v[0].strip()
+    return u_pars.path.split('/')[-1].strip()
+
 def get_documents_from_youtube(url):
     try:
-      youtube_loader = YoutubeLoader.from_youtube_url(url, 
-                                                      language=["en-US", "en-gb", "en-ca", "en-au","zh-CN", "zh-Hans", "zh-TW", "fr-FR","de-DE","it-IT","ja-JP","pt-BR","ru-RU","es-ES"],
-                                                      translation = "en",
-                                                      add_video_info=True)
-      pages = youtube_loader.load()
-      file_name = YouTube(url).title
-      return file_name, pages
+      youtube_id = get_youtube_id(url)
+      transcript = get_youtube_transcript(youtube_id, translate_to_english=True)
+      video = YouTube(url)
+      # the page and metadata YoutubeLoader(add_video_info=True) produced, without fetching the transcript again
+      metadata = {"source": youtube_id, "title": video.title, "description": video.description,
+                  "view_count": video.views, "thumbnail_url": video.thumbnail_url,
+                  "publish_date": str(video.publish_date), "length": video.length, "author": video.author}
+      page_content = " ".join(segment["text"].strip(" ") for segment in transcript)
+      file_name = video.title
+      return file_name, [Document(page_content=page_content, metadata=metadata)]
     except Exception as e:
       error_message = str(e)
       logging.exception(f'Exception in reading transcript from youtube:{error_message}')
       raise Exception(error_message)  
 
+class TranscriptOffsetIndex:
+  """
+  The transcript text as it is chunked (segments joined by spaces and cleaned like a page)
+  with the character offset at which every segment starts.
+  """
+  def __init__(self, transcript):
+    self.segments = transcript
+    self.segment_offsets = []
+    texts = []
+    offset = 0
+    for segment in transcript:
+      text = segment['text'].strip(" ").translate(PAGE_TEXT_TRANSLATION)
+      self.segment_offsets.append(offset)
+      texts.append(text)
+      offset += len(text) + 1
+    self.text = " ".join(texts)
+
+  def segment_index_at(self, offset):
+    return max(0, bisect.bisect_right(self.segment_offsets, offset) - 1)
+
+  def find(self, chunk_text, cursor):
+    """Offset of chunk_text, looked up from cursor first since chunks follow the transcript; -1 if absent."""
+    offset = self.text.find(chunk_text, cursor)
+    if offset == -1:
+      offset = self.text.find(chunk_text)
+    return offset
+
+def get_fuzzy_segment_indexes(index, chunk_text, expected_segment_index):
+  # Fallback for chunks that are not a verbatim part of the transcript, limited to nearby segments
+  first = max(0, expected_segment_index - FUZZY_ALIGNMENT_WINDOW)
+  last = min(len(index.segments), expected_segment_index + FUZZY_ALIGNMENT_WINDOW + 1)
+  start_content = chunk_text[:40]
+  end_content = chunk_text[-40:]
+  start_segment_index = end_segment_index = expected_segment_index
+  max_start_similarity = max_end_similarity = 0
+  for segment_index in range(first, last):
+    text = index.segments[segment_index]['text']
+    start_similarity = SequenceMatcher(None, start_content, text).ratio()
+    end_similarity = SequenceMatcher(None, end_content, text).ratio()
+    if start_similarity > max_start_similarity:
+      max_start_similarity, start_segment_index = start_similarity, segment_index
+    if end_similarity > max_end_similarity:
+      max_end_similarity, end_segment_index = end_similarity, segment_index
+  return start_segment_index, end_segment_index
+
 def get_chunks_with_timestamps(chunks, youtube_id):
-  max_start_similarity=0
-  max_end_similarity=0
-  transcript = get_youtube_transcript(youtube_id)
+  """
+  Set start_time and end_time of every chunk from the transcript segments it spans. Chunks
+  are located in the transcript text by offset and mapped to segments by binary search;
+  only chunks that are not found verbatim are matched by similarity.
+  """
+  transcript = get_youtube_transcript(youtube_id, translate_to_english=True)
+  if not transcript:
+    return chunks
+  index = TranscriptOffsetIndex(transcript)
+  cursor = 0
+  fuzzy_count = 0
   for chunk in chunks:
-    start_content = chunk.page_content[:40]
-    end_content = chunk.page_content[-40:]
-    
-    for segment in transcript:
-        start_similarity = SequenceMatcher(None, start_content, segment['text'])
-        end_similarity = SequenceMatcher(None, end_content, segment['text'])
-        
-        if start_similarity.ratio() > max_start_similarity:
-            max_start_similarity = start_similarity.ratio()
-            start_time = segment['start']
-            
-        if end_similarity.ratio() > max_end_similarity:
-            max_end_similarity = end_similarity.ratio()
-            end_time = segment['start']+segment['duration'] 
-                   
+    offset = index.find(chunk.page_content, cursor)
+    if offset == -1:
+      fuzzy_count += 1
+      start_segment_index, end_segment_index = get_fuzzy_segment_indexes(index, chunk.page_content, index.segment_index_at(cursor))
+    else:
+      # chunks overlap, so the next chunk starts after this chunk's start rather than its end
+      cursor = offset + 1
+      start_segment_index = index.segment_index_at(offset)
+      end_segment_index = index.segment_index_at(offset + max(len(chunk.page_content) - 1, 0))
+    start_segment = transcript[start_segment_index]
+    end_segment = transcript[end_segment_index]
+    start_time = start_segment['start']
+    end_time = end_segment['start'] + end_segment['duration']
     chunk.metadata['start_time'] = str(timedelta(seconds = start_time)).split('.')[0]
     chunk.metadata['end_time'] = str(timedelta(seconds = end_time)).split('.')[0]
-    max_start_similarity=0
-    max_end_similarity=0
-  return chunks
\ No newline at end of file
+  if fuzzy_count:
+    logging.info(f'{fuzzy_count} of {len(chunks)} chunks of youtube video {youtube_id} aligned by similarity')
+  return chunks
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+from langchain_core.documents import Document
+from langchain_community.graphs.graph_document import GraphDocument, Node, Relationship
+
+DEFAULT_CACHE_PATH = os.path.join(Path(__file__).resolve().parents[1], "extraction_cache", "graph_documents.db")
+
+CREATE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS extraction_cache (
+        cache_key TEXT PRIMARY KEY,
+        graph_document TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        last_accessed REAL NOT NULL
+    )
+"""
+CREATE_INDEX_QUERY = "CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_accessed ON extraction_cache (last_accessed)"
+
+
+def is_extraction_cache_enabled():
+    return os.environ.get("EXTRACTION_CACHE_ENABLED", "False").lower() in ("true", "1", "yes")
+
+
+def get_llm_model_id(llm):
+    """Identify the concrete model behind a chat model instance, e.g. 'ChatOpenAI:gpt-4o-mini'."""
+    for attribute in ("model_name", "model_id", "model", "deployment_name"):
+        value = getattr(llm, attribute, None)
+        if isinstance(value, str) and value:
+            return f"{llm.get_name()}:{value}"
+    return llm.get_name()
+
+
+def get_prompt_fingerprint(prompt):
+    """SHA1 of the rendered prompt messages, so that any prompt edit invalidates cached extractions."""
+    rendered_prompt = prompt.format(input="{input}")
+    return hashlib.sha1(rendered_prompt.encode()).hexdigest()
+
+
+def create_extraction_cache_key(text: str, model_id: str, allowedNodes: List[str], allowedRelationship: List[str], prompt_fingerprint: str):
+    key_parts = json.dumps([model_id, list(allowedNodes or []), list(allowedRelationship or []), prompt_fingerprint])
+    content_sha1 = hashlib.sha1(text.encode())
+    content_sha1.update(key_parts.encode())
+    return content_sha1.hexdigest()
+
+
+def serialize_graph_document(graph_document: GraphDocument) -> str:
+    def node_to_dict(node: Node):
+        return {"id": node.id, "type": node.type, "properties": node.properties}
+
+    return json.dumps({
+        "nodes": [node_to_dict(node) for node in graph_document.nodes],
+        "relationships": [
+            {
+                "source": node_to_dict(relationship.source),
+                "target": node_to_dict(relationship.target),
+                "type": relationship.type,
+                "properties": relationship.properties,
+            }
+            for relationship in graph_document.relationships
+        ],
+    }, default=str)
+
+
+def deserialize_graph_document(serialized: str, source: Document) -> GraphDocument:
+    """Rebuild a GraphDocument; the source is always the current chunk so combined_chunk_ids stay correct."""
+    data = json.loads(serialized)
+    nodes = [Node(**node) for node in data["nodes"]]
+    relationships = [
+        Relationship(
+            source=Node(**relationship["source"]),
+            target=Node(**relationship["target"]),
+            type=relationship["type"],
+            properties=relationship["properties"],
+        )
+        for relationship in data["relationships"]
+    ]
+    return GraphDocument(nodes=nodes, relationships=relationships, source=source)
+
+
+class ExtractionCache:
+    """
+    Persistent, content-addressed store of LLM graph extractions.
+
+    Entries are keyed by the SHA1 of the combined chunk text together with the model,
+    the allowed schema and the prompt fingerprint. Entries older than max_age_seconds
+    are dropped, and the least recently used entries are evicted once the cache grows
+    beyond max_entries or max_size_bytes.
+    """
+
+    def __init__(self, cache_path: str, max_entries: int, max_size_bytes: int, max_age_seconds: float):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.max_size_bytes = max_size_bytes
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(CREATE_TABLE_QUERY)
+            connection.execute(CREATE_INDEX_QUERY)
+
+    def _connect(self):
+        return sqlite3.connect(self.cache_path, timeout=30)
+
+    def get(self, cache_key: str) -> Optional[str]:
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT graph_document, created_at FROM extraction_cache WHERE cache_key = ?", (cache_key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.max_age_seconds and now - row[1] > self.max_age_seconds:
+                connection.execute("DELETE FROM extraction_cache WHERE cache_key = ?", (cache_key,))
+                return None
+            connection.execute("UPDATE extraction_cache SET last_accessed = ? WHERE cache_key = ?", (now, cache_key))
+        return row[0]
+
+    def put(self, cache_key: str, serialized_graph_document: str):
+        now = time.time()
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                """INSERT OR REPLACE INTO extraction_cache (cache_key, graph_document, size, created_at, last_accessed)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (cache_key, serialized_graph_document, len(serialized_graph_document), now, now),
+            )
+            self._evict(connection, now)
+
+    def _evict(self, connection, now):
+        if self.max_age_seconds:
+            connection.execute("DELETE FROM extraction_cache WHERE created_at < ?", (now - self.max_age_seconds,))
+        entries, total_size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extraction_cache").fetchone()
+        if entries <= self.max_entries and total_size <= self.max_size_bytes:
+            return
+        evicted = 0
+        rows = connection.execute("SELECT cache_key, size FROM extraction_cache ORDER BY last_accessed ASC").fetchall()
+        for cache_key, size in rows:
+            if entries <= self.max_entries and total_size <= self.max_size_bytes:
+                break
+            connection.execute("DELETE FROM extraction_cache WHERE cache_key = ?", (cache_key,))
+            entries -= 1
+            total_size -= size
+            evicted += 1
+        logging.info(f"Extraction cache evicted {evicted} entries")
+
+    def clear(self):
+        with self._lock, self._connect() as connection:
+            connection.execute("DELETE FROM extraction_cache")
+
+
+_extraction_cache = None
+_extraction_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    """Return the process-wide extraction cache, or None when EXTRACTION_CACHE_ENABLED is not set."""
+    global _extraction_cache
+    if not is_extraction_cache_enabled():
+        return None
+    with _extraction_cache_lock:
+        if _extraction_cache is None:
+            _extraction_cache = ExtractionCache(
+                cache_path=os.environ.get("EXTRACTION_CACHE_PATH") or DEFAULT_CACHE_PATH,
+                max_entries=int(os.environ.get("EXTRACTION_CACHE_MAX_ENTRIES", 100000)),
+                max_size_bytes=int(float(os.environ.get("EXTRACTION_CACHE_MAX_SIZE_MB", 512)) * 1024 * 1024),
+                max_age_seconds=float(os.environ.get("EXTRACTION_CACHE_MAX_AGE_DAYS", 30)) * 24 * 3600,
+            )
+            logging.info(f"Extraction cache enabled at {_extraction_cache.cache_path}")
+    return _extraction_cache
@@ -12,12 +12,25 @@ import google.auth
 from typing import List
 from langchain_core.documents import Document
 import vertexai
-from src.llm import get_graph_document_list, get_combined_chunks, get_llm
+from functools import lru_cache
+from src.llm import get_graph_document_list, get_combined_chunks, get_llm, get_prompt_token_count, get_google_credentials
 
 load_dotenv()
 logging.basicConfig(format='%(asctime)s - %(message)s',level='DEBUG')
 
 
+@lru_cache(maxsize=1)
+def init_vertexai():
+    location = "us-central1"
+    #project_id = "llm-experiments-387609"                            
+    credentials, project_id = get_google_credentials()
+    if hasattr(credentials, "service_account_email"):
+      logging.info(credentials.service_account_email)
+    else:
+        logging.info("WARNING: no service account credential. User account credential?")                           
+    vertexai.init(project=project_id, location=location)
+
+
 def get_graph_from_Gemini(model_version,
                             graph: Neo4jGraph,
                             chunkId_chunkDoc_list: List, 
@@ -37,16 +50,10 @@ def get_graph_from_Gemini(model_version,
     logging.info(f"Get graphDocuments from {model_version}")
     futures = []
     graph_document_list = []
-    location = "us-central1"
-    #project_id = "llm-experiments-387609"                            
-    credentials, project_id = google.auth.default()
-    if hasattr(credentials, "service_account_email"):
-      logging.info(credentials.service_account_email)
-    else:
-        logging.info("WARNING: no service account credential. User account credential?")                           
-    vertexai.init(project=project_id, location=location)
+    init_vertexai()
     
-    combined_chunk_document_list = get_combined_chunks(chunkId_chunkDoc_list)
+    prompt_tokens = get_prompt_token_count(model_version, allowedNodes, allowedRelationship)
+    combined_chunk_document_list = get_combined_chunks(chunkId_chunkDoc_list, model_version, prompt_tokens)
      
     llm,model_name = get_llm(model_version)
     return  get_graph_document_list(llm, combined_chunk_document_list, allowedNodes, allowedRelationship)
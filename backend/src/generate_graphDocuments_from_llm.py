@@ -7,20 +7,26 @@ import logging
 from src.shared.constants import *
 import os
 from src.llm import get_graph_from_llm
+from src.shared.schema_profiles import get_schema_profile_for
 
 logging.basicConfig(format="%(asctime)s - %(message)s", level="INFO")
 
 
 def generate_graphDocuments(model: str, graph: Neo4jGraph, chunkId_chunkDoc_list: List, allowedNodes=None, allowedRelationship=None):
     
+    # Comma separated strings from the request, or the tuples of a schema profile
     if  allowedNodes is None or allowedNodes=="":
         allowedNodes =[]
-    else:
+    elif isinstance(allowedNodes, str):
         allowedNodes = allowedNodes.split(',')    
+    else:
+        allowedNodes = list(allowedNodes)
     if  allowedRelationship is None or allowedRelationship=="":   
         allowedRelationship=[]
-    else:
+    elif isinstance(allowedRelationship, str):
         allowedRelationship = allowedRelationship.split(',')
+    else:
+        allowedRelationship = list(allowedRelationship)
     
     logging.info(f"allowedNodes: {allowedNodes}, allowedRelationship: {allowedRelationship}")
 
@@ -40,5 +46,9 @@ def generate_graphDocuments(model: str, graph: Neo4jGraph, chunkId_chunkDoc_list
     else : 
         graph_documents = get_graph_from_llm(model,chunkId_chunkDoc_list, allowedNodes, allowedRelationship) 
 
+    schema_profile = get_schema_profile_for(allowedNodes, allowedRelationship)
+    if schema_profile is not None:
+        schema_profile.validate_graph_documents(graph_documents)
+
     logging.info(f"graph_documents = {len(graph_documents)}")
     return graph_documents
@@ -6,6 +6,8 @@ from src.shared.common_fn import create_gcs_bucket_folder_name_hashed, delete_up
 from src.document_sources.gcs_bucket import delete_file_from_gcs
 from src.shared.constants import BUCKET_UPLOAD
 from src.entities.source_node import sourceNode
+from src.shared.graph_pool import get_graph_connection_pool
+from src.shared.status_events import document_status_event_bus, get_status_event_key
 import json
 
 class graphDBdataAccess:
@@ -13,15 +15,16 @@ class graphDBdataAccess:
     def __init__(self, graph: Neo4jGraph):
         self.graph = graph
 
-    def update_exception_db(self, file_name, exp_msg):
+    def update_exception_db(self, file_name, exp_msg, job_status="Failed"):
         try:
-            job_status = "Failed"
             result = self.get_current_status_document_node(file_name)
             is_cancelled_status = result[0]['is_cancelled']
             if bool(is_cancelled_status) == True:
                 job_status = 'Cancelled'
             self.graph.query("""MERGE(d:Document {fileName :$fName}) SET d.status = $status, d.errorMessage = $error_msg""",
                             {"fName":file_name, "status":job_status, "error_msg":exp_msg})
+            self.publish_status_event(file_name, {"status":job_status})
+            return job_status
         except Exception as e:
             error_message = str(e)
             logging.error(f"Error in updating document node status as failed: {error_message}")
@@ -98,11 +101,28 @@ class graphDBdataAccess:
             query = "MERGE(d:Document {fileName :$props.fileName}) SET d += $props"
             logging.info("Update source node properties")
             self.graph.query(query,param)
+            self.publish_status_event(obj_source_node.file_name, params)
         except Exception as e:
             error_message = str(e)
             self.update_exception_db(self.file_name,error_message)
             raise Exception(error_message)
     
+    def set_document_metadata(self, file_name, metadata):
+        """Store caller metadata (e.g. email headers) as Document properties; the node's own properties are kept."""
+        properties = {key: value if isinstance(value, (str, int, float, bool)) else json.dumps(value)
+                      for key, value in metadata.items() if value is not None}
+        query = """MATCH (d:Document {fileName: $fName})
+                   SET d += apoc.map.removeKeys($props, keys(properties(d)))"""
+        self.graph.query(query, {"fName": file_name, "props": properties})
+
+    def publish_status_event(self, file_name, event):
+        """Push Document progress to SSE subscribers of this database; a no-op for connections outside the pool."""
+        connection_key = get_graph_connection_pool().get_connection_key(self.graph)
+        if connection_key is None:
+            return
+        uri, database = connection_key
+        document_status_event_bus.publish(get_status_event_key(uri, database, file_name), event)
+
     def get_source_list(self):
         """
         Args:
@@ -167,6 +187,12 @@ class graphDBdataAccess:
         param = {"file_name" : file_name}
         return self.execute_query(query, param)
     
+    def get_document_statuses(self, file_names):
+        """Status of every listed document that has a Document node, keyed by file name."""
+        query = "MATCH (d:Document) WHERE d.fileName IN $file_names RETURN d.fileName AS fileName, d.status AS status"
+        result = self.execute_query(query, {"file_names": file_names})
+        return {row['fileName']: row['status'] for row in result}
+
     def delete_file_from_graph(self, filenames, source_types, deleteEntities:str, merged_dir:str, uri):
         # filename_list = filenames.split(',')
         filename_list= list(map(str.strip, json.loads(filenames)))
@@ -1,6 +1,6 @@
 import logging
 from neo4j import time 
-from neo4j import GraphDatabase
+from src.shared.graph_pool import borrowed_driver
 import os
 import json
 # from neo4j.debug import watch
@@ -45,29 +45,6 @@ QUERY_WITHOUT_DOCUMENT = """
     RETURN nodes, rels
 """
 
-def get_graphDB_driver(uri, username, password):
-    """
-    Creates and returns a Neo4j database driver instance configured with the provided credentials.
-
-    Returns:
-    Neo4j.Driver: A driver object for interacting with the Neo4j database.
-
-    """
-    try:
-        logging.info(f"Attempting to connect to the Neo4j database at {uri}")
-        enable_user_agent = os.environ.get("ENABLE_USER_AGENT", "False").lower() in ("true", "1", "yes")
-        if enable_user_agent:
-            driver = GraphDatabase.driver(uri, auth=(username, password), user_agent=os.environ.get('NEO4J_USER_AGENT'))
-        else:
-            driver = GraphDatabase.driver(uri, auth=(username, password))
-        logging.info("Connection successful")
-        return driver
-    except Exception as e:
-        error_message = f"graph_query module: Failed to connect to the database at {uri}."
-        logging.error(error_message, exc_info=True)
-        # raise Exception(error_message) from e 
-
-
 def get_cypher_query(query_map, query_type, document_names):
     """
     Generates a Cypher query based on the provided parameters using global templates.
@@ -255,30 +232,29 @@ def get_graph_results(uri, username, password,document_names):
     """
     try:
         logging.info(f"Starting graph query process")
-        driver = get_graphDB_driver(uri, username, password)  
-        document_names= list(map(str.strip, json.loads(document_names)))
-        query_type = "docChunkEntities"
-        query = get_cypher_query(QUERY_MAP, query_type, document_names)
-        records, summary , keys = execute_query(driver, query, document_names)
-        document_nodes = extract_node_elements(records)
-        document_relationships = extract_relationships(records)
-
-        print(query)
-
-        logging.info(f"no of nodes : {len(document_nodes)}")
-        logging.info(f"no of relations : {len(document_relationships)}")
-        result = {
-            "nodes": document_nodes,
-            "relationships": document_relationships
-        }
-
-        logging.info(f"Query process completed successfully")
-        return result
+        with borrowed_driver(uri, username, password) as driver:
+            document_names= list(map(str.strip, json.loads(document_names)))
+            query_type = "docChunkEntities"
+            query = get_cypher_query(QUERY_MAP, query_type, document_names)
+            records, summary , keys = execute_query(driver, query, document_names)
+            document_nodes = extract_node_elements(records)
+            document_relationships = extract_relationships(records)
+
+            print(query)
+
+            logging.info(f"no of nodes : {len(document_nodes)}")
+            logging.info(f"no of relations : {len(document_relationships)}")
+            result = {
+                "nodes": document_nodes,
+                "relationships": document_relationships
+            }
+
+            logging.info(f"Query process completed successfully")
+            return result
     except Exception as e:
         logging.error(f"graph_query module: An error occurred in get_graph_results. Error: {str(e)}")
         raise Exception(f"graph_query module: An error occurred in get_graph_results. Please check the logs for more details.") from e
     finally:
-        logging.info("Closing connection for graph_query api")
-        driver.close()
+        logging.info("Released connection for graph_query api")
 
 
@@ -7,7 +7,7 @@ from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from langchain_experimental.graph_transformers import LLMGraphTransformer
 from langchain_core.documents import Document
-from src.llm import get_combined_chunks, get_llm
+from src.llm import get_combined_chunks, get_llm, get_prompt_token_count
 
 load_dotenv()
 logging.basicConfig(format='%(asctime)s - %(message)s',level='INFO')
@@ -31,7 +31,8 @@ def get_graph_from_Groq_Llama3(model_version,
     logging.info(f"Get graphDocuments from {model_version}")
     futures = []
     graph_document_list = []
-    combined_chunk_document_list = get_combined_chunks(chunkId_chunkDoc_list)
+    prompt_tokens = get_prompt_token_count(model_version, allowedNodes, allowedRelationship)
+    combined_chunk_document_list = get_combined_chunks(chunkId_chunkDoc_list, model_version, prompt_tokens)
     #api_key = os.environ.get('GROQ_API_KEY') 
     llm,model_name = get_llm(model_version)
     llm_transformer = LLMGraphTransformer(llm=llm, node_properties=["description"], allowed_nodes=allowedNodes, allowed_relationships=allowedRelationship)
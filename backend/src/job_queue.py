@@ -0,0 +1,318 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Optional
+
+DEFAULT_JOB_QUEUE_PATH = os.path.join(Path(__file__).resolve().parents[1], "job_queue", "extract_jobs.db")
+
+# Never written to disk; only the names of the ones a job was given are stored, in secret_params
+SECRET_JOB_PARAMS = ("password", "aws_secret_access_key", "access_token")
+
+CREATE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS extract_jobs (
+        job_id TEXT PRIMARY KEY,
+        tenant TEXT NOT NULL,
+        file_name TEXT,
+        priority INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        params TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        max_attempts INTEGER NOT NULL,
+        next_run_at REAL NOT NULL,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        result TEXT,
+        error TEXT,
+        submitted_by TEXT,
+        owner TEXT,
+        lease_expires_at REAL
+    )
+"""
+CREATE_INDEX_QUERY = "CREATE INDEX IF NOT EXISTS idx_extract_jobs_status ON extract_jobs (status, priority, created_at)"
+# One row per process serving the queue, so jobs holding the secrets of a live process wait for it
+CREATE_WORKERS_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS extract_job_workers (
+        owner TEXT PRIMARY KEY,
+        heartbeat_at REAL NOT NULL
+    )
+"""
+# Columns added after the first release of the queue
+ADDED_COLUMNS = (("submitted_by", "TEXT"), ("owner", "TEXT"), ("lease_expires_at", "REAL"))
+
+
+class ResubmitRequired(Exception):
+    """Raised by a runner for a job that cannot run without secrets lost by a restart; it is not retried."""
+
+
+def is_job_queue_enabled():
+    return os.environ.get("EXTRACT_JOB_QUEUE_ENABLED", "False").lower() in ("true", "1", "yes")
+
+
+def get_job_tenant(uri, database):
+    return f"{uri}|{database or ''}"
+
+
+class ExtractJobQueue:
+    """
+    Durable queue of /extract requests served by a pool of worker threads.
+
+    Jobs are stored in SQLite so queued and interrupted jobs survive a restart. Workers
+    pick the highest priority job that is due, skipping tenants (uri, database) that
+    already run max_jobs_per_tenant jobs. A failed job is retried with exponential
+    backoff until max_attempts is reached. Running jobs are cancelled through the
+    Document is_cancelled flag like any other extraction; queued jobs are cancelled here.
+
+    Every gunicorn worker process serves the same file. Jobs are claimed in a write
+    transaction, and a running job holds a lease its process renews every
+    lease_seconds / 3; only jobs whose lease expired (their process died) are queued
+    again. Secrets stay in the memory of the process that received the request, so a
+    job with secrets is only claimed by that process while it is alive.
+    """
+
+    def __init__(self, queue_path: str, runner: Callable, workers: int, max_jobs_per_tenant: int,
+                 max_attempts: int, retry_backoff_seconds: float, lease_seconds: float = 60):
+        self.queue_path = queue_path
+        self.runner = runner
+        self.workers = workers
+        self.max_jobs_per_tenant = max_jobs_per_tenant
+        self.max_attempts = max_attempts
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._secrets = {}
+        self._lock = threading.Lock()
+        self._job_available = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._threads = []
+        os.makedirs(os.path.dirname(queue_path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(CREATE_TABLE_QUERY)
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(extract_jobs)")}
+            for column, column_type in ADDED_COLUMNS:
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE extract_jobs ADD COLUMN {column} {column_type}")
+            connection.execute(CREATE_INDEX_QUERY)
+            connection.execute(CREATE_WORKERS_TABLE_QUERY)
+        self._heartbeat()
+
+    def _connect(self):
+        return sqlite3.connect(self.queue_path, timeout=30)
+
+    def _heartbeat(self):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO extract_job_workers (owner, heartbeat_at) VALUES (?, ?)",
+                               (self.owner, now))
+            connection.execute("UPDATE extract_jobs SET lease_expires_at = ? WHERE owner = ? AND status = 'Running'",
+                               (now + self.lease_seconds, self.owner))
+
+    def _renew_leases(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self._heartbeat()
+            except Exception as e:
+                logging.error(f"Error renewing extract job leases: {e}")
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"extract-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._renew_leases, name="extract-lease", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        logging.info(f"Started {self.workers} extract workers in process {self.owner}")
+
+    def stop(self):
+        self._stop.set()
+        with self._job_available:
+            self._job_available.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        with self._connect() as connection:
+            connection.execute("DELETE FROM extract_job_workers WHERE owner = ?", (self.owner,))
+
+    def submit(self, params: dict, priority: int = 0) -> str:
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        stored_params = {name: value for name, value in params.items() if name not in SECRET_JOB_PARAMS}
+        stored_params["secret_params"] = [name for name in SECRET_JOB_PARAMS if params.get(name)]
+        with self._job_available:
+            self._secrets[job_id] = {name: params.get(name) for name in SECRET_JOB_PARAMS}
+            with self._connect() as connection:
+                connection.execute(
+                    """INSERT INTO extract_jobs (job_id, tenant, file_name, priority, status, params, attempts,
+                       max_attempts, next_run_at, created_at, updated_at, submitted_by)
+                       VALUES (?, ?, ?, ?, 'Queued', ?, 0, ?, ?, ?, ?, ?)""",
+                    (job_id, get_job_tenant(params.get("uri"), params.get("database")), params.get("file_name"),
+                     priority, json.dumps(stored_params), self.max_attempts, now, now, now, self.owner),
+                )
+            self._job_available.notify()
+        logging.info(f"Queued extract job {job_id} for file {params.get('file_name')} with priority {priority}")
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        with self._connect() as connection:
+            connection.row_factory = sqlite3.Row
+            row = connection.execute(
+                """SELECT job_id, file_name, priority, status, attempts, max_attempts, created_at, updated_at, result, error
+                   FROM extract_jobs WHERE job_id = ?""", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def cancel_queued_jobs(self, uri, database, file_names) -> int:
+        with self._lock, self._connect() as connection:
+            cancelled = 0
+            for file_name in file_names:
+                cancelled += connection.execute(
+                    """UPDATE extract_jobs SET status = 'Cancelled', updated_at = ?
+                       WHERE tenant = ? AND file_name = ? AND status = 'Queued'""",
+                    (time.time(), get_job_tenant(uri, database), file_name),
+                ).rowcount
+        return cancelled
+
+    def _claim_next_job(self):
+        now = time.time()
+        connection = self._connect()
+        connection.isolation_level = None
+        try:
+            # the write lock is taken before reading, so two processes cannot claim the same job
+            connection.execute("BEGIN IMMEDIATE")
+            # jobs of a process that stopped renewing its leases are picked up again
+            recovered = connection.execute(
+                """UPDATE extract_jobs SET status = 'Queued', owner = NULL, updated_at = ?
+                   WHERE status = 'Running' AND (lease_expires_at IS NULL OR lease_expires_at < ?)""", (now, now)
+            ).rowcount
+            if recovered:
+                logging.info(f"Re-queued {recovered} extract jobs whose worker process stopped")
+            live_owners = {row[0] for row in connection.execute(
+                "SELECT owner FROM extract_job_workers WHERE heartbeat_at >= ?", (now - self.lease_seconds,)
+            )}
+            running = dict(connection.execute(
+                "SELECT tenant, COUNT(*) FROM extract_jobs WHERE status = 'Running' GROUP BY tenant"
+            ).fetchall())
+            rows = connection.execute(
+                """SELECT job_id, tenant, params, submitted_by FROM extract_jobs WHERE status = 'Queued' AND next_run_at <= ?
+                   ORDER BY priority DESC, created_at ASC""", (now,)
+            ).fetchall()
+            for job_id, tenant, params, submitted_by in rows:
+                if running.get(tenant, 0) >= self.max_jobs_per_tenant:
+                    continue
+                params = json.loads(params)
+                # the secrets of a job are only in the memory of the process it was submitted to
+                if params.get("secret_params") and submitted_by != self.owner and submitted_by in live_owners:
+                    continue
+                claimed = connection.execute(
+                    """UPDATE extract_jobs SET status = 'Running', attempts = attempts + 1, updated_at = ?, owner = ?,
+                       lease_expires_at = ? WHERE job_id = ? AND status = 'Queued'""",
+                    (now, self.owner, now + self.lease_seconds, job_id),
+                ).rowcount
+                if claimed:
+                    connection.execute("COMMIT")
+                    return job_id, params
+            next_run_at = connection.execute(
+                "SELECT MIN(next_run_at) FROM extract_jobs WHERE status = 'Queued'"
+            ).fetchone()[0]
+            connection.execute("COMMIT")
+        except Exception:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+        return None, next_run_at
+
+    def _work(self):
+        while not self._stop.is_set():
+            with self._job_available:
+                job_id, params_or_next_run = self._claim_next_job()
+                if job_id is None:
+                    # Due jobs that were skipped wait for a tenant slot, which _finish signals; jobs
+                    # submitted to or left by other processes are found within a lease period
+                    wait_seconds = self.lease_seconds if params_or_next_run is None else params_or_next_run - time.time()
+                    timeout = self.lease_seconds if wait_seconds <= 0 else min(wait_seconds, self.lease_seconds)
+                    self._job_available.wait(timeout)
+                    continue
+                params = {**params_or_next_run, **self._secrets.get(job_id, {})}
+            self._run(job_id, params)
+
+    def _run(self, job_id, params):
+        with self._connect() as connection:
+            attempts, max_attempts = connection.execute(
+                "SELECT attempts, max_attempts FROM extract_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        is_final_attempt = attempts >= max_attempts
+        try:
+            logging.info(f"Running extract job {job_id}, attempt {attempts}/{max_attempts}")
+            result = self.runner(params, is_final_attempt)
+            if result is None:
+                raise Exception("Extraction returned no result, the Document may already be in Processing status")
+            status = "Cancelled" if result is not None and result.get("status") == "Cancelled" else "Completed"
+            self._finish(job_id, status, result=json.dumps(result, default=str))
+        except ResubmitRequired as e:
+            logging.error(f"Extract job {job_id} needs to be submitted again: {e}")
+            self._finish(job_id, "Resubmit required", error=str(e))
+        except Exception as e:
+            error_message = str(e)
+            if is_final_attempt:
+                logging.error(f"Extract job {job_id} failed after {attempts} attempts: {error_message}")
+                self._finish(job_id, "Failed", error=error_message)
+            else:
+                delay = self.retry_backoff_seconds * 2 ** (attempts - 1)
+                logging.warning(f"Extract job {job_id} failed, retrying in {delay:.0f}s: {error_message}")
+                with self._job_available:
+                    with self._connect() as connection:
+                        connection.execute(
+                            """UPDATE extract_jobs SET status = 'Queued', next_run_at = ?, updated_at = ?, error = ?,
+                               owner = NULL WHERE job_id = ? AND status = 'Running'""",
+                            (time.time() + delay, time.time(), error_message, job_id),
+                        )
+                    self._job_available.notify_all()
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._job_available:
+            with self._connect() as connection:
+                connection.execute(
+                    "UPDATE extract_jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                    (status, result, error, time.time(), job_id),
+                )
+            self._secrets.pop(job_id, None)
+            # A finished job frees a tenant slot
+            self._job_available.notify_all()
+
+
+_extract_job_queue = None
+_extract_job_queue_lock = threading.Lock()
+
+
+def start_extract_job_queue(runner: Callable) -> ExtractJobQueue:
+    global _extract_job_queue
+    with _extract_job_queue_lock:
+        if _extract_job_queue is None:
+            _extract_job_queue = ExtractJobQueue(
+                queue_path=os.environ.get("EXTRACT_JOB_QUEUE_PATH") or DEFAULT_JOB_QUEUE_PATH,
+                runner=runner,
+                workers=int(os.environ.get("EXTRACT_WORKERS", 2)),
+                max_jobs_per_tenant=int(os.environ.get("EXTRACT_JOBS_PER_TENANT", 1)),
+                max_attempts=int(os.environ.get("EXTRACT_JOB_MAX_ATTEMPTS", 3)),
+                retry_backoff_seconds=float(os.environ.get("EXTRACT_JOB_RETRY_BACKOFF_SECONDS", 30)),
+                lease_seconds=float(os.environ.get("EXTRACT_JOB_LEASE_SECONDS", 60)),
+            )
+            _extract_job_queue.start()
+    return _extract_job_queue
+
+
+def get_extract_job_queue() -> Optional[ExtractJobQueue]:
+    return _extract_job_queue
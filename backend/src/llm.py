@@ -7,6 +7,10 @@ from langchain_groq import ChatGroq
 from langchain_google_vertexai import HarmBlockThreshold, HarmCategory
 from langchain_experimental.graph_transformers.diffbot import DiffbotGraphTransformer
 import concurrent.futures
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+import tiktoken
 from concurrent.futures import ThreadPoolExecutor
 from langchain_experimental.graph_transformers import LLMGraphTransformer
 from langchain_anthropic import ChatAnthropic
@@ -16,16 +20,48 @@ from langchain_community.chat_models import ChatOllama
 from langchain_core.prompts import ChatPromptTemplate
 import boto3
 import google.auth
-from src.shared.constants import MODEL_VERSIONS
+from src.shared.constants import MODEL_VERSIONS, MODEL_CONTEXT_WINDOWS, DEFAULT_CONTEXT_WINDOW, MIN_CHUNK_TOKENS_PER_REQUEST, SENTENCE_ENDINGS
+from src.extraction_cache import (
+    get_extraction_cache,
+    get_llm_model_id,
+    get_prompt_fingerprint,
+    create_extraction_cache_key,
+    serialize_graph_document,
+    deserialize_graph_document,
+)
+from src.llm_concurrency import get_llm_concurrency_limiter, estimate_tokens
+
+
+_llm_cache = {}
+# Least recently used transformers are dropped beyond this many (client, schema) pairs
+LLM_GRAPH_TRANSFORMER_CACHE_SIZE = 64
+_llm_graph_transformer_cache = OrderedDict()
+_llm_cache_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def get_google_credentials():
+    """Application default credentials and project, resolved once per process; the credentials refresh their own tokens."""
+    return google.auth.default()
 
 
 def get_llm(model_version: str):
-    """Retrieve the specified language model based on the model name."""
+    """Retrieve the specified language model based on the model name, reusing the client built for earlier calls."""
+    with _llm_cache_lock:
+        cached_llm = _llm_cache.get(model_version)
+    if cached_llm is not None:
+        return cached_llm
+    cached_llm = create_llm(model_version)
+    with _llm_cache_lock:
+        return _llm_cache.setdefault(model_version, cached_llm)
+
+
+def create_llm(model_version: str):
     env_key = "LLM_MODEL_CONFIG_" + model_version
     env_value = os.environ.get(env_key)
     logging.info("Model: {}".format(env_key))
     if "gemini" in model_version:
-        credentials, project_id = google.auth.default()
+        credentials, project_id = get_google_credentials()
         model_name = MODEL_VERSIONS[model_version]
         llm = ChatVertexAI(
             model_name=model_name,
@@ -102,47 +138,110 @@ def get_llm(model_version: str):
     return llm, model_name
 
 
-def get_combined_chunks(chunkId_chunkDoc_list):
-    chunks_to_combine = int(os.environ.get("NUMBER_OF_CHUNKS_TO_COMBINE"))
-    logging.info(f"Combining {chunks_to_combine} chunks before sending request to LLM")
+@lru_cache(maxsize=None)
+def get_token_encoding(model_version=None):
+    """tiktoken encoding of the model; other providers are measured with cl100k_base, which is close enough to budget."""
+    try:
+        return tiktoken.encoding_for_model(MODEL_VERSIONS.get(model_version, model_version or ""))
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text, model_version=None):
+    return len(get_token_encoding(model_version).encode(text, disallowed_special=()))
+
+
+def get_chunk_token_budget(model_version=None, prompt_tokens=0):
+    """Tokens of chunk text per LLM request: what the context window leaves after the prompt and the answer."""
+    context_window = MODEL_CONTEXT_WINDOWS.get(model_version)
+    if context_window is None:
+        if model_version is not None:
+            logging.warning(f"No context window known for model {model_version}, assuming {DEFAULT_CONTEXT_WINDOW} tokens")
+        context_window = DEFAULT_CONTEXT_WINDOW
+    output_token_reserve = int(os.environ.get("LLM_OUTPUT_TOKEN_RESERVE", 4096))
+    max_chunk_tokens = int(os.environ.get("LLM_MAX_CHUNK_TOKENS_PER_REQUEST", 8000))
+    window_budget = context_window - prompt_tokens - output_token_reserve
+    if window_budget < MIN_CHUNK_TOKENS_PER_REQUEST:
+        # a prompt this large for the window would otherwise send every chunk on its own
+        logging.warning(f"Prompt of {prompt_tokens} tokens leaves {window_budget} chunk tokens in the context window of "
+                        f"{model_version}, sending {MIN_CHUNK_TOKENS_PER_REQUEST} chunk tokens per request")
+        window_budget = MIN_CHUNK_TOKENS_PER_REQUEST
+    return max(1, min(max_chunk_tokens, window_budget))
+
+
+def ends_with_sentence(text):
+    return text.rstrip().endswith(SENTENCE_ENDINGS)
+
+
+def get_combined_chunks(chunkId_chunkDoc_list, model_version=None, prompt_tokens=0):
+    """
+    Pack consecutive chunks into LLM requests of at most the model's chunk token budget.
+
+    When a request is full it is closed after the last chunk that ends a sentence, as long
+    as that keeps it at least half full; the chunks after it open the next request. A chunk
+    larger than the budget is sent on its own.
+    """
+    token_budget = get_chunk_token_budget(model_version, prompt_tokens)
+    logging.info(f"Combining chunks into requests of up to {token_budget} tokens before sending request to LLM")
+    combined_chunk_groups = []
+    current_group = []
+    current_group_tokens = []
+    for document in chunkId_chunkDoc_list:
+        current_group.append(document)
+        current_group_tokens.append(count_tokens(document["chunk_doc"].page_content, model_version))
+        while len(current_group) > 1 and sum(current_group_tokens) > token_budget:
+            split_at = len(current_group) - 1
+            group_tokens = 0
+            for i, tokens in enumerate(current_group_tokens[:-1]):
+                group_tokens += tokens
+                if group_tokens > token_budget:
+                    break
+                if group_tokens >= token_budget / 2 and ends_with_sentence(current_group[i]["chunk_doc"].page_content):
+                    split_at = i + 1
+            combined_chunk_groups.append(current_group[:split_at])
+            current_group = current_group[split_at:]
+            current_group_tokens = current_group_tokens[split_at:]
+    if current_group:
+        combined_chunk_groups.append(current_group)
+
     combined_chunk_document_list = []
-    combined_chunks_page_content = [
-        "".join(
-            document["chunk_doc"].page_content
-            for document in chunkId_chunkDoc_list[i : i + chunks_to_combine]
-        )
-        for i in range(0, len(chunkId_chunkDoc_list), chunks_to_combine)
-    ]
-    combined_chunks_ids = [
-        [
-            document["chunk_id"]
-            for document in chunkId_chunkDoc_list[i : i + chunks_to_combine]
-        ]
-        for i in range(0, len(chunkId_chunkDoc_list), chunks_to_combine)
-    ]
-
-    for i in range(len(combined_chunks_page_content)):
+    for group in combined_chunk_groups:
         combined_chunk_document_list.append(
             Document(
-                page_content=combined_chunks_page_content[i],
-                metadata={"combined_chunk_ids": combined_chunks_ids[i]},
+                page_content="".join(document["chunk_doc"].page_content for document in group),
+                metadata={"combined_chunk_ids": [document["chunk_id"] for document in group]},
             )
         )
+    logging.info(f"Combined {len(chunkId_chunkDoc_list)} chunks into {len(combined_chunk_document_list)} LLM requests")
     return combined_chunk_document_list
 
 
-def get_graph_document_list(
-    llm, combined_chunk_document_list, allowedNodes, allowedRelationship
-):
-    futures = []
-    graph_document_list = []
-    if llm.get_name() == "ChatOllama":
-        node_properties = False
-    else:
-        node_properties = ["description"]
-    llm_transformer = LLMGraphTransformer(
-        llm=llm,
-        prompt=ChatPromptTemplate.from_messages(
+def get_prompt_token_count(model_version, allowedNodes, allowedRelationship):
+    return _get_prompt_token_count(model_version, tuple(allowedNodes or ()), tuple(allowedRelationship or ()))
+
+
+@lru_cache(maxsize=64)
+def _get_prompt_token_count(model_version, allowedNodes: tuple, allowedRelationship: tuple):
+    return count_tokens(build_extraction_prompt(allowedNodes, allowedRelationship).format(input=""), model_version)
+
+
+@lru_cache(maxsize=64)
+def get_estimated_prompt_tokens(allowedNodes: tuple, allowedRelationship: tuple):
+    return estimate_tokens(build_extraction_prompt(allowedNodes, allowedRelationship).format(input=""))
+
+
+def get_extraction_prompt(allowedNodes, allowedRelationship):
+    return build_extraction_prompt(tuple(allowedNodes or ()), tuple(allowedRelationship or ()))
+
+
+@lru_cache(maxsize=64)
+def get_extraction_prompt_fingerprint(allowedNodes: tuple, allowedRelationship: tuple):
+    return get_prompt_fingerprint(build_extraction_prompt(allowedNodes, allowedRelationship))
+
+
+@lru_cache(maxsize=64)
+def build_extraction_prompt(allowedNodes: tuple, allowedRelationship: tuple):
+    return ChatPromptTemplate.from_messages(
         [(
           "system",
           f"""#Knowledge Graph Instructions for GPT-4
@@ -519,19 +618,103 @@ This is your most important instruction, adhere to this rules strictly. Non-comp
           """),
             ("human", "Use the given format to extract information from the following input: {input}"),
             ("human", "Tip: Make sure to answer in the correct format"),
-        ]),
+        ])
+
+
+def get_llm_graph_transformer(llm, allowedNodes, allowedRelationship):
+    """Return the LLMGraphTransformer of this client and allowed schema, built on first use and shared afterwards."""
+    cache_key = (id(llm), tuple(allowedNodes or ()), tuple(allowedRelationship or ()))
+    with _llm_cache_lock:
+        cached_transformer = _llm_graph_transformer_cache.get(cache_key)
+        if cached_transformer is not None:
+            _llm_graph_transformer_cache.move_to_end(cache_key)
+    # The client is kept with its transformer so the id in the key cannot be reused by another client
+    if cached_transformer is not None and cached_transformer[0] is llm:
+        return cached_transformer[1]
+    if llm.get_name() == "ChatOllama":
+        node_properties = False
+    else:
+        node_properties = ["description"]
+    llm_transformer = LLMGraphTransformer(
+        llm=llm,
+        prompt=get_extraction_prompt(allowedNodes, allowedRelationship),
         node_properties=node_properties,
         allowed_nodes=allowedNodes,
         allowed_relationships=allowedRelationship,
     )
-    with ThreadPoolExecutor(max_workers=10) as executor:
+    with _llm_cache_lock:
+        _llm_graph_transformer_cache[cache_key] = (llm, llm_transformer)
+        _llm_graph_transformer_cache.move_to_end(cache_key)
+        while len(_llm_graph_transformer_cache) > LLM_GRAPH_TRANSFORMER_CACHE_SIZE:
+            _llm_graph_transformer_cache.popitem(last=False)
+    return llm_transformer
+
+
+def invalidate_llm_cache(model_version: str = None):
+    """
+    Drop cached clients and transformers, e.g. after rotating an API key or editing
+    LLM_MODEL_CONFIG_*. Without a model version every client and the prompts are dropped.
+    """
+    with _llm_cache_lock:
+        if model_version is None:
+            _llm_cache.clear()
+            _llm_graph_transformer_cache.clear()
+        else:
+            cached_llm = _llm_cache.pop(model_version, None)
+            if cached_llm is not None:
+                for cache_key, (llm, _) in list(_llm_graph_transformer_cache.items()):
+                    if llm is cached_llm[0]:
+                        del _llm_graph_transformer_cache[cache_key]
+    if model_version is None:
+        build_extraction_prompt.cache_clear()
+        get_extraction_prompt_fingerprint.cache_clear()
+        _get_prompt_token_count.cache_clear()
+        get_estimated_prompt_tokens.cache_clear()
+        get_google_credentials.cache_clear()
+    logging.info(f"Invalidated cached LLM clients for {model_version or 'all models'}")
+
+
+def get_graph_document_list(
+    llm, combined_chunk_document_list, allowedNodes, allowedRelationship
+):
+    futures = []
+    graph_document_list = []
+    llm_transformer = get_llm_graph_transformer(llm, allowedNodes, allowedRelationship)
+    extraction_cache = get_extraction_cache()
+    if extraction_cache is not None:
+        model_id = get_llm_model_id(llm)
+        prompt_fingerprint = get_extraction_prompt_fingerprint(tuple(allowedNodes or ()), tuple(allowedRelationship or ()))
+    cache_hits = 0
+    # The limiter is shared by all extractions on this provider, the pool only bounds this call's threads
+    limiter = get_llm_concurrency_limiter(llm)
+    prompt_tokens = get_estimated_prompt_tokens(tuple(allowedNodes or ()), tuple(allowedRelationship or ()))
+    max_retries = int(os.environ.get("LLM_RATE_LIMIT_MAX_RETRIES", 5))
+    with ThreadPoolExecutor(max_workers=limiter.max_limit) as executor:
         for chunk in combined_chunk_document_list:
             chunk_doc = Document(
                 page_content=chunk.page_content.encode("utf-8"), metadata=chunk.metadata
             )
-            futures.append(
-                executor.submit(llm_transformer.convert_to_graph_documents, [chunk_doc])
+            estimated_tokens = prompt_tokens + 2 * estimate_tokens(chunk.page_content)
+            if extraction_cache is None:
+                futures.append(
+                    executor.submit(limiter.run, llm_transformer.convert_to_graph_documents, [chunk_doc],
+                                    estimated_tokens=estimated_tokens, max_retries=max_retries)
+                )
+                continue
+            cache_key = create_extraction_cache_key(
+                chunk.page_content, model_id, allowedNodes, allowedRelationship, prompt_fingerprint
             )
+            cached_graph_document = extraction_cache.get(cache_key)
+            if cached_graph_document is not None:
+                cache_hits += 1
+                graph_document_list.append(deserialize_graph_document(cached_graph_document, chunk_doc))
+            else:
+                futures.append(
+                    executor.submit(limiter.run, convert_and_cache_graph_document, llm_transformer, chunk_doc, extraction_cache, cache_key,
+                                    estimated_tokens=estimated_tokens, max_retries=max_retries)
+                )
+        if extraction_cache is not None:
+            logging.info(f"Extraction cache hits: {cache_hits}/{len(combined_chunk_document_list)}")
 
         for i, future in enumerate(concurrent.futures.as_completed(futures)):
             graph_document = future.result()
@@ -540,9 +723,16 @@ This is your most important instruction, adhere to this rules strictly. Non-comp
     return graph_document_list
 
 
+def convert_and_cache_graph_document(llm_transformer, chunk_doc, extraction_cache, cache_key):
+    graph_document = llm_transformer.convert_to_graph_documents([chunk_doc])
+    extraction_cache.put(cache_key, serialize_graph_document(graph_document[0]))
+    return graph_document
+
+
 def get_graph_from_llm(model, chunkId_chunkDoc_list, allowedNodes, allowedRelationship):
     llm, model_name = get_llm(model)
-    combined_chunk_document_list = get_combined_chunks(chunkId_chunkDoc_list)
+    prompt_tokens = get_prompt_token_count(model, allowedNodes, allowedRelationship)
+    combined_chunk_document_list = get_combined_chunks(chunkId_chunkDoc_list, model, prompt_tokens)
     graph_document_list = get_graph_document_list(
         llm, combined_chunk_document_list, allowedNodes, allowedRelationship
     )
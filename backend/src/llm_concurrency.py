@@ -0,0 +1,176 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+RATE_LIMIT_MARKERS = ("429", "rate limit", "ratelimit", "too many requests", "throttl", "resource exhausted", "quota")
+
+
+def is_rate_limit_error(error: Exception):
+    """Recognise 429 / throttling errors raised by the OpenAI, Anthropic, Groq, Vertex AI and Bedrock clients."""
+    for candidate in (error, getattr(error, "response", None)):
+        if getattr(candidate, "status_code", None) == 429:
+            return True
+    description = f"{type(error).__name__} {error}".lower()
+    return any(marker in description for marker in RATE_LIMIT_MARKERS)
+
+
+def estimate_tokens(text: str):
+    # Roughly four characters per token for the latin-script documents and prompts we send
+    return max(1, len(text) // 4)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Bounds in-flight requests to one LLM provider and adapts the bound to the provider.
+
+    The limit grows additively while request latency stays within latency_tolerance of the
+    best latency seen, shrinks slightly when latency degrades, and is halved on a rate limit
+    response, after which new requests wait for an exponentially growing backoff.
+    When tokens_per_minute is set, requests also draw their estimated tokens from a bucket
+    refilled at that rate. One limiter is shared by every extraction of the process using
+    the provider; each gunicorn worker process has its own, see create_llm_concurrency_limiter.
+    """
+
+    def __init__(self, provider: str, max_limit: int, min_limit: int = 1, initial_limit: int = None,
+                 tokens_per_minute: int = 0, latency_tolerance: float = 2.0, min_backoff_seconds: float = 1,
+                 max_backoff_seconds: float = 60, token_window_seconds: float = 60):
+        self.provider = provider
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(initial_limit or max(min_limit, max_limit // 2))
+        self.tokens_per_minute = tokens_per_minute
+        self.latency_tolerance = latency_tolerance
+        self.min_backoff_seconds = min_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.token_window_seconds = token_window_seconds
+        self.in_flight = 0
+        self.rate_limited_count = 0
+        self._best_latency = None
+        self._tokens = float(tokens_per_minute)
+        self._tokens_updated_at = time.monotonic()
+        self._backoff_seconds = 0
+        self._backoff_until = 0
+        self._condition = threading.Condition()
+
+    def _refill_tokens(self, now):
+        if self.tokens_per_minute:
+            elapsed = now - self._tokens_updated_at
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / self.token_window_seconds)
+        self._tokens_updated_at = now
+
+    def _wait_seconds(self, estimated_tokens):
+        """Seconds until a request may start, 0 when it may start now; called with the condition held."""
+        now = time.monotonic()
+        if now < self._backoff_until:
+            return self._backoff_until - now
+        if self.in_flight >= int(self.limit):
+            return None
+        if self.tokens_per_minute:
+            self._refill_tokens(now)
+            needed_tokens = min(estimated_tokens, self.tokens_per_minute)
+            if self._tokens < needed_tokens:
+                return (needed_tokens - self._tokens) * self.token_window_seconds / self.tokens_per_minute
+        return 0
+
+    def acquire(self, estimated_tokens: int = 0):
+        with self._condition:
+            while True:
+                wait_seconds = self._wait_seconds(estimated_tokens)
+                if wait_seconds == 0:
+                    break
+                self._condition.wait(wait_seconds)
+            self.in_flight += 1
+            if self.tokens_per_minute:
+                self._tokens -= min(estimated_tokens, self.tokens_per_minute)
+
+    def release(self, latency: float, rate_limited: bool = False):
+        with self._condition:
+            self.in_flight -= 1
+            if rate_limited:
+                self.rate_limited_count += 1
+                # Requests that were already in flight when the limit was hit do not shrink it again
+                if time.monotonic() >= self._backoff_until:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._backoff_seconds = min(self.max_backoff_seconds, max(self.min_backoff_seconds, self._backoff_seconds * 2))
+                    self._backoff_until = time.monotonic() + self._backoff_seconds
+                    logging.warning(f"{self.provider} rate limited, concurrency lowered to {int(self.limit)}, backing off {self._backoff_seconds}s")
+            else:
+                self._backoff_seconds = 0
+                if self._best_latency is None or latency < self._best_latency:
+                    self._best_latency = latency
+                if latency <= self._best_latency * self.latency_tolerance:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                else:
+                    self.limit = max(self.min_limit, self.limit * 0.95)
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, estimated_tokens: int = 0):
+        self.acquire(estimated_tokens)
+        start = time.monotonic()
+        rate_limited = False
+        try:
+            yield
+        except Exception as e:
+            rate_limited = is_rate_limit_error(e)
+            raise
+        finally:
+            self.release(time.monotonic() - start, rate_limited)
+
+    def run(self, function, *args, estimated_tokens: int = 0, max_retries: int = 5, **kwargs):
+        """Call function inside a slot, retrying rate limited calls after the limiter's backoff."""
+        attempt = 0
+        while True:
+            try:
+                with self.slot(estimated_tokens):
+                    return function(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                if not is_rate_limit_error(e) or attempt > max_retries:
+                    raise
+
+
+_llm_concurrency_limiters = {}
+_llm_concurrency_limiters_lock = threading.Lock()
+
+
+def get_server_process_count():
+    # gunicorn starts WEB_CONCURRENCY worker processes when --workers is not given
+    return max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+
+
+def create_llm_concurrency_limiter(provider: str) -> AdaptiveConcurrencyLimiter:
+    """
+    The configured limits are for the whole server. Limiters live in each worker process and
+    do not see each other's requests or rate limit backoff, so every process gets an equal
+    share of the concurrency and tokens per minute of the WEB_CONCURRENCY processes.
+    """
+    max_limit = int(os.environ.get("LLM_MAX_CONCURRENCY", 10))
+    tokens_per_minute = int(os.environ.get("LLM_TOKENS_PER_MINUTE", 0))
+    # Per provider override, e.g. LLM_CONCURRENCY_CONFIG_ChatOllama="2,0"
+    provider_config = os.environ.get("LLM_CONCURRENCY_CONFIG_" + provider)
+    if provider_config:
+        max_limit, tokens_per_minute = [int(value) for value in provider_config.split(",")]
+    processes = get_server_process_count()
+    min_limit = int(os.environ.get("LLM_MIN_CONCURRENCY", 1))
+    return AdaptiveConcurrencyLimiter(
+        provider,
+        max_limit=max(min_limit, max_limit // processes),
+        min_limit=min_limit,
+        tokens_per_minute=tokens_per_minute // processes,
+    )
+
+
+def get_llm_concurrency_limiter(llm) -> AdaptiveConcurrencyLimiter:
+    """Return the process-wide limiter of the provider behind llm, keyed by its chat model class."""
+    provider = llm.get_name()
+    with _llm_concurrency_limiters_lock:
+        limiter = _llm_concurrency_limiters.get(provider)
+        if limiter is None:
+            limiter = create_llm_concurrency_limiter(provider)
+            _llm_concurrency_limiters[provider] = limiter
+            logging.info(f"Created LLM concurrency limiter for {provider}: max {limiter.max_limit} in flight, {limiter.tokens_per_minute or 'unlimited'} tokens/min "
+                         f"in this process, one of {get_server_process_count()}")
+    return limiter
@@ -4,10 +4,11 @@ from src.shared.schema_extraction import schema_extraction_from_text
 from dotenv import load_dotenv
 from datetime import datetime
 import logging
-from src.create_chunks import CreateChunksofDocument
+from src.create_chunks import CreateChunksofDocument, clean_pages
 from src.graphDB_dataAccess import graphDBdataAccess
-from src.document_sources.local_file import get_documents_from_file_by_path
+from src.document_sources.local_file import get_documents_from_file_by_path, get_total_pages
 from src.entities.source_node import sourceNode
+from langchain.docstore.document import Document
 from src.generate_graphDocuments_from_llm import generate_graphDocuments
 from src.document_sources.gcs_bucket import *
 from src.document_sources.s3_bucket import *
@@ -24,11 +25,47 @@ import sys
 import shutil
 import urllib.parse
 import json
+import queue
+import threading
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from google.oauth2.credentials import Credentials
 
 warnings.filterwarnings("ignore")
 load_dotenv()
 logging.basicConfig(format='%(asctime)s - %(message)s',level='INFO')
 
+def get_s3_source_node(model, source_url, file_info, aws_access_key_id, source_type):
+    file_name=file_info['file_key'] 
+    obj_source_node = sourceNode()
+    obj_source_node.file_name = file_name.split('/')[-1]
+    obj_source_node.file_type = 'pdf'
+    obj_source_node.file_size = file_info['file_size_bytes']
+    obj_source_node.file_source = source_type
+    obj_source_node.total_pages = 'N/A'
+    obj_source_node.model = model
+    obj_source_node.url = str(source_url+file_name)
+    obj_source_node.awsAccessKeyId = aws_access_key_id
+    obj_source_node.created_at = datetime.now()
+    return obj_source_node
+
+def get_gcs_source_node(model, gcs_bucket_name, file_metadata, source_type, access_token):
+    obj_source_node = sourceNode()
+    obj_source_node.file_name = file_metadata['fileName']
+    obj_source_node.file_size = file_metadata['fileSize']
+    obj_source_node.url = file_metadata['url']
+    obj_source_node.file_source = source_type
+    obj_source_node.total_pages = 'N/A'
+    obj_source_node.model = model
+    obj_source_node.file_type = 'pdf'
+    obj_source_node.gcsBucket = gcs_bucket_name
+    obj_source_node.gcsBucketFolder = file_metadata['gcsBucketFolder']
+    obj_source_node.gcsProjectId = file_metadata['gcsProjectId']
+    obj_source_node.created_at = datetime.now()
+    obj_source_node.access_token = access_token
+    return obj_source_node
+
 def create_source_node_graph_url_s3(graph, model, source_url, aws_access_key_id, aws_secret_access_key, source_type):
     
     lst_file_name = []
@@ -40,17 +77,7 @@ def create_source_node_graph_url_s3(graph, model, source_url, aws_access_key_id,
     failed_count=0
     
     for file_info in files_info:
-        file_name=file_info['file_key'] 
-        obj_source_node = sourceNode()
-        obj_source_node.file_name = file_name.split('/')[-1]
-        obj_source_node.file_type = 'pdf'
-        obj_source_node.file_size = file_info['file_size_bytes']
-        obj_source_node.file_source = source_type
-        obj_source_node.total_pages = 'N/A'
-        obj_source_node.model = model
-        obj_source_node.url = str(source_url+file_name)
-        obj_source_node.awsAccessKeyId = aws_access_key_id
-        obj_source_node.created_at = datetime.now()
+        obj_source_node = get_s3_source_node(model, source_url, file_info, aws_access_key_id, source_type)
         try:
           graphDb_data_Access = graphDBdataAccess(graph)
           graphDb_data_Access.create_source_node(obj_source_node)
@@ -71,20 +98,7 @@ def create_source_node_graph_url_gcs(graph, model, gcs_project_id, gcs_bucket_na
     
     lst_file_metadata= get_gcs_bucket_files_info(gcs_project_id, gcs_bucket_name, gcs_bucket_folder, credentials)
     for file_metadata in lst_file_metadata :
-      obj_source_node = sourceNode()
-      obj_source_node.file_name = file_metadata['fileName']
-      obj_source_node.file_size = file_metadata['fileSize']
-      obj_source_node.url = file_metadata['url']
-      obj_source_node.file_source = source_type
-      obj_source_node.total_pages = 'N/A'
-      obj_source_node.model = model
-      obj_source_node.file_type = 'pdf'
-      obj_source_node.gcsBucket = gcs_bucket_name
-      obj_source_node.gcsBucketFolder = file_metadata['gcsBucketFolder']
-      obj_source_node.gcsProjectId = file_metadata['gcsProjectId']
-      obj_source_node.created_at = datetime.now()
-      obj_source_node.access_token = credentials.token
-    
+      obj_source_node = get_gcs_source_node(model, gcs_bucket_name, file_metadata, source_type, credentials.token)
       try:
           graphDb_data_Access = graphDBdataAccess(graph)
           graphDb_data_Access.create_source_node(obj_source_node)
@@ -191,7 +205,8 @@ def extract_graph_from_file_local_file(graph, model, merged_file_path, fileName,
     file_name, pages = get_documents_from_gcs( PROJECT_ID, BUCKET_UPLOAD, folder_name, fileName)
   else:
     file_name, pages, file_extension = get_documents_from_file_by_path(merged_file_path,fileName)
-  if pages==None or len(pages)==0:
+  # PDF pages are a generator, processing_source raises when it yields no page
+  if pages==None or (isinstance(pages, list) and len(pages)==0):
     raise Exception(f'File content is not available for file : {file_name}')
 
   return processing_source(graph, model, file_name, pages, allowedNodes, allowedRelationship, True, merged_file_path, uri)
@@ -243,6 +258,120 @@ def extract_graph_from_file_gcs(graph, model, gcs_project_id, gcs_bucket_name, g
 
   return processing_source(graph, model, file_name, pages, allowedNodes, allowedRelationship)
 
+def ingest_text_document(graph, model, file_name, text, allowedNodes, allowedRelationship, metadata=None):
+  """
+  Creates the Document node of a text and extracts its graph from the text in memory,
+  without writing upload parts, merging them and loading the merged file again.
+  metadata (e.g. email headers) is stored as properties of the Document node.
+  """
+  if text is None or len(text.strip())==0:
+    raise Exception(f'File content is not available for file : {file_name}')
+
+  obj_source_node = sourceNode()
+  obj_source_node.file_name = file_name
+  obj_source_node.file_type = file_name.split('.')[-1] if '.' in file_name else 'txt'
+  obj_source_node.file_size = len(text.encode('utf-8'))
+  obj_source_node.file_source = 'text'
+  obj_source_node.model = model
+  obj_source_node.total_pages = 1
+  obj_source_node.created_at = datetime.now()
+  graphDb_data_Access = graphDBdataAccess(graph)
+  graphDb_data_Access.create_source_node(obj_source_node)
+  if metadata:
+    graphDb_data_Access.set_document_metadata(file_name, metadata)
+  logging.info(f'Ingesting text document {file_name} of {obj_source_node.file_size} bytes')
+
+  return processing_source(graph, model, file_name, [Document(page_content=text, metadata={'source': file_name})], allowedNodes, allowedRelationship)
+
+def extract_graph_from_folder(graph, model, source_type, allowedNodes, allowedRelationship, source_url=None,
+                              aws_access_key_id=None, aws_secret_access_key=None, gcs_project_id=None,
+                              gcs_bucket_name=None, gcs_bucket_folder=None, access_token=None):
+  """
+  Extract every PDF of an S3 prefix or GCS bucket folder in one request.
+
+  Files are downloaded and extracted by FOLDER_EXTRACT_WORKERS threads; their LLM calls share
+  the provider's concurrency limiter, so the folder uses the whole LLM budget without
+  exceeding it. Each file reports progress and failures through its own Document node.
+  Files without a Document node are registered, and files already Completed or
+  Processing are skipped, so an interrupted folder can be submitted again.
+  """
+  start_time = datetime.now()
+  extract_functions = {}
+  if source_type == 's3 bucket':
+    if(aws_access_key_id==None or aws_secret_access_key==None):
+      raise Exception('Please provide AWS access and secret keys')
+    bucket = urllib.parse.urlparse(source_url).netloc
+    for file_info in get_s3_files_info(source_url,aws_access_key_id=aws_access_key_id,aws_secret_access_key=aws_secret_access_key):
+      obj_source_node = get_s3_source_node(model, source_url, file_info, aws_access_key_id, source_type)
+      file_url = f"s3://{bucket}/{file_info['file_key']}"
+      extract_functions[obj_source_node.file_name] = (obj_source_node, functools.partial(
+        extract_graph_from_file_s3, graph, model, file_url, aws_access_key_id, aws_secret_access_key, allowedNodes, allowedRelationship))
+  else:
+    credentials = Credentials(access_token) if access_token else None
+    for file_metadata in get_gcs_bucket_files_info(gcs_project_id, gcs_bucket_name, gcs_bucket_folder, credentials):
+      obj_source_node = get_gcs_source_node(model, gcs_bucket_name, file_metadata, source_type, access_token)
+      extract_functions[obj_source_node.file_name] = (obj_source_node, functools.partial(
+        extract_graph_from_file_gcs, graph, model, gcs_project_id, gcs_bucket_name, file_metadata['gcsBucketFolder'] or None,
+        file_metadata['fileName'], access_token, allowedNodes, allowedRelationship))
+  if not extract_functions:
+    raise Exception('No pdf files found.')
+
+  graphDb_data_Access = graphDBdataAccess(graph)
+  statuses = graphDb_data_Access.get_document_statuses(list(extract_functions))
+  files_to_extract = []
+  skipped_count = 0
+  for file_name, (obj_source_node, extract_function) in extract_functions.items():
+    status = statuses.get(file_name)
+    if status in ('Completed', 'Processing'):
+      skipped_count += 1
+      continue
+    if status is None:
+      graphDb_data_Access.create_source_node(obj_source_node)
+    files_to_extract.append((file_name, extract_function))
+
+  folder_extract_workers = int(os.environ.get('FOLDER_EXTRACT_WORKERS', 8))
+  logging.info(f'Extracting {len(files_to_extract)} files of {source_type} folder with {folder_extract_workers} workers, {skipped_count} already extracted')
+  files = []
+  success_count = 0
+  failed_count = 0
+  node_count = 0
+  rel_count = 0
+  with ThreadPoolExecutor(max_workers=folder_extract_workers) as executor:
+    futures = {executor.submit(extract_function): file_name for file_name, extract_function in files_to_extract}
+    for future in as_completed(futures):
+      file_name = futures[future]
+      try:
+        result = future.result()
+        if result is None:
+          skipped_count += 1
+          continue
+        success_count += 1
+        node_count += result['nodeCount']
+        rel_count += result['relationshipCount']
+        files.append({'fileName': file_name, 'status': result['status'], 'nodeCount': result['nodeCount'],
+                      'relationshipCount': result['relationshipCount'], 'processingTime': result['processingTime']})
+      except Exception as e:
+        failed_count += 1
+        error_message = str(e)
+        logging.exception(f'Folder extraction failed for file {file_name}: {error_message}')
+        graphDb_data_Access.update_exception_db(file_name, error_message)
+        files.append({'fileName': file_name, 'status': 'Failed', 'errorMessage': error_message})
+      logging.info(f'Folder extraction progress: {success_count + failed_count}/{len(files_to_extract)} files')
+
+  processed_time = datetime.now() - start_time
+  return {
+      "fileName": source_url or f'{gcs_bucket_name}/{gcs_bucket_folder or ""}',
+      "nodeCount": node_count,
+      "relationshipCount": rel_count,
+      "processingTime": round(processed_time.total_seconds(),2),
+      "status" : 'Completed',
+      "model" : model,
+      "success_count" : success_count,
+      "failed_count" : failed_count,
+      "skipped_count" : skipped_count,
+      "files" : files
+  }
+
 def processing_source(graph, model, file_name, pages, allowedNodes, allowedRelationship, is_uploaded_from_local=None, merged_file_path=None, uri=None):
   """
    Extracts a Neo4jGraph from a PDF file based on the model.
@@ -263,26 +392,27 @@ def processing_source(graph, model, file_name, pages, allowedNodes, allowedRelat
   graphDb_data_Access = graphDBdataAccess(graph)
 
   result = graphDb_data_Access.get_current_status_document_node(file_name)
-  logging.info("Break down file into chunks")
-  bad_chars = ['"', "\n", "'"]
-  for i in range(0,len(pages)):
-    text = pages[i].page_content
-    for j in bad_chars:
-      if j == '\n':
-        text = text.replace(j, ' ')
-      else:
-        text = text.replace(j, '')
-    pages[i]=Document(page_content=str(text), metadata=pages[i].metadata)
-  create_chunks_obj = CreateChunksofDocument(pages, graph)
-  chunks = create_chunks_obj.split_file_into_chunks()
-  chunkId_chunkDoc_list = create_relation_between_chunks(graph,file_name,chunks)
   if result[0]['Status'] != 'Processing':      
+    logging.info("Break down file into chunks")
+    # pages may be a generator: PDF pages are parsed while earlier pages are chunked, written and extracted
+    pages = iter(pages)
+    first_page = next(pages, None)
+    if first_page is None:
+      raise Exception(f'File content is not available for file : {file_name}')
+    page_count = [0]
+    def count_pages():
+      for page in itertools.chain([first_page], pages):
+        page_count[0] += 1
+        yield page
+    create_chunks_obj = CreateChunksofDocument(clean_pages(count_pages()), graph)
+    is_incremental = os.environ.get('INCREMENTAL_EXTRACTION', 'False').lower() in ('true', '1', 'yes')
+    existing_chunks = get_document_chunks(graph, file_name) if is_incremental else {}
+    embedded_chunk_ids = {chunk_id for chunk_id, extracted in existing_chunks.items() if extracted}
+    written_chunk_batches = write_chunk_batches(graph, file_name, create_chunks_obj.iter_chunk_records(), embedded_chunk_ids)
     obj_source_node = sourceNode()
     status = "Processing"
     obj_source_node.file_name = file_name
     obj_source_node.status = status
-    obj_source_node.total_chunks = len(chunks)
-    obj_source_node.total_pages = len(pages)
     obj_source_node.model = model
     logging.info(file_name)
     logging.info(obj_source_node)
@@ -295,21 +425,71 @@ def processing_source(graph, model, file_name, pages, allowedNodes, allowedRelat
     job_status = "Completed"
     node_count = 0
     rel_count = 0
-    for i in range(0, len(chunkId_chunkDoc_list), update_graph_chunk_processed):
-      select_chunks_upto = i+update_graph_chunk_processed
+    pipeline_queue_size = int(os.environ.get('PIPELINE_QUEUE_SIZE', 2))
+    extracted_batches = queue.Queue(maxsize=pipeline_queue_size)
+    stop_pipeline = threading.Event()
+    # chunks written so far, and their total once every page is chunked
+    chunk_stream = {'written': 0, 'total': None, 'chunk_ids': []}
+
+    def put_extracted_batch(item):
+      # Block while the writer is behind, but give up once the writer has stopped
+      while not stop_pipeline.is_set():
+        try:
+          extracted_batches.put(item, timeout=1)
+          return True
+        except queue.Full:
+          continue
+      return False
+
+    def extract_selected_chunks(selected_chunks, select_chunks_upto):
       logging.info(f'Selected Chunks upto: {select_chunks_upto}')
-      if len(chunkId_chunkDoc_list) <= select_chunks_upto:
-         select_chunks_upto = len(chunkId_chunkDoc_list)
-      selected_chunks = chunkId_chunkDoc_list[i:select_chunks_upto]
       result = graphDb_data_Access.get_current_status_document_node(file_name)
-      is_cancelled_status = result[0]['is_cancelled']
       logging.info(f"Value of is_cancelled : {result[0]['is_cancelled']}")
-      if bool(is_cancelled_status) == True:
-         job_status = "Cancelled"
+      if bool(result[0]['is_cancelled']) == True:
          logging.info('Exit from running loop of processing file')
-         exit
-      else:
-        node_count,rel_count = processing_chunks(selected_chunks,graph,file_name,model,allowedNodes,allowedRelationship,node_count, rel_count)
+         put_extracted_batch(('cancelled', None, None, None))
+         return False
+      graph_documents = extract_graph_documents_from_chunks(selected_chunks,graph,file_name,model,allowedNodes,allowedRelationship)
+      return put_extracted_batch(('extracted', select_chunks_upto, selected_chunks, graph_documents))
+
+    def extract_batches():
+      # Producer stage: chunks are written as the pages are chunked, and LLM extraction
+      # for batch N+1 runs while batch N is written to Neo4j
+      try:
+        selected_chunks = []
+        for written_batch in written_chunk_batches:
+          chunk_stream['written'] += len(written_batch)
+          for chunk in written_batch:
+            chunk_stream['chunk_ids'].append(chunk['chunk_id'])
+            # Incremental mode: only chunks whose graph documents were not saved before are extracted
+            if existing_chunks.get(chunk['chunk_id']):
+              continue
+            selected_chunks.append(chunk)
+            if len(selected_chunks) == update_graph_chunk_processed:
+              if not extract_selected_chunks(selected_chunks, len(chunk_stream['chunk_ids'])):
+                return
+              selected_chunks = []
+        chunk_stream['total'] = len(chunk_stream['chunk_ids'])
+        if selected_chunks and not extract_selected_chunks(selected_chunks, chunk_stream['total']):
+          return
+        put_extracted_batch(('done', None, None, None))
+      except Exception as e:
+        put_extracted_batch(('failed', None, None, e))
+
+    extraction_thread = threading.Thread(target=extract_batches, name=f'extract-{file_name}', daemon=True)
+    extraction_thread.start()
+    try:
+      while True:
+        # Consumer stage: Neo4j writes and progress updates on the Document node
+        stage, select_chunks_upto, selected_chunks, graph_documents = extracted_batches.get()
+        if stage == 'done':
+          break
+        if stage == 'cancelled':
+          job_status = "Cancelled"
+          break
+        if stage == 'failed':
+          raise graph_documents
+        node_count,rel_count = save_graph_documents_for_chunks(graph_documents,selected_chunks,graph,file_name,node_count,rel_count)
         end_time = datetime.now()
         processed_time = end_time - start_time
         
@@ -319,8 +499,17 @@ def processing_source(graph, model, file_name, pages, allowedNodes, allowedRelat
         obj_source_node.processing_time = processed_time
         obj_source_node.node_count = node_count
         obj_source_node.processed_chunk = select_chunks_upto
+        # Until every page is chunked the total is a lower bound, kept above the processed count
+        obj_source_node.total_chunks = chunk_stream['total'] or max(chunk_stream['written'], select_chunks_upto + 1)
         obj_source_node.relationship_count = rel_count
         graphDb_data_Access.update_source_node(obj_source_node)
+    finally:
+      stop_pipeline.set()
+      extraction_thread.join()
+
+    # Chunks of the previous version that are gone can only be known once the whole document is chunked
+    if existing_chunks and chunk_stream['total'] is not None:
+      remove_stale_chunks(graph, file_name, chunk_stream['chunk_ids'], existing_chunks)
     
     result = graphDb_data_Access.get_current_status_document_node(file_name)
     is_cancelled_status = result[0]['is_cancelled']
@@ -334,6 +523,11 @@ def processing_source(graph, model, file_name, pages, allowedNodes, allowedRelat
     obj_source_node.file_name = file_name
     obj_source_node.status = job_status
     obj_source_node.processing_time = processed_time
+    obj_source_node.total_pages = page_count[0]
+    if chunk_stream['total'] is not None:
+      obj_source_node.total_chunks = chunk_stream['total']
+      if job_status == 'Completed':
+        obj_source_node.processed_chunk = chunk_stream['total']
 
     graphDb_data_Access.update_source_node(obj_source_node)
     logging.info('Updated the nodeCount and relCount properties in Document node')
@@ -362,15 +556,29 @@ def processing_source(graph, model, file_name, pages, allowedNodes, allowedRelat
   else:
      logging.info('File does not process because it\'s already in Processing status')
 
-def processing_chunks(chunkId_chunkDoc_list,graph,file_name,model,allowedNodes,allowedRelationship, node_count, rel_count):
-  #create vector index and update chunk node with embedding
-  update_embedding_create_vector_index( graph, chunkId_chunkDoc_list, file_name)
+def remove_stale_chunks(graph, file_name, chunk_ids, existing_chunks):
+  """
+  Compare the chunks of a re-processed document with the chunks that were PART_OF it before.
+  Removed chunks are detached and stale FIRST_CHUNK/NEXT_CHUNK links dropped.
+  """
+  removed_chunk_ids = list(set(existing_chunks) - set(chunk_ids))
+  delete_orphan_entities = os.environ.get('INCREMENTAL_DELETE_ORPHAN_ENTITIES', 'False').lower() in ('true', '1', 'yes')
+  detach_removed_chunks(graph, file_name, removed_chunk_ids, delete_orphan_entities)
+  delete_stale_chunk_links(graph, file_name, chunk_ids)
+  extracted_chunk_count = sum(1 for chunk_id in chunk_ids if existing_chunks.get(chunk_id))
+  logging.info(f'Incremental extraction of {file_name}: {len(chunk_ids) - extracted_chunk_count} new chunks, {extracted_chunk_count} unchanged, {len(removed_chunk_ids)} removed')
+
+def extract_graph_documents_from_chunks(chunkId_chunkDoc_list,graph,file_name,model,allowedNodes,allowedRelationship):
+  # chunk embeddings are written with the chunks by create_relation_between_chunks
   logging.info("Get graph document list from models")
-  graph_documents =  generate_graphDocuments(model, graph, chunkId_chunkDoc_list, allowedNodes, allowedRelationship)
+  return generate_graphDocuments(model, graph, chunkId_chunkDoc_list, allowedNodes, allowedRelationship)
+
+def save_graph_documents_for_chunks(graph_documents,chunkId_chunkDoc_list,graph,file_name,node_count,rel_count):
+  create_entity_id_indexes(graph, {node.type for graph_document in graph_documents for node in graph_document.nodes if is_valid_cypher_label(node.type)})
   save_graphDocuments_in_neo4j(graph, graph_documents)
   chunks_and_graphDocuments_list = get_chunk_and_graphDocument(graph_documents, chunkId_chunkDoc_list)
   merge_relationship_between_chunk_and_entites(graph, chunks_and_graphDocuments_list)
-  # return graph_documents
+  mark_chunks_extracted(graph, file_name, [chunk['chunk_id'] for chunk in chunkId_chunkDoc_list])
   
   distinct_nodes = set()
   relations = []
@@ -381,9 +589,9 @@ def processing_chunks(chunkId_chunkDoc_list,graph,file_name,model,allowedNodes,a
           node_type= node.type
           if (node_id, node_type) not in distinct_nodes:
             distinct_nodes.add((node_id, node_type))
-  #get all relations
-  for relation in graph_document.relationships:
-        relations.append(relation.type)
+    #get all relations
+    for relation in graph_document.relationships:
+          relations.append(relation.type)
 
   node_count += len(distinct_nodes)
   rel_count += len(relations)
@@ -405,12 +613,12 @@ def get_source_list_from_graph(uri,userName,password,db_name=None):
    sorting the list by the last updated date. 
  """
   logging.info("Get existing files list from graph")
-  graph = Neo4jGraph(url=uri, database=db_name, username=userName, password=password)
-  graph_DB_dataAccess = graphDBdataAccess(graph)
-  if not graph._driver._closed:
-      logging.info(f"closing connection for sources_list api")
-      graph._driver.close()
-  return graph_DB_dataAccess.get_source_list()
+  graph = create_graph_database_connection(uri, userName, password, db_name)
+  try:
+    graph_DB_dataAccess = graphDBdataAccess(graph)
+    return graph_DB_dataAccess.get_source_list()
+  finally:
+    close_db_connection(graph, 'sources_list')
 
 def update_graph(graph):
   """
@@ -433,22 +641,64 @@ def connection_check(graph):
   graph_DB_dataAccess = graphDBdataAccess(graph)
   return graph_DB_dataAccess.connection_check()
 
-def merge_chunks_local(file_name, total_chunks, chunk_dir, merged_dir):
+_upload_locks = {}
+_upload_locks_lock = threading.Lock()
+
+def get_upload_lock(file_path):
+  with _upload_locks_lock:
+    return _upload_locks.setdefault(file_path, threading.Lock())
 
-  if not os.path.exists(merged_dir):
-      os.mkdir(merged_dir)
-  logging.info(f'Merged File Path: {merged_dir}')
+def append_chunk_local(chunk, chunk_number, file_name, chunk_dir, merged_dir):
+  """
+  Stream an uploaded part onto the end of <merged_dir>/<file_name>.partial, so only one part
+  is buffered at a time. A part that arrives before its predecessor is staged in chunk_dir
+  and appended once the gap is filled. Returns the number of parts appended so far.
+  """
+  os.makedirs(merged_dir, exist_ok=True)
+  partial_file_path = os.path.join(merged_dir, f"{file_name}.partial")
+  # next expected part number, kept next to the partial file
+  next_part_path = partial_file_path + '.next'
+  with get_upload_lock(partial_file_path):
+    if chunk_number == 1:
+      open(partial_file_path, "wb").close()
+      next_part = 1
+    elif os.path.exists(next_part_path):
+      with open(next_part_path) as next_part_file:
+        next_part = int(next_part_file.read())
+    else:
+      next_part = 1
+    if chunk_number != next_part:
+      os.makedirs(chunk_dir, exist_ok=True)
+      chunk_file_path = os.path.join(chunk_dir, f"{file_name}_part_{chunk_number}")
+      logging.info(f'Part {chunk_number} of {file_name} arrived before part {next_part}, staged at {chunk_file_path}')
+      with open(chunk_file_path, "wb") as chunk_file:
+        shutil.copyfileobj(chunk.file, chunk_file)
+      return next_part - 1
+    with open(partial_file_path, "ab") as write_stream:
+      shutil.copyfileobj(chunk.file, write_stream)
+      next_part += 1
+      staged_chunk_path = os.path.join(chunk_dir, f"{file_name}_part_{next_part}")
+      while os.path.exists(staged_chunk_path):
+        with open(staged_chunk_path, "rb") as staged_chunk:
+          shutil.copyfileobj(staged_chunk, write_stream)
+        os.unlink(staged_chunk_path)
+        next_part += 1
+        staged_chunk_path = os.path.join(chunk_dir, f"{file_name}_part_{next_part}")
+    with open(next_part_path, "w") as next_part_file:
+      next_part_file.write(str(next_part))
+    return next_part - 1
+
+def merge_chunks_local(file_name, total_chunks, chunk_dir, merged_dir):
+  """Move the fully appended upload into place and read its size and page count."""
+  partial_file_path = os.path.join(merged_dir, f"{file_name}.partial")
   merged_file_path = os.path.join(merged_dir, file_name)
-  with open(merged_file_path, "wb") as write_stream:
-      for i in range(1,total_chunks+1):
-          chunk_file_path = os.path.join(chunk_dir, f"{file_name}_part_{i}")
-          logging.info(f'Chunk File Path While Merging Parts:{chunk_file_path}')
-          with open(chunk_file_path, "rb") as chunk_file:
-              shutil.copyfileobj(chunk_file, write_stream)
-          os.unlink(chunk_file_path)  # Delete the individual chunk file after merging
-  logging.info("Chunks merged successfully and return file size")
-  file_name, pages, file_extension = get_documents_from_file_by_path(merged_file_path,file_name)
-  pdf_total_pages = pages[0].metadata['total_pages']
+  with get_upload_lock(partial_file_path):
+    os.replace(partial_file_path, merged_file_path)
+    os.unlink(partial_file_path + '.next')
+  with _upload_locks_lock:
+    _upload_locks.pop(partial_file_path, None)
+  logging.info(f'Merged File Path: {merged_file_path}')
+  pdf_total_pages = get_total_pages(merged_file_path)
   file_size = os.path.getsize(merged_file_path)
   return pdf_total_pages,file_size
   
@@ -462,17 +712,14 @@ def upload_file(graph, model, chunk, chunk_number:int, total_chunks:int, origina
   if gcs_file_cache == 'True':
     folder_name = create_gcs_bucket_folder_name_hashed(uri,originalname)
     upload_file_to_gcs(chunk, chunk_number, originalname, BUCKET_UPLOAD, folder_name)
+    is_last_chunk = int(chunk_number) == int(total_chunks)
   else:
-    if not os.path.exists(chunk_dir):
-      os.mkdir(chunk_dir)
-    
-    chunk_file_path = os.path.join(chunk_dir, f"{originalname}_part_{chunk_number}")
-    logging.info(f'Chunk File Path: {chunk_file_path}')
-    
-    with open(chunk_file_path, "wb") as chunk_file:
-      chunk_file.write(chunk.file.read())
+    appended_chunks = append_chunk_local(chunk, int(chunk_number), originalname, chunk_dir, merged_dir)
+    logging.info(f'{appended_chunks}/{total_chunks} parts of {originalname} appended')
+    # the last part may arrive before the ones it follows
+    is_last_chunk = appended_chunks == int(total_chunks)
 
-  if int(chunk_number) == int(total_chunks):
+  if is_last_chunk:
       # If this is the last chunk, merge all chunks into a single file
       if gcs_file_cache == 'True':
         file_size = merge_file_gcs(BUCKET_UPLOAD, originalname, folder_name, int(total_chunks))
@@ -1,125 +1,145 @@
 from langchain_community.graphs import Neo4jGraph
 from langchain.docstore.document import Document
-from src.shared.common_fn import load_embedding_model
+from src.shared.common_fn import load_embedding_model, embed_documents_in_batches, escape_cypher_label, is_valid_cypher_label
+from src.create_chunks import get_chunk_records
 import logging
-from typing import List
+from typing import Iterable, List
 import os
-import hashlib
 import time
+import weakref
 
 logging.basicConfig(format='%(asctime)s - %(message)s',level='INFO')
 
+# driver -> databases in which the chunk vector index / Chunk.id constraint has already been created
+_vector_index_created = weakref.WeakKeyDictionary()
+_chunk_constraint_created = weakref.WeakKeyDictionary()
+# driver -> (database, entity label) pairs whose id index has already been created
+_entity_index_created = weakref.WeakKeyDictionary()
+
+def create_entity_id_indexes(graph, node_types):
+    """Create the id index each entity label is merged on, once per database and label."""
+    driver_labels = _entity_index_created.setdefault(graph._driver, set())
+    for node_type in node_types:
+        if (graph._database, node_type) in driver_labels:
+            continue
+        try:
+            graph.query(f"CREATE INDEX IF NOT EXISTS FOR (n:{escape_cypher_label(node_type)}) ON (n.id)")
+        except Exception as e:
+            # e.g. a uniqueness constraint on the label's id already provides the index
+            logging.warning(f"Unable to create the id index of {node_type}: {e}")
+        driver_labels.add((graph._database, node_type))
+
 def merge_relationship_between_chunk_and_entites(graph: Neo4jGraph, graph_documents_chunk_chunk_Id : list):
-    batch_data = []
+    """
+    Create HAS_ENTITY relationships with one statically labelled MERGE query per entity label.
+    A graph document of combined chunks is listed once per chunk, so (chunk, entity) pairs
+    are de-duplicated before they are sent.
+    """
     logging.info("Create HAS_ENTITY relationship between chunks and entities")
-    chunk_node_id_set = 'id:"{}"'
+    batch_data_by_label = {}
+    seen = set()
     for graph_doc_chunk_id in graph_documents_chunk_chunk_Id:
         for node in graph_doc_chunk_id['graph_doc'].nodes:
-            query_data={
+            # entities without a usable label are not written by save_graphDocuments_in_neo4j either
+            if not node.id or not is_valid_cypher_label(node.type):
+                continue
+            key = (graph_doc_chunk_id['chunk_id'], node.type, node.id)
+            if key in seen:
+                continue
+            seen.add(key)
+            batch_data_by_label.setdefault(node.type, []).append({
                 'chunk_id': graph_doc_chunk_id['chunk_id'],
-                'node_type': node.type,
                 'node_id': node.id
-            }
-            batch_data.append(query_data)
-            #node_id = node.id
-            #Below query is also unable to change as parametrize because we can't make parameter of Label or node type
-            #https://neo4j.com/docs/cypher-manual/current/syntax/parameters/
-            #graph.query('MATCH(c:Chunk {'+chunk_node_id_set.format(graph_doc_chunk_id['chunk_id'])+'}) MERGE (n:'+ node.type +'{ id: "'+node_id+'"}) MERGE (c)-[:HAS_ENTITY]->(n)')
-          
-    if batch_data:
-        unwind_query = """
+            })
+
+    create_entity_id_indexes(graph, batch_data_by_label.keys())
+    for node_type, batch_data in batch_data_by_label.items():
+        #Labels can't be parameters, https://neo4j.com/docs/cypher-manual/current/syntax/parameters/
+        unwind_query = f"""
                     UNWIND $batch_data AS data
-                    MATCH (c:Chunk {id: data.chunk_id})
-                    CALL apoc.merge.node([data.node_type], {id: data.node_id}) YIELD node AS n
+                    MATCH (c:Chunk {{id: data.chunk_id}})
+                    MERGE (n:{escape_cypher_label(node_type)} {{id: data.node_id}})
                     MERGE (c)-[:HAS_ENTITY]->(n)
                 """
         graph.query(unwind_query, params={"batch_data": batch_data})
+    logging.info(f"Merged {len(seen)} HAS_ENTITY relationships for {len(batch_data_by_label)} entity labels")
 
     
-def update_embedding_create_vector_index(graph, chunkId_chunkDoc_list, file_name):
-    #create embedding
+def create_vector_index(graph, dimension):
+    """Create the chunk vector index once per database instead of once per chunk."""
+    driver_databases = _vector_index_created.setdefault(graph._driver, set())
+    if graph._database in driver_databases:
+        return
+    logging.info('create vector index on chunk embedding')
+    graph.query("""CREATE VECTOR INDEX `vector` if not exists for (c:Chunk) on (c.embedding)
+                    OPTIONS {indexConfig: {
+                    `vector.dimensions`: $dimensions,
+                    `vector.similarity_function`: 'cosine'
+                    }}
+                """,
+                {
+                    "dimensions" : dimension
+                }
+                )
+    driver_databases.add(graph._database)
+
+def create_chunk_constraint(graph):
+    """Create the Chunk.id uniqueness constraint, which backs every chunk MERGE, once per database."""
+    driver_databases = _chunk_constraint_created.setdefault(graph._driver, set())
+    if graph._database in driver_databases:
+        return
+    try:
+        graph.query("CREATE CONSTRAINT chunk_id_unique IF NOT EXISTS FOR (c:Chunk) REQUIRE c.id IS UNIQUE")
+    except Exception as e:
+        # e.g. an older database that already holds duplicate chunk ids; chunk writes still work without it
+        logging.warning(f"Unable to create the Chunk.id uniqueness constraint: {e}")
+    driver_databases.add(graph._database)
+
+def get_chunk_embeddings(chunk_rows, skip_embedding_chunk_ids):
+    """Embed the rows' text in place; returns the embedding dimension, or None when embedding is disabled."""
     isEmbedding = os.getenv('IS_EMBEDDING')
-    embedding_model = os.getenv('EMBEDDING_MODEL')
-    
-    embeddings, dimension = load_embedding_model(embedding_model)
-    logging.info(f'embedding model:{embeddings} and dimesion:{dimension}')
-    data_for_query = []
-    logging.info(f"update embedding and vector index for chunks")
-    for row in chunkId_chunkDoc_list:
-        # for graph_document in row['graph_doc']:
-        if isEmbedding.upper() == "TRUE":
-            embeddings_arr = embeddings.embed_query(row['chunk_doc'].page_content)
-            # logging.info(f'Embedding list {embeddings_arr}')
-                                    
-            data_for_query.append({
-                "chunkId": row['chunk_id'],
-                "embeddings": embeddings_arr
-            })
-            # graph.query("""MATCH (d:Document {fileName : $fileName})
-            #                MERGE (c:Chunk {id:$chunkId}) SET c.embedding = $embeddings 
-            #                MERGE (c)-[:PART_OF]->(d)
-            #             """,
-            #             {
-            #                 "fileName" : file_name,
-            #                 "chunkId": row['chunk_id'],
-            #                 "embeddings" : embeddings_arr
-            #             }
-            #             )
-            # logging.info('create vector index on chunk embedding')
-
-            graph.query("""CREATE VECTOR INDEX `vector` if not exists for (c:Chunk) on (c.embedding)
-                            OPTIONS {indexConfig: {
-                            `vector.dimensions`: $dimensions,
-                            `vector.similarity_function`: 'cosine'
-                            }}
-                        """,
-                        {
-                            "dimensions" : dimension
-                        }
-                        )
-    
-    query_to_create_embedding = """
-        UNWIND $data AS row
-        MATCH (d:Document {fileName: $fileName})
-        MERGE (c:Chunk {id: row.chunkId})
-        SET c.embedding = row.embeddings
-        MERGE (c)-[:PART_OF]->(d)
-    """       
-    graph.query(query_to_create_embedding, params={"fileName":file_name, "data":data_for_query})
-    
-def create_relation_between_chunks(graph, file_name, chunks: List[Document])->list:
+    if isEmbedding is None or isEmbedding.upper() != "TRUE":
+        return None
+    embeddings, dimension = load_embedding_model(os.getenv('EMBEDDING_MODEL'))
+    rows_to_embed = [row for row in chunk_rows if row['id'] not in skip_embedding_chunk_ids]
+    if rows_to_embed:
+        vectors = embed_documents_in_batches(embeddings, [row['pg_content'] for row in rows_to_embed])
+        for row, vector in zip(rows_to_embed, vectors):
+            row['embedding'] = vector
+    return dimension
+
+def create_relation_between_chunks(graph, file_name, chunks: Iterable[Document], skip_embedding_chunk_ids=frozenset())->list:
+    """Write all chunks of a document, see write_chunk_batches, and return their records."""
+    return [record for batch in write_chunk_batches(graph, file_name, get_chunk_records(chunks), skip_embedding_chunk_ids)
+            for record in batch]
+
+def write_chunk_batches(graph, file_name, chunk_records: Iterable[dict], skip_embedding_chunk_ids=frozenset()):
+    """
+    Write the chunks of a document with their embeddings, PART_OF, FIRST_CHUNK and NEXT_CHUNK
+    relationships, in one query per CHUNK_WRITE_BATCH_SIZE chunks, and yield every batch of
+    chunk records once it is written. Only one batch is held at a time, so downstream
+    extraction can start while later pages are still being chunked. Chunks in
+    skip_embedding_chunk_ids keep the embedding they already have.
+    """
     logging.info("creating FIRST_CHUNK and NEXT_CHUNK relationships between chunks")
-    current_chunk_id = ""
-    lst_chunks_including_hash = []
+    create_chunk_constraint(graph)
+    batch_size = int(os.environ.get('CHUNK_WRITE_BATCH_SIZE', 500))
+    previous_chunk_id = ""
+    batch = []
     batch_data = []
-    relationships = []
-    offset=0
-    for i, chunk in enumerate(chunks):
-        page_content_sha1 = hashlib.sha1(chunk.page_content.encode())
-        previous_chunk_id = current_chunk_id
-        current_chunk_id = page_content_sha1.hexdigest()
-        position = i + 1 
-        if i>0:
-            #offset += len(tiktoken.encoding_for_model("gpt2").encode(chunk.page_content))
-            offset += len(chunks[i-1].page_content)
-        if i == 0:
-            firstChunk = True
-        else:
-            firstChunk = False  
-        metadata = {"position": position,"length": len(chunk.page_content), "content_offset":offset}
-        chunk_document = Document(
-            page_content=chunk.page_content, metadata=metadata
-        )
-        
+    chunk_count = 0
+    batch_count = 0
+    for record in chunk_records:
+        chunk = record['chunk_doc']
         chunk_data = {
-            "id": current_chunk_id,
-            "pg_content": chunk_document.page_content,
-            "position": position,
-            "length": chunk_document.metadata["length"],
-            "f_name": file_name,
+            "id": record['chunk_id'],
+            "pg_content": chunk.page_content,
+            "position": record['position'],
+            "length": len(chunk.page_content),
             "previous_id" : previous_chunk_id,
-            "content_offset" : offset
+            "content_offset" : record['content_offset']
         }
+        previous_chunk_id = record['chunk_id']
         
         if 'page_number' in chunk.metadata:
             chunk_data['page_number'] = chunk.metadata['page_number']
@@ -129,50 +149,98 @@ def create_relation_between_chunks(graph, file_name, chunks: List[Document])->li
             chunk_data['end_time'] = chunk.metadata['end_time'] 
                
         batch_data.append(chunk_data)
-        
-        lst_chunks_including_hash.append({'chunk_id': current_chunk_id, 'chunk_doc': chunk})
-        
-        # create relationships between chunks
-        if firstChunk:
-            relationships.append({"type": "FIRST_CHUNK", "chunk_id": current_chunk_id})
-        else:
-            relationships.append({
-                "type": "NEXT_CHUNK",
-                "previous_chunk_id": previous_chunk_id,  # ID of previous chunk
-                "current_chunk_id": current_chunk_id
-            })
-          
-    query_to_create_chunk_and_PART_OF_relation = """
+        batch.append(record)
+        if len(batch) == batch_size:
+            write_chunks_with_embeddings(graph, file_name, batch_data, skip_embedding_chunk_ids)
+            chunk_count += len(batch)
+            batch_count += 1
+            yield batch
+            batch = []
+            batch_data = []
+
+    if batch:
+        write_chunks_with_embeddings(graph, file_name, batch_data, skip_embedding_chunk_ids)
+        chunk_count += len(batch)
+        batch_count += 1
+        yield batch
+    logging.info(f"Wrote {chunk_count} chunks of {file_name} in {batch_count} batches")
+
+def write_chunks_with_embeddings(graph, file_name, batch_data, skip_embedding_chunk_ids):
+    dimension = get_chunk_embeddings(batch_data, skip_embedding_chunk_ids)
+    if dimension is not None:
+        create_vector_index(graph, dimension)
+    write_chunk_batch(graph, file_name, batch_data)
+
+def write_chunk_batch(graph, file_name, batch_data):
+    # The previous chunk is MERGEd rather than MATCHed so NEXT_CHUNK does not depend on row order within the batch
+    query_to_write_chunks = """
+        MATCH (d:Document {fileName: $f_name})
         UNWIND $batch_data AS data
         MERGE (c:Chunk {id: data.id})
-        SET c.text = data.pg_content, c.position = data.position, c.length = data.length, c.fileName=data.f_name, c.content_offset=data.content_offset
-        WITH data, c
-        SET c.page_number = CASE WHEN data.page_number IS NOT NULL THEN data.page_number END,
-            c.start_time = CASE WHEN data.start_time IS NOT NULL THEN data.start_time END,
-            c.end_time = CASE WHEN data.end_time IS NOT NULL THEN data.end_time END
-        WITH data, c
-        MATCH (d:Document {fileName: data.f_name})
+        SET c.text = data.pg_content, c.position = data.position, c.length = data.length, c.fileName = $f_name,
+            c.content_offset = data.content_offset,
+            c.page_number = data.page_number, c.start_time = data.start_time, c.end_time = data.end_time
+        SET c.embedding = coalesce(data.embedding, c.embedding)
         MERGE (c)-[:PART_OF]->(d)
+        FOREACH (_ IN CASE WHEN data.position = 1 THEN [1] ELSE [] END |
+                 MERGE (d)-[:FIRST_CHUNK]->(c))
+        FOREACH (_ IN CASE WHEN data.previous_id <> '' THEN [1] ELSE [] END |
+                 MERGE (pc:Chunk {id: data.previous_id})
+                 MERGE (pc)-[:NEXT_CHUNK]->(c))
     """
-    graph.query(query_to_create_chunk_and_PART_OF_relation, params={"batch_data": batch_data})
-    
-    query_to_create_FIRST_relation = """ 
-        UNWIND $relationships AS relationship
+    graph.query(query_to_write_chunks, params={"f_name": file_name, "batch_data": batch_data})
+
+def get_document_chunks(graph, file_name):
+    """Chunk ids already PART_OF the document, mapped to whether their graph documents were saved for it."""
+    result = graph.query("""
+        MATCH (c:Chunk)-[p:PART_OF]->(d:Document {fileName: $f_name})
+        RETURN c.id AS id, p.extracted IS NOT NULL AS extracted
+        """, params={"f_name": file_name})
+    return {row['id']: row['extracted'] for row in result}
+
+def mark_chunks_extracted(graph, file_name, chunk_ids):
+    # Chunk ids are content hashes shared by every document with the same text, so the marker is on PART_OF
+    graph.query("""
         MATCH (d:Document {fileName: $f_name})
-        MATCH (c:Chunk {id: relationship.chunk_id})
-        FOREACH(r IN CASE WHEN relationship.type = 'FIRST_CHUNK' THEN [1] ELSE [] END |
-                MERGE (d)-[:FIRST_CHUNK]->(c))
-        """
-    graph.query(query_to_create_FIRST_relation, params={"f_name": file_name, "relationships": relationships})   
-    
-    query_to_create_NEXT_CHUNK_relation = """ 
-        UNWIND $relationships AS relationship
-        MATCH (c:Chunk {id: relationship.current_chunk_id})
-        WITH c, relationship
-        MATCH (pc:Chunk {id: relationship.previous_chunk_id})
-        FOREACH(r IN CASE WHEN relationship.type = 'NEXT_CHUNK' THEN [1] ELSE [] END |
-                MERGE (c)<-[:NEXT_CHUNK]-(pc))
+        UNWIND $chunk_ids AS chunk_id
+        MATCH (:Chunk {id: chunk_id})-[p:PART_OF]->(d)
+        SET p.extracted = datetime()
+        """, params={"f_name": file_name, "chunk_ids": chunk_ids})
+
+def detach_removed_chunks(graph, file_name, removed_chunk_ids, delete_orphan_entities=False):
+    """Detach chunks no longer in the document; chunks shared with no other document are deleted."""
+    if not removed_chunk_ids:
+        return
+    logging.info(f"Detaching {len(removed_chunk_ids)} chunks removed from {file_name}")
+    graph.query("""
+        MATCH (d:Document {fileName: $f_name})<-[p:PART_OF]-(c:Chunk) WHERE c.id IN $removed_chunk_ids
+        OPTIONAL MATCH (d)-[f:FIRST_CHUNK]->(c)
+        OPTIONAL MATCH (c)-[n:NEXT_CHUNK]-(:Chunk)-[:PART_OF]->(d)
+        DELETE p, f, n
+        """, params={"f_name": file_name, "removed_chunk_ids": removed_chunk_ids})
+    query_to_delete_unused_chunks = """
+        MATCH (c:Chunk) WHERE c.id IN $removed_chunk_ids AND NOT (c)-[:PART_OF]->(:Document)
+        OPTIONAL MATCH (c)-[:HAS_ENTITY]->(e)
+        WITH c, collect(DISTINCT e) AS entities
+        DETACH DELETE c
+        WITH entities
+        UNWIND entities AS e
+        WITH DISTINCT e WHERE $delete_orphan_entities AND NOT ()-[:HAS_ENTITY]->(e)
+        DETACH DELETE e
         """
-    graph.query(query_to_create_NEXT_CHUNK_relation, params={"relationships": relationships})   
-    
-    return lst_chunks_including_hash
\ No newline at end of file
+    graph.query(query_to_delete_unused_chunks, params={"removed_chunk_ids": removed_chunk_ids,
+                                                       "delete_orphan_entities": delete_orphan_entities})
+
+def delete_stale_chunk_links(graph, file_name, chunk_ids):
+    """Remove FIRST_CHUNK and NEXT_CHUNK links of the document that no longer match the chunk order."""
+    next_chunk_pairs = [{"previous_id": previous_id, "id": chunk_id} for previous_id, chunk_id in zip(chunk_ids, chunk_ids[1:])]
+    graph.query("""
+        MATCH (d:Document {fileName: $f_name})-[f:FIRST_CHUNK]->(c:Chunk)
+        WHERE c.id <> $first_chunk_id
+        DELETE f
+        """, params={"f_name": file_name, "first_chunk_id": chunk_ids[0] if chunk_ids else None})
+    graph.query("""
+        MATCH (d:Document {fileName: $f_name})<-[:PART_OF]-(pc:Chunk)-[n:NEXT_CHUNK]->(c:Chunk)-[:PART_OF]->(d)
+        WHERE NOT {previous_id: pc.id, id: c.id} IN $next_chunk_pairs
+        DELETE n
+        """, params={"f_name": file_name, "next_chunk_pairs": next_chunk_pairs})
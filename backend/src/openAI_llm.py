@@ -5,7 +5,7 @@ import logging
 import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor
 from langchain_experimental.graph_transformers import LLMGraphTransformer
-from src.llm import get_graph_document_list, get_combined_chunks, get_llm
+from src.llm import get_graph_document_list, get_combined_chunks, get_llm, get_prompt_token_count
 
 load_dotenv()
 logging.basicConfig(format='%(asctime)s - %(message)s',level='INFO')
@@ -14,7 +14,8 @@ def get_graph_from_OpenAI(model_version, graph, chunkId_chunkDoc_list, allowedNo
     futures=[]
     graph_document_list=[]
         
-    combined_chunk_document_list = get_combined_chunks(chunkId_chunkDoc_list)
+    prompt_tokens = get_prompt_token_count(model_version, allowedNodes, allowedRelationship)
+    combined_chunk_document_list = get_combined_chunks(chunkId_chunkDoc_list, model_version, prompt_tokens)
     
     llm,model_name = get_llm(model_version)  
     return  get_graph_document_list(llm, combined_chunk_document_list, allowedNodes, allowedRelationship)
@@ -1,9 +1,9 @@
-from neo4j import GraphDatabase
+from src.shared.graph_pool import get_graph_connection_pool
 import logging
 import time
 from langchain_community.graphs import Neo4jGraph
 import os
-from src.shared.common_fn import load_embedding_model
+from src.shared.common_fn import load_embedding_model, embed_documents_in_batches
 
 DROP_INDEX_QUERY = "DROP INDEX entities IF EXISTS;"
 LABELS_QUERY = "CALL db.labels()"
@@ -15,15 +15,15 @@ def create_fulltext(uri, username, password, database):
     logging.info("Starting the process of creating a full-text index.")
 
     try:
-        driver = GraphDatabase.driver(uri, auth=(username, password), database=database)
-        driver.verify_connectivity()
+        graph = get_graph_connection_pool().borrow(uri, username, password, database)
+        driver = graph._driver
         logging.info("Database connectivity verified.")
     except Exception as e:
         logging.error(f"Failed to create a database driver or verify connectivity: {e}")
         return
 
     try:
-        with driver.session() as session:
+        with driver.session(database=database) as session:
             try:
                 start_step = time.time()
                 session.run(DROP_INDEX_QUERY)
@@ -55,8 +55,8 @@ def create_fulltext(uri, username, password, database):
     except Exception as e:
         logging.error(f"An error occurred during the session: {e}")
     finally:
-        driver.close()
-        logging.info("Driver closed.")
+        get_graph_connection_pool().release(graph)
+        logging.info("Driver released.")
         logging.info(f"Process completed in {time.time() - start_time:.2f} seconds.")
 
         
@@ -78,8 +78,9 @@ def update_embeddings(rows, graph):
     embedding_model = os.getenv('EMBEDDING_MODEL')
     embeddings, dimension = load_embedding_model(embedding_model)
     logging.info(f"update embedding for entities")
-    for row in rows:
-        row['embedding'] = embeddings.embed_query(row['text'])                        
+    vectors = embed_documents_in_batches(embeddings, [row['text'] for row in rows])
+    for row, vector in zip(rows, vectors):
+        row['embedding'] = vector
     query = """
       UNWIND $rows AS row
       MATCH (e) WHERE elementId(e) = row.elementId
@@ -1,6 +1,7 @@
 import hashlib
 import logging
 from src.document_sources.youtube import create_youtube_url
+from src.shared.graph_pool import get_graph_connection_pool
 from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
 from langchain_google_vertexai import VertexAIEmbeddings
 from langchain_openai import OpenAIEmbeddings
@@ -11,11 +12,20 @@ from typing import List
 import re
 import os
 from pathlib import Path
+import threading
+import time
+import psutil
 from langchain_openai import ChatOpenAI
 from langchain_google_vertexai import ChatVertexAI
 from langchain_groq import ChatGroq
 from langchain_google_vertexai import HarmBlockThreshold, HarmCategory
 from langchain_experimental.graph_transformers.diffbot import DiffbotGraphTransformer
+
+_embedding_models = {}
+_embedding_model_locks = {}
+_embedding_model_stats = {}
+_embedding_models_lock = threading.Lock()
+
 # from neo4j.debug import watch
 
 # watch("neo4j")
@@ -66,15 +76,48 @@ def get_chunk_and_graphDocument(graph_document_list, chunkId_chunkDoc_list):
   return lst_chunk_chunkId_document  
                  
 def create_graph_database_connection(uri, userName, password, database):
-  enable_user_agent = os.environ.get("ENABLE_USER_AGENT", "False").lower() in ("true", "1", "yes")
-  if enable_user_agent:
-    graph = Neo4jGraph(url=uri, database=database, username=userName, password=password, refresh_schema=False, sanitize=True,driver_config={'user_agent':os.environ.get('NEO4J_USER_AGENT')})  
-  else:
-    graph = Neo4jGraph(url=uri, database=database, username=userName, password=password, refresh_schema=False, sanitize=True)    
-  return graph
-
+  """Borrow a pooled connection; every borrower must hand it back with close_db_connection."""
+  return get_graph_connection_pool().borrow(uri, userName, password, database)
 
 def load_embedding_model(embedding_model_name: str):
+    """
+    Return the shared (embeddings, dimension) pair for a model name.
+    Models are created lazily on first use and then reused by every request and thread.
+    """
+    registry_key = get_embedding_model_registry_key(embedding_model_name)
+    if registry_key in _embedding_models:
+        return _embedding_models[registry_key]
+    with _embedding_models_lock:
+        model_lock = _embedding_model_locks.setdefault(registry_key, threading.Lock())
+    with model_lock:
+        if registry_key not in _embedding_models:
+            rss_before = psutil.Process().memory_info().rss
+            start_time = time.perf_counter()
+            embeddings, dimension = create_embedding_model(embedding_model_name)
+            load_time = time.perf_counter() - start_time
+            memory_mb = (psutil.Process().memory_info().rss - rss_before) / (1024 * 1024)
+            _embedding_model_stats[registry_key] = {'load_time_seconds': round(load_time, 2), 'memory_mb': round(memory_mb, 1), 'dimension': dimension}
+            logging.info(f"Embedding model {registry_key} loaded in {load_time:.2f} seconds, memory increase {memory_mb:.1f} MB")
+            _embedding_models[registry_key] = (embeddings, dimension)
+    return _embedding_models[registry_key]
+
+def get_embedding_model_registry_key(embedding_model_name: str):
+    if embedding_model_name in ("openai", "vertexai"):
+        return embedding_model_name
+    return "all-MiniLM-L6-v2"
+
+def get_embedding_model_stats():
+    """Load time and resident memory increase of every embedding model loaded in this process."""
+    return dict(_embedding_model_stats)
+
+def warm_up_embedding_models(embedding_model_names: List[str]):
+    for embedding_model_name in embedding_model_names:
+        embeddings, dimension = load_embedding_model(embedding_model_name)
+        # first call initialises tokenizer and backend sessions
+        embeddings.embed_query("warm up")
+    return get_embedding_model_stats()
+
+def create_embedding_model(embedding_model_name: str):
     if embedding_model_name == "openai":
         embeddings = OpenAIEmbeddings()
         dimension = 1536
@@ -93,9 +136,101 @@ def load_embedding_model(embedding_model_name: str):
         logging.info(f"Embedding: Using SentenceTransformer , Dimension:{dimension}")
     return embeddings, dimension
 
-def save_graphDocuments_in_neo4j(graph:Neo4jGraph, graph_document_list:List[GraphDocument]):
-  # graph.add_graph_documents(graph_document_list, baseEntityLabel=True)
-  graph.add_graph_documents(graph_document_list)
+def embed_documents_in_batches(embeddings, texts: List[str], batch_size: int = None):
+    """
+    Embed texts with one embed_documents call per batch instead of one embed_query call per text.
+    Works for every backend returned by load_embedding_model (SentenceTransformer, OpenAI, VertexAI).
+    """
+    if batch_size is None:
+        batch_size = int(os.environ.get('EMBEDDING_BATCH_SIZE', 64))
+    vectors = []
+    for i in range(0, len(texts), batch_size):
+        vectors.extend(embeddings.embed_documents(texts[i:i+batch_size]))
+    return vectors
+    
+def escape_cypher_label(label: str):
+  """Backtick-escape a node label or relationship type so it can be written into a query."""
+  return '`' + label.replace('`', '``') + '`'
+
+def is_valid_cypher_label(label):
+  # an empty or blank label would make the escaped label, and with it the whole batch query, invalid
+  return bool(label and label.strip())
+
+def get_graph_document_write_batches(graph_document_list:List[GraphDocument]):
+  """
+  Nodes grouped by label and relationships grouped by (source label, type, target label),
+  de-duplicated by (label, id) and (source, type, target) with their properties merged. A node
+  keeps the first value seen for each property, as it is only written when the node is created.
+  """
+  nodes = {}
+  relationships = {}
+  for graph_document in graph_document_list:
+    for node in graph_document.nodes:
+      if not node.id or not is_valid_cypher_label(node.type):
+        continue
+      node_properties = nodes.setdefault(node.type, {}).setdefault(node.id, {})
+      for key, value in (node.properties or {}).items():
+        node_properties.setdefault(key, value)
+    for relationship in graph_document.relationships:
+      source, target = relationship.source, relationship.target
+      if not (source.id and is_valid_cypher_label(source.type) and target.id and is_valid_cypher_label(target.type)
+              and is_valid_cypher_label(relationship.type)):
+        continue
+      # relationship ends are merged like any other node, as add_graph_documents did
+      nodes.setdefault(source.type, {}).setdefault(source.id, {})
+      nodes.setdefault(target.type, {}).setdefault(target.id, {})
+      group = relationships.setdefault((source.type, relationship.type, target.type), {})
+      group.setdefault((source.id, target.id), {}).update(relationship.properties or {})
+  # rows are sorted so concurrent writers lock shared entities in the same order
+  node_batches = {label: [{'id': id, 'properties': properties} for id, properties in sorted(rows.items())]
+                  for label, rows in nodes.items()}
+  relationship_batches = {key: [{'source': source, 'target': target, 'properties': properties}
+                                for (source, target), properties in sorted(rows.items())]
+                          for key, rows in relationships.items()}
+  return node_batches, relationship_batches
+
+def write_graph_batch(tx, query, rows):
+  tx.run(query, rows=rows).consume()
+
+def save_graphDocuments_in_neo4j(graph:Neo4jGraph, graph_document_list:List[GraphDocument], batch_size:int=None):
+  """
+  Write the entities and relationships of the graph documents with one parameterized query per
+  label (or relationship type) and GRAPH_WRITE_BATCH_SIZE rows, instead of one document at a time.
+  Entity properties are only set when the entity is created, so a later chunk does not replace them.
+  Every batch is its own write transaction, which the driver retries on transient errors such as
+  deadlocks between /extract jobs that merge the same entities.
+  """
+  if batch_size is None:
+    batch_size = int(os.environ.get('GRAPH_WRITE_BATCH_SIZE', 1000))
+  node_batches, relationship_batches = get_graph_document_write_batches(graph_document_list)
+  start_time = time.perf_counter()
+  node_count = 0
+  relationship_count = 0
+  with graph._driver.session(database=graph._database) as session:
+    for label, rows in node_batches.items():
+      query = f"""
+        UNWIND $rows AS row
+        MERGE (n:{escape_cypher_label(label)} {{id: row.id}})
+        ON CREATE SET n += row.properties
+      """
+      for i in range(0, len(rows), batch_size):
+        session.execute_write(write_graph_batch, query, rows[i:i+batch_size])
+      node_count += len(rows)
+    for (source_label, relationship_type, target_label), rows in relationship_batches.items():
+      query = f"""
+        UNWIND $rows AS row
+        MATCH (source:{escape_cypher_label(source_label)} {{id: row.source}})
+        MATCH (target:{escape_cypher_label(target_label)} {{id: row.target}})
+        MERGE (source)-[r:{escape_cypher_label(relationship_type)}]->(target)
+        SET r += row.properties
+      """
+      for i in range(0, len(rows), batch_size):
+        session.execute_write(write_graph_batch, query, rows[i:i+batch_size])
+      relationship_count += len(rows)
+  elapsed = time.perf_counter() - start_time
+  entities_per_second = (node_count + relationship_count) / elapsed if elapsed else 0
+  logging.info(f"Wrote {node_count} nodes and {relationship_count} relationships of {len(graph_document_list)} graph documents in {elapsed:.2f} seconds ({entities_per_second:.0f} entities/sec)")
+  return node_count, relationship_count
 
 def delete_uploaded_local_file(merged_file_path, file_name):
   file_path = Path(merged_file_path)
@@ -104,10 +239,9 @@ def delete_uploaded_local_file(merged_file_path, file_name):
     logging.info(f'file {file_name} deleted successfully')
    
 def close_db_connection(graph, api_name):
-  if not graph._driver._closed:
-      logging.info(f"closing connection for {api_name} api")
-      # graph._driver.close()   
-  
+  logging.info(f"releasing connection for {api_name} api")
+  get_graph_connection_pool().release(graph)
+    
 def create_gcs_bucket_folder_name_hashed(uri, file_name):
   folder_name = uri + file_name
   folder_name_sha1 = hashlib.sha1(folder_name.encode())
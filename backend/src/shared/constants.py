@@ -8,6 +8,29 @@ MODEL_VERSIONS = {
         "openai-gpt-4o-mini":"gpt-4o-mini",        
         "groq-llama3" : "llama3-70b-8192"
          }
+# Context window in tokens per model version, used to size the chunk text of an extraction request
+MODEL_CONTEXT_WINDOWS = {
+        "openai-gpt-3.5": 16385,
+        "gemini-1.0-pro": 32760,
+        "gemini-1.5-pro": 1048576,
+        "openai-gpt-4": 128000,
+        "openai-gpt-4o": 128000,
+        "openai-gpt-4o-mini": 128000,
+        "groq-llama3": 8192,
+        "azure_ai_gpt_35": 16385,
+        "azure_ai_gpt_4o": 128000,
+        "anthropic_claude_3_5_sonnet": 200000,
+        "bedrock_claude_3_5_sonnet": 200000,
+        "fireworks_llama_v3_70b": 8192,
+        "groq_llama3_70b": 8192,
+        "ollama_llama3": 8192
+         }
+DEFAULT_CONTEXT_WINDOW = 8192
+# Smallest chunk budget per LLM request: six 200 token chunks, as NUMBER_OF_CHUNKS_TO_COMBINE = 6 used to send
+MIN_CHUNK_TOKENS_PER_REQUEST = 1200
+SENTENCE_ENDINGS = (".", "!", "?", "…")
+# Page text cleaning before chunking: quotes are dropped and newlines become spaces
+PAGE_TEXT_TRANSLATION = str.maketrans({'"': None, "'": None, "\n": " "})
 OPENAI_MODELS = ["openai-gpt-3.5", "openai-gpt-4o"]
 GEMINI_MODELS = ["gemini-1.0-pro", "gemini-1.5-pro"]
 GROQ_MODELS = ["groq-llama3"]
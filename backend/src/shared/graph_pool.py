@@ -0,0 +1,180 @@
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from langchain_community.graphs import Neo4jGraph
+
+
+class _PooledGraph:
+    def __init__(self, key, graph: Neo4jGraph, password_hash: str):
+        self.key = key
+        self.graph = graph
+        self.password_hash = password_hash
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.last_health_check = self.created_at
+        self.borrowed = 0
+        self.retired = False
+
+
+class GraphConnectionPool:
+    """
+    Registry of Neo4jGraph connections shared across API requests.
+
+    Connections are keyed by (uri, userName, database) and re-verified against the
+    password of every borrower. A connection is health-checked when it has not been
+    verified for health_check_seconds, retired when it has been idle for ttl_seconds,
+    and the least recently used idle connections are retired once more than max_size
+    keys are open. A retired connection is closed only after its last borrower releases it.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float, health_check_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.health_check_seconds = health_check_seconds
+        self._entries = {}
+        self._borrowed_graphs = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _hash_password(password):
+        return hashlib.sha256((password or '').encode()).hexdigest()
+
+    def borrow(self, uri, userName, password, database=None) -> Neo4jGraph:
+        key = (uri, userName, database)
+        password_hash = self._hash_password(password)
+        with self._lock:
+            self._evict_expired()
+            entry = self._entries.get(key)
+            if entry is not None and not hmac.compare_digest(entry.password_hash, password_hash):
+                entry = None
+            if entry is not None and time.monotonic() - entry.last_health_check > self.health_check_seconds:
+                if self._is_healthy(entry):
+                    entry.last_health_check = time.monotonic()
+                else:
+                    self._retire(key, entry)
+                    entry = None
+            if entry is not None:
+                return self._checkout(entry)
+
+        # Connect outside the lock so a slow or unreachable database does not block other borrowers
+        graph = create_neo4j_graph(uri, userName, password, database)
+        with self._lock:
+            existing_entry = self._entries.get(key)
+            if existing_entry is not None:
+                self._retire(key, existing_entry)
+            entry = _PooledGraph(key, graph, password_hash)
+            self._entries[key] = entry
+            self._evict_over_capacity()
+            logging.info(f"Opened pooled Neo4j connection for {uri}, database {database}")
+            return self._checkout(entry)
+
+    def release(self, graph: Neo4jGraph):
+        with self._lock:
+            entry = self._borrowed_graphs.get(id(graph))
+            if entry is None:
+                return
+            entry.borrowed -= 1
+            entry.last_used = time.monotonic()
+            if entry.borrowed == 0:
+                del self._borrowed_graphs[id(graph)]
+                if entry.retired:
+                    self._close(entry)
+
+    def get_connection_key(self, graph: Neo4jGraph):
+        """Return (uri, database) of a pooled graph, or None when the graph is not managed by the pool."""
+        with self._lock:
+            entry = self._borrowed_graphs.get(id(graph))
+            if entry is None:
+                entry = next((entry for entry in self._entries.values() if entry.graph is graph), None)
+            if entry is None:
+                return None
+            uri, userName, database = entry.key
+            return uri, database
+
+    def close_all(self):
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                self._retire(key, entry)
+
+    def _checkout(self, entry: _PooledGraph):
+        entry.borrowed += 1
+        entry.last_used = time.monotonic()
+        self._borrowed_graphs[id(entry.graph)] = entry
+        return entry.graph
+
+    def _is_healthy(self, entry: _PooledGraph):
+        try:
+            entry.graph._driver.verify_connectivity()
+            return True
+        except Exception as e:
+            logging.warning(f"Pooled Neo4j connection failed health check: {e}")
+            return False
+
+    def _retire(self, key, entry: _PooledGraph):
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+        entry.retired = True
+        if entry.borrowed == 0:
+            self._close(entry)
+
+    def _close(self, entry: _PooledGraph):
+        try:
+            entry.graph._driver.close()
+        except Exception as e:
+            logging.warning(f"Unable to close pooled Neo4j connection: {e}")
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for key, entry in list(self._entries.items()):
+            if entry.borrowed == 0 and now - entry.last_used > self.ttl_seconds:
+                logging.info(f"Closing idle Neo4j connection for {key[0]}, database {key[2]}")
+                self._retire(key, entry)
+
+    def _evict_over_capacity(self):
+        idle_entries = sorted(
+            ((key, entry) for key, entry in self._entries.items() if entry.borrowed == 0),
+            key=lambda item: item[1].last_used,
+        )
+        while len(self._entries) > self.max_size and idle_entries:
+            key, entry = idle_entries.pop(0)
+            self._retire(key, entry)
+        if len(self._entries) > self.max_size:
+            logging.warning(f"Neo4j connection pool holds {len(self._entries)} busy connections, above NEO4J_POOL_MAX_SIZE={self.max_size}")
+
+
+def create_neo4j_graph(uri, userName, password, database):
+    driver_config = {'max_connection_pool_size': int(os.environ.get('NEO4J_MAX_CONNECTION_POOL_SIZE', 100))}
+    enable_user_agent = os.environ.get("ENABLE_USER_AGENT", "False").lower() in ("true", "1", "yes")
+    if enable_user_agent:
+        driver_config['user_agent'] = os.environ.get('NEO4J_USER_AGENT')
+    return Neo4jGraph(url=uri, database=database, username=userName, password=password, refresh_schema=False, sanitize=True, driver_config=driver_config)
+
+
+_graph_connection_pool = None
+_graph_connection_pool_lock = threading.Lock()
+
+
+def get_graph_connection_pool() -> GraphConnectionPool:
+    global _graph_connection_pool
+    with _graph_connection_pool_lock:
+        if _graph_connection_pool is None:
+            _graph_connection_pool = GraphConnectionPool(
+                max_size=int(os.environ.get('NEO4J_POOL_MAX_SIZE', 20)),
+                ttl_seconds=float(os.environ.get('NEO4J_POOL_TTL_SECONDS', 1800)),
+                health_check_seconds=float(os.environ.get('NEO4J_POOL_HEALTH_CHECK_SECONDS', 60)),
+            )
+    return _graph_connection_pool
+
+
+@contextmanager
+def borrowed_driver(uri, userName, password, database=None):
+    """Borrow the neo4j driver of a pooled connection for modules that run raw driver queries."""
+    graph = get_graph_connection_pool().borrow(uri, userName, password, database)
+    try:
+        yield graph._driver
+    finally:
+        get_graph_connection_pool().release(graph)
@@ -0,0 +1,176 @@
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# backend/schemas, shipped with the backend image
+SCHEMAS_DIR = Path(__file__).resolve().parents[2] / "schemas"
+
+TAXONOMY_CLASS_PATTERN = re.compile(r"\((\w+):Class \{name: '([^']*)'\}\)")
+TAXONOMY_SUBCLASS_PATTERN = re.compile(r"\((\w+)(?::Class[^)]*)?\)-\[:SUBCLASS_OF\]->\((\w+)(?::Class[^)]*)?\)")
+TAXONOMY_RELATION_PATTERN = re.compile(
+    r"\((\w+)(?::Class[^)]*)?\)-\[:RELATION \{name: '([^']*)'\}\]->\((\w+)(?::Class[^)]*)?\)")
+TTL_STATEMENT_END = re.compile(r"\s\.\s*$", re.M)
+TTL_SUBJECT = re.compile(r"^\s*<([^>]+)>")
+TTL_SUBCLASS = re.compile(r"rdfs:subClassOf\s+<([^>]+)>")
+TTL_CLASS_LIST = re.compile(r"<([^>]+)>")
+
+
+def normalize_schema_name(name):
+    # LLMGraphTransformer capitalizes node types and upper-cases relationship types with underscores
+    return re.sub(r"[\s_]+", " ", name.replace("’", "'")).strip().casefold()
+
+
+class SchemaProfile:
+    """
+    Named extraction schema: the node labels and relationship types sent to the LLM, and
+    the (source label, relationship type, target label) triples extracted relationships
+    are checked against. A triple also allows the subclasses of its labels; None stands
+    for any label. Relationship types without triples are not checked.
+    """
+
+    def __init__(self, profile_id: str, allowed_nodes: List[str], allowed_relationships: List[str],
+                 triples: List[Tuple[Optional[str], str, Optional[str]]], parents: Dict[str, List[str]]):
+        self.profile_id = profile_id
+        # tuples, the form the prompt and LLMGraphTransformer caches are keyed by
+        self.allowed_nodes = tuple(dict.fromkeys(allowed_nodes))
+        self.allowed_relationships = tuple(dict.fromkeys(allowed_relationships))
+        self._labels = {normalize_schema_name(label) for label in self.allowed_nodes}
+        self._relationship_types = {normalize_schema_name(rel_type) for rel_type in self.allowed_relationships}
+        self._parents = {normalize_schema_name(label): [normalize_schema_name(parent) for parent in label_parents]
+                         for label, label_parents in parents.items()}
+        self._triples = {}
+        for source, rel_type, target in triples:
+            self._triples.setdefault(normalize_schema_name(rel_type), set()).add(
+                (normalize_schema_name(source) if source else None, normalize_schema_name(target) if target else None))
+
+    def _with_ancestors(self, label):
+        labels, pending = [label], [label]
+        while pending:
+            for parent in self._parents.get(pending.pop(), []):
+                if parent not in labels:
+                    labels.append(parent)
+                    pending.append(parent)
+        return labels + [None]
+
+    def is_allowed_relationship(self, source_type, rel_type, target_type):
+        rel_key = normalize_schema_name(rel_type)
+        if rel_key not in self._relationship_types:
+            return False
+        allowed_pairs = self._triples.get(rel_key)
+        if not allowed_pairs:
+            return True
+        sources = self._with_ancestors(normalize_schema_name(source_type))
+        targets = self._with_ancestors(normalize_schema_name(target_type))
+        return any((source, target) in allowed_pairs for source in sources for target in targets)
+
+    def validate_graph_documents(self, graph_documents):
+        """Drops nodes with labels outside the profile and relationships outside its triples, in place."""
+        dropped_nodes = dropped_relationships = 0
+        for graph_document in graph_documents:
+            nodes = [node for node in graph_document.nodes if normalize_schema_name(node.type) in self._labels]
+            relationships = [rel for rel in graph_document.relationships
+                             if normalize_schema_name(rel.source.type) in self._labels
+                             and normalize_schema_name(rel.target.type) in self._labels
+                             and self.is_allowed_relationship(rel.source.type, rel.type, rel.target.type)]
+            dropped_nodes += len(graph_document.nodes) - len(nodes)
+            dropped_relationships += len(graph_document.relationships) - len(relationships)
+            graph_document.nodes, graph_document.relationships = nodes, relationships
+        if dropped_nodes or dropped_relationships:
+            logging.info(f"Schema profile {self.profile_id} dropped {dropped_nodes} nodes and {dropped_relationships} relationships")
+        return graph_documents
+
+
+def parse_taxonomy_cypher(profile_id, file_path):
+    """Classes, SUBCLASS_OF and RELATION {name} edges of a taxonomy written as Cypher CREATE statements."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    names = dict(TAXONOMY_CLASS_PATTERN.findall(text))
+    parents = {}
+    for child, parent in TAXONOMY_SUBCLASS_PATTERN.findall(text):
+        parents.setdefault(names[child], []).append(names[parent])
+    triples = [(names[source], rel_name.replace(" ", "_"), names[target])
+               for source, rel_name, target in TAXONOMY_RELATION_PATTERN.findall(text)]
+    relationships = [rel_type for _, rel_type, _ in triples]
+    return SchemaProfile(profile_id, list(names.values()), relationships, triples, parents)
+
+
+def parse_ontology_ttl(profile_id, file_path):
+    """owl:Class and rdfs:subClassOf declarations and owl:ObjectProperty domains and ranges of a Turtle ontology."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        text = "\n".join(line for line in f.read().splitlines() if not line.lstrip().startswith("#"))
+    classes, parents, relationships, triples = [], {}, [], []
+    for statement in TTL_STATEMENT_END.split(text):
+        subject = TTL_SUBJECT.match(statement)
+        if subject is None:
+            continue
+        name = subject.group(1)
+        subclass_of = TTL_SUBCLASS.search(statement)
+        if "rdf:type owl:Class" in statement or subclass_of:
+            classes.append(name)
+            if subclass_of:
+                parents.setdefault(name, []).append(subclass_of.group(1))
+        elif "rdf:type owl:ObjectProperty" in statement:
+            relationships.append(name)
+            domain = get_ttl_classes(statement, "rdfs:domain")
+            target_range = get_ttl_classes(statement, "rdfs:range")
+            triples.extend((source, name, target) for source in domain for target in target_range)
+    return SchemaProfile(profile_id, classes, relationships, triples, parents)
+
+
+def get_ttl_classes(statement, predicate):
+    # <Class>, [ owl:unionOf (<A> <B>) ], or owl:Class for any class (None)
+    match = re.search(predicate + r"\s+(<[^>]+>|\[[^\]]*\]|owl:Class)", statement)
+    if match is None or match.group(1) == "owl:Class":
+        return [None]
+    return TTL_CLASS_LIST.findall(match.group(1))
+
+
+_profiles = None
+_profiles_lock = threading.Lock()
+
+
+def get_schema_profiles():
+    """Profiles by id, parsed from the ontology files on first use; a missing file is an error."""
+    global _profiles
+    with _profiles_lock:
+        if _profiles is None:
+            sources = [
+                ("taxonomy", parse_taxonomy_cypher, os.environ.get("SCHEMA_TAXONOMY_PATH") or SCHEMAS_DIR / "taxonomy.cypher"),
+                ("ontology", parse_ontology_ttl, os.environ.get("SCHEMA_ONTOLOGY_PATH") or SCHEMAS_DIR / "ontology.ttl"),
+            ]
+            profiles = {}
+            for profile_id, parse, file_path in sources:
+                if not os.path.exists(file_path):
+                    raise Exception(f"Schema profile {profile_id} not available, {file_path} not found")
+                profile = parse(profile_id, file_path)
+                profiles[profile_id] = profile
+                logging.info(f"Loaded schema profile {profile_id} with {len(profile.allowed_nodes)} node labels "
+                             f"and {len(profile.allowed_relationships)} relationship types")
+            _profiles = profiles
+        return _profiles
+
+
+def get_schema_profile(profile_id):
+    profile = get_schema_profiles().get(profile_id)
+    if profile is None:
+        raise Exception(f"Unknown schema profile: {profile_id}")
+    return profile
+
+
+def get_schema_profile_for(allowedNodes, allowedRelationship):
+    # The profile whose schema a request uses, e.g. to validate what was extracted with it
+    for profile in get_schema_profiles().values():
+        if tuple(allowedNodes or ()) == profile.allowed_nodes and tuple(allowedRelationship or ()) == profile.allowed_relationships:
+            return profile
+    return None
+
+
+def resolve_allowed_schema(schema_profile, allowedNodes, allowedRelationship):
+    """allowedNodes and allowedRelationship of the named profile, or the ones given when no profile is named."""
+    if not schema_profile:
+        return allowedNodes, allowedRelationship
+    profile = get_schema_profile(schema_profile)
+    return profile.allowed_nodes, profile.allowed_relationships
@@ -0,0 +1,53 @@
+import logging
+import threading
+from collections import defaultdict
+
+STATUS_EVENT_FIELDS = ('status', 'processingTime', 'nodeCount', 'relationshipCount', 'model',
+                       'total_chunks', 'total_pages', 'fileSize', 'processed_chunk', 'fileSource')
+
+
+class DocumentStatusEventBus:
+    """
+    In-process publish/subscribe channel for Document node progress.
+
+    Events are keyed by (uri, database, file_name) and carry only the status fields that
+    changed. Subscribers are plain callables invoked on the publishing thread, so they
+    must hand the event off quickly (e.g. loop.call_soon_threadsafe onto an asyncio queue).
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def publish(self, key, event: dict):
+        event = {field: value for field, value in event.items() if field in STATUS_EVENT_FIELDS}
+        if not event:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers.get(key, ()))
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                logging.warning(f"Status event subscriber failed for {key[2]}: {e}")
+
+    def subscribe(self, key, callback):
+        with self._lock:
+            self._subscribers[key].append(callback)
+
+    def unsubscribe(self, key, callback):
+        with self._lock:
+            subscribers = self._subscribers.get(key)
+            if subscribers is None:
+                return
+            if callback in subscribers:
+                subscribers.remove(callback)
+            if not subscribers:
+                del self._subscribers[key]
+
+
+document_status_event_bus = DocumentStatusEventBus()
+
+
+def get_status_event_key(uri, database, file_name):
+    return (uri, database or None, file_name)
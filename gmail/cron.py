@@ -1,20 +1,5 @@
-import os
-import time
-from retrieve_emails import RetrieveEmail
-from orchestrator import send_emails
-
-def job():
-    r = RetrieveEmail()
-    r.retrieve_emails()
-    send_emails()
+from pipeline import run_pipeline
 
 if __name__ == "__main__":
-    CREDENTIALS_FILE_PATH = "/root/one-mail-tb/gmail/credentials/token.pickle"
-    
-    while True:
-        if os.path.exists(CREDENTIALS_FILE_PATH):
-            job()
-        else:
-            print(f"'{CREDENTIALS_FILE_PATH}' not found. Skipping job execution.")
-        
-        time.sleep(60)  # Wait for 60 seconds before running the job again
\ No newline at end of file
+    # Polls the mailbox and hands new messages to the OCR, upload and extract stages as they arrive
+    run_pipeline()
@@ -0,0 +1,233 @@
+"""
+In-memory stand-in for the Gmail API service used by RetrieveEmail, for running the
+retrieval without a Google account:
+
+    service = FakeGmailService()
+    service.add_message("thread-1", "Bonjour", attachments={"devis.pdf": b"%PDF-1.4 ..."})
+    RetrieveEmail(service=service).retrieve_emails()
+
+It supports the calls RetrieveEmail makes: threads().list/get, messages().attachments().get,
+history().list, getProfile and new_batch_http_request. Every HTTP request is counted in
+http_requests (a batch counts once) and can be slowed down with latency_seconds.
+
+Running the module compares a full sync with an incremental sync in a temporary folder:
+
+    python fake_gmail_service.py --threads 60 --latency 0.05
+"""
+import argparse
+import base64
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+import httplib2
+from googleapiclient.errors import HttpError
+
+
+def encode_data(data):
+    return base64.urlsafe_b64encode(data).decode("ASCII")
+
+
+class FakeRequest:
+    def __init__(self, service, method, handler):
+        self.service = service
+        self.method = method
+        self.handler = handler
+
+    def execute(self):
+        self.service.record_request(self.method)
+        return self.handler()
+
+
+class FakeBatchRequest:
+    def __init__(self, service, callback=None):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request, callback or self.callback, request_id or str(len(self.requests) + 1)))
+
+    def execute(self):
+        self.service.record_request("batch")
+        for request, callback, request_id in self.requests:
+            self.service.record_call(request.method)
+            try:
+                response, exception = request.handler(), None
+            except HttpError as error:
+                response, exception = None, error
+            callback(request_id, response, exception)
+
+
+class FakeGmailService:
+    def __init__(self, latency_seconds=0):
+        self.latency_seconds = latency_seconds
+        self.thread_data = {}
+        self.attachments = {}
+        self.history_records = []
+        self.history_id = 1
+        # history records older than this are gone, as after Gmail's retention period
+        self.min_history_id = 1
+        self.http_requests = 0
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def record_call(self, method):
+        with self._lock:
+            self.calls[method] += 1
+
+    def record_request(self, method):
+        with self._lock:
+            self.http_requests += 1
+        self.record_call(method)
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    def add_message(self, thread_id, text, attachments=None, labels=("CATEGORY_PERSONAL",),
+                    sender="client@example.com", subject="Demande de devis"):
+        with self._lock:
+            self.history_id += 1
+            message_id = f"{thread_id}-{len(self.thread_data.get(thread_id, {}).get('messages', [])) + 1}"
+            parts = [{"mimeType": "text/plain", "filename": "", "body": {"data": encode_data(text.encode("utf-8"))}}]
+            for file_name, data in (attachments or {}).items():
+                attachment_id = f"{message_id}-{file_name}"
+                self.attachments[(message_id, attachment_id)] = encode_data(data)
+                parts.append({"mimeType": "application/octet-stream", "filename": file_name,
+                              "body": {"attachmentId": attachment_id, "size": len(data)}})
+            message = {
+                "id": message_id,
+                "threadId": thread_id,
+                "labelIds": list(labels),
+                "snippet": text[:100],
+                "historyId": str(self.history_id),
+                "internalDate": str(int(time.time() * 1000)),
+                "sizeEstimate": len(text),
+                "payload": {"mimeType": "multipart/mixed",
+                            "headers": [{"name": "From", "value": f"Client <{sender}>"},
+                                        {"name": "Subject", "value": subject}],
+                            "parts": parts},
+            }
+            thread = self.thread_data.setdefault(thread_id, {"id": thread_id, "messages": []})
+            thread["messages"].append(message)
+            thread["historyId"] = str(self.history_id)
+            self.history_records.append({"id": str(self.history_id),
+                                         "messagesAdded": [{"message": {"id": message_id, "threadId": thread_id}}]})
+            return message_id
+
+    def expire_history(self):
+        self.min_history_id = self.history_id + 1
+
+    def _not_found(self, message):
+        return HttpError(httplib2.Response({"status": "404"}), message.encode("utf-8"))
+
+    # users() resources
+    def users(self):
+        return self
+
+    def threads(self):
+        return FakeThreads(self)
+
+    def messages(self):
+        return FakeMessages(self)
+
+    def history(self):
+        return FakeHistory(self)
+
+    def getProfile(self, userId="me"):
+        return FakeRequest(self, "getProfile", lambda: {"emailAddress": "me@example.com", "historyId": str(self.history_id)})
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatchRequest(self, callback)
+
+
+class FakeThreads:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId="me", labelIds=None, maxResults=100):
+        def handler():
+            threads = sorted(self.service.thread_data.values(), key=lambda thread: int(thread["historyId"]), reverse=True)
+            return {"threads": [{"id": thread["id"], "historyId": thread["historyId"]} for thread in threads[:maxResults]]}
+        return FakeRequest(self.service, "threads.list", handler)
+
+    def get(self, userId="me", id=None):
+        def handler():
+            if id not in self.service.thread_data:
+                raise self.service._not_found(f"Thread {id} not found")
+            return self.service.thread_data[id]
+        return FakeRequest(self.service, "threads.get", handler)
+
+
+class FakeMessages:
+    def __init__(self, service):
+        self.service = service
+
+    def attachments(self):
+        return self
+
+    def get(self, userId="me", messageId=None, id=None):
+        def handler():
+            data = self.service.attachments.get((messageId, id))
+            if data is None:
+                raise self.service._not_found(f"Attachment {id} not found")
+            return {"attachmentId": id, "data": data, "size": len(data)}
+        return FakeRequest(self.service, "attachments.get", handler)
+
+
+class FakeHistory:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId="me", startHistoryId=None, historyTypes=None, pageToken=None, maxResults=100):
+        def handler():
+            if int(startHistoryId) < self.service.min_history_id:
+                raise self.service._not_found("Requested entity was not found.")
+            records = [record for record in self.service.history_records if int(record["id"]) > int(startHistoryId)]
+            start = int(pageToken or 0)
+            response = {"history": records[start:start + maxResults], "historyId": str(self.service.history_id)}
+            if start + maxResults < len(records):
+                response["nextPageToken"] = str(start + maxResults)
+            return response
+        return FakeRequest(self.service, "history.list", handler)
+
+
+def main():
+    from retrieve_emails import RetrieveEmail
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=60)
+    parser.add_argument("--attachments", type=int, default=2)
+    parser.add_argument("--new-messages", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    service = FakeGmailService(latency_seconds=args.latency)
+    for i in range(args.threads):
+        service.add_message(f"thread-{i}", f"Demande de devis {i}",
+                            attachments={f"piece_{j}.pdf": os.urandom(1024) for j in range(args.attachments)})
+
+    work_dir = tempfile.mkdtemp(prefix="gmail-sync-")
+    cwd = os.getcwd()
+    try:
+        # RetrieveEmail writes threads_metadata.json, sync_state.json, new_emails and threads/ in the working directory
+        os.chdir(work_dir)
+        print(f"{'sync':>12} {'seconds':>8} {'HTTP requests':>14} {'threads.get':>12} {'attachments.get':>16}")
+        for name in ("full", "incremental"):
+            if name == "incremental":
+                for i in range(args.new_messages):
+                    service.add_message(f"thread-{i}", f"Relance {i}", attachments={"plan.jpg": os.urandom(1024)})
+            service.http_requests, service.calls = 0, Counter()
+            start = time.perf_counter()
+            RetrieveEmail(service=service).retrieve_emails()
+            elapsed = time.perf_counter() - start
+            print(f"{name:>12} {elapsed:>8.2f} {service.http_requests:>14} {service.calls['threads.get']:>12} "
+                  f"{service.calls['attachments.get']:>16}")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+OCR throughput (pages/sec) for attachments of many threads: one predictor call per
+file, as the orchestrator did before, versus OcrEngine batching pages across files.
+
+The sample images of POC_Documents/V1 are copied --copies times into a temporary
+folder, each copy with a different trailing byte so the content hash cache does not
+apply; a last engine run over the same files shows the cached throughput.
+
+    python ocr_benchmark.py --copies 20 --batch-size 16 --decode-workers 4
+"""
+import argparse
+import glob
+import os
+import shutil
+import tempfile
+import time
+from doctr.models import ocr_predictor
+from doctr.io import DocumentFile
+from ocr_engine import OcrEngine
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "POC_Documents", "V1")
+
+
+def make_attachments(target_dir, copies):
+    samples = sorted(glob.glob(os.path.join(SAMPLE_DIR, "*.jpg")))
+    if not samples:
+        raise Exception(f"No sample images in {SAMPLE_DIR}")
+    file_paths = []
+    for copy in range(copies):
+        for sample in samples:
+            file_path = os.path.join(target_dir, f"{copy}_{os.path.basename(sample)}")
+            shutil.copyfile(sample, file_path)
+            # JPEG decoders ignore bytes after the end marker
+            with open(file_path, "ab") as file:
+                file.write(str(copy).encode())
+            file_paths.append(file_path)
+    return file_paths
+
+
+def ocr_sequential(predictor, file_paths):
+    pages = 0
+    for file_path in file_paths:
+        doc = DocumentFile.from_images(file_path)
+        predictor(doc).render()
+        pages += len(doc)
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--copies", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--decode-workers", type=int, default=4)
+    args = parser.parse_args()
+
+    predictor = ocr_predictor(pretrained=True)
+    work_dir = tempfile.mkdtemp(prefix="ocr-benchmark-")
+    try:
+        file_paths = make_attachments(work_dir, args.copies)
+        # warm up the model so the first run does not pay for loading weights
+        ocr_sequential(predictor, file_paths[:1])
+
+        print(f"{'strategy':>12} {'files':>6} {'pages':>6} {'seconds':>8} {'pages/s':>8}")
+        start = time.perf_counter()
+        pages = ocr_sequential(predictor, file_paths)
+        elapsed = time.perf_counter() - start
+        print(f"{'per file':>12} {len(file_paths):>6} {pages:>6} {elapsed:>8.2f} {pages / elapsed:>8.2f}")
+
+        engine = OcrEngine(predictor, batch_size=args.batch_size, decode_workers=args.decode_workers,
+                           cache_dir=os.path.join(work_dir, "cache"))
+        # the cached run predicts no pages, its throughput is for the pages of the batched run
+        for name in ("batched", "cached"):
+            start = time.perf_counter()
+            engine.ocr_files(file_paths)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>12} {len(file_paths):>6} {pages:>6} {elapsed:>8.2f} {pages / elapsed:>8.2f}")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
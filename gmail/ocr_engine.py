@@ -0,0 +1,163 @@
+import hashlib
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from doctr.io import DocumentFile
+
+OCR_EXTENSIONS = ('.jpg', '.png', '.pdf')
+# Same threshold as process_pdf_or_image: shorter renders are treated as no text
+MIN_OCR_TEXT_LENGTH = 20
+# doctr Document.render() joins pages with this separator
+PAGE_BREAK = "\n\n\n\n"
+
+
+def get_content_hash(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def decode_document_file(file_path):
+    # Runs in the decode pool; returns the page images of a PDF or image attachment
+    if file_path.endswith(".pdf"):
+        return DocumentFile.from_pdf(file_path)
+    return DocumentFile.from_images(file_path)
+
+
+class OcrEngine:
+    """
+    OCR for many attachments at once.
+
+    Attachments are decoded into page images by a pool of decode_workers threads, and
+    the pages of all attachments are sent to the doctr predictor in batches of
+    batch_size pages, so small attachments share predictor calls. Results are cached
+    on disk by attachment content hash: an attachment forwarded in several threads is
+    only OCR'd once.
+    """
+
+    def __init__(self, predictor, batch_size=None, decode_workers=None, cache_dir=None):
+        self.predictor = predictor
+        self.batch_size = batch_size or int(os.getenv("OCR_BATCH_SIZE", 16))
+        self.decode_workers = decode_workers or int(os.getenv("OCR_DECODE_WORKERS", 4))
+        self.cache_dir = cache_dir or os.getenv("OCR_CACHE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "ocr_cache")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.cache_hits = 0
+        self.pages_processed = 0
+
+    def _cache_path(self, content_hash):
+        return os.path.join(self.cache_dir, f"{content_hash}.txt")
+
+    def _read_cache(self, content_hash):
+        cache_path = self._cache_path(content_hash)
+        if not os.path.exists(cache_path):
+            return False, None
+        with open(cache_path, "r", encoding="UTF-8") as cache_file:
+            text = cache_file.read()
+        # an empty entry records an attachment without text
+        return True, text or None
+
+    def _write_cache(self, content_hash, text):
+        cache_path = self._cache_path(content_hash)
+        with open(cache_path + ".tmp", "w", encoding="UTF-8") as cache_file:
+            cache_file.write(text or "")
+        os.replace(cache_path + ".tmp", cache_path)
+
+    def ocr_files(self, file_paths):
+        """OCR text of every file, keyed by path; None when a file has no text or cannot be read."""
+        results = {}
+        paths_by_hash = {}
+        for file_path in file_paths:
+            content_hash = get_content_hash(file_path)
+            is_cached, text = self._read_cache(content_hash)
+            if is_cached:
+                self.cache_hits += 1
+                results[file_path] = text
+            else:
+                paths_by_hash.setdefault(content_hash, []).append(file_path)
+
+        # one representative file per content hash is decoded and OCR'd
+        pending = [(content_hash, same_paths[0]) for content_hash, same_paths in paths_by_hash.items()]
+        rendered_pages = {content_hash: [] for content_hash, _ in pending}
+        page_batch = []
+        # decodes run at most 2 * decode_workers files ahead of the predictor, so the page
+        # images held in memory do not grow with the number of attachments
+        pending_files = iter(pending)
+        decoded = deque()
+        with ThreadPoolExecutor(max_workers=self.decode_workers) as executor:
+            for content_hash, file_path in itertools.islice(pending_files, 2 * self.decode_workers):
+                decoded.append((content_hash, file_path, executor.submit(decode_document_file, file_path)))
+            while decoded:
+                content_hash, file_path, future = decoded.popleft()
+                for next_hash, next_path in itertools.islice(pending_files, 1):
+                    decoded.append((next_hash, next_path, executor.submit(decode_document_file, next_path)))
+                try:
+                    pages = future.result()
+                except Exception as e:
+                    print(f"Error processing {file_path}: {e}")
+                    rendered_pages[content_hash] = None
+                    continue
+                for page in pages:
+                    page_batch.append((content_hash, page))
+                    if len(page_batch) == self.batch_size:
+                        self._predict(page_batch, rendered_pages)
+                        page_batch = []
+                # the page images are only kept by page_batch until their predictor call
+                del future, pages
+        if page_batch:
+            self._predict(page_batch, rendered_pages)
+
+        for content_hash, same_paths in paths_by_hash.items():
+            pages = rendered_pages[content_hash]
+            text = PAGE_BREAK.join(pages) if pages is not None else None
+            if text is not None and len(text.strip()) < MIN_OCR_TEXT_LENGTH:
+                text = None
+            if pages is not None:
+                self._write_cache(content_hash, text)
+            for file_path in same_paths:
+                results[file_path] = text
+        return results
+
+    def _predict(self, page_batch, rendered_pages):
+        batch_hashes = [content_hash for content_hash, _ in page_batch]
+        try:
+            result = self.predictor([page for _, page in page_batch])
+            for content_hash, page in zip(batch_hashes, result.pages):
+                if rendered_pages[content_hash] is not None:
+                    rendered_pages[content_hash].append(page.render())
+        except Exception as e:
+            print(f"Error running OCR on a batch of {len(page_batch)} pages: {e}")
+            for content_hash in set(batch_hashes):
+                rendered_pages[content_hash] = None
+        self.pages_processed += len(page_batch)
+
+
+def ocr_files_in_directories(directory_paths, ocr_engine):
+    """
+    OCR every image and PDF under the directories in one engine call, write <name>.txt
+    next to each file with text and remove the original, as before. Returns the OCR
+    text of every file by path, None for files without text.
+    """
+    file_paths = []
+    for directory_path in directory_paths:
+        for root, _, files in os.walk(directory_path):
+            for file_name in files:
+                file_path = os.path.join(root, file_name)
+                if file_path.lower().endswith(OCR_EXTENSIONS):
+                    file_paths.append(file_path)
+    if not file_paths:
+        return {}
+    print(f"Processing OCR for {len(file_paths)} files")
+    results = ocr_engine.ocr_files(file_paths)
+    for file_path, ocr_text in results.items():
+        if ocr_text:
+            txt_file_path = file_path.rsplit('.', 1)[0].replace(" ", "_") + ".txt"
+            with open(txt_file_path, "w") as txt_file:
+                txt_file.write(ocr_text)
+            os.remove(file_path)
+            print(f"Created {txt_file_path} and removed original file {file_path}")
+        else:
+            print(f"No text extracted from {file_path}")
+    return results
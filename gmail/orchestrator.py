@@ -1,9 +1,10 @@
 from time import sleep
 import requests
 import os
+import json
 from dotenv import load_dotenv
 from doctr.models import ocr_predictor
-from doctr.io import DocumentFile
+from ocr_engine import OcrEngine, ocr_files_in_directories
 
 load_dotenv()
 
@@ -19,14 +20,138 @@ uri = os.getenv("NEO4J_URI")
 username = os.getenv("NEO4J_USERNAME")
 password = os.getenv("NEO4J_PASSWORD")
 database = os.getenv("NEO4J_DATABASE")
+# Send text files to /ingest_text in one request instead of /upload followed by /extract
+direct_ingestion = os.getenv("DIRECT_INGESTION", "True").lower() == "true"
+# Server side schema profile ("taxonomy" or "ontology") sent instead of the allowed node and relationship lists
+schema_profile = os.getenv("SCHEMA_PROFILE", "")
+
+# Graph schema sent with every extraction when no schema_profile is set
+allowed_relationships = [
+    "Situé_à",
+    "Situé_dans",
+    "A_les_détails",
+    "A_le_statut",
+    "Est_effectuée_par",
+    "Est_la_visite_de",
+    "A_la_référence",
+    "Est_proposé_par",
+    "Est_proposé_à",
+    "Est_du_Type",
+    "A_Demandé",
+    "Est_géré_par",
+    "Est_de_la_catégorie",
+    "Concerne_adresse",
+    "A_le_volume",
+    "Est_du_type",
+    "Inclus_la_prestation",
+    "A",
+    "Travaille_pour",
+    "Employe",
+    "Necessite_réservation_de_parking",
+    "Necessite_réservation_de_monte-charges",
+    "Est_du_Type",
+    "Est_a_étage",
+    "Est_accessible",
+    "Contient",
+    "A_la_surface",
+    "A_le_poids",
+    "A_la_largeur",
+    "A_la_longueur",
+    "A_la_profondeur",
+    "A_le_volume",
+    "A_les_dimensions",
+    "Est_dans",
+    "A_le_prix",
+    "A_été_envoyé_le",
+    "Concerne_adresse_chargement",
+    "Concerne_adresse_déchargement",
+    "Concerne_adresse_départ",
+    "Concerne_adresse_arrivée",
+    "A_le_téléphone",
+    "A_le_mail",
+    "Départ_chargement_de",
+    "Arrivée_déchargement_de"
+]
+
+allowed_nodes = [
+    "Status",
+    "Confirmé",
+    "Annulé",
+    "Non-confirmé",
+    "Date",
+    "Date de chargement",
+    "Date de déchargement",
+    "Date d’envoi du devis",
+    "Date de signature",
+    "Date d’envoi de la demande de devis",
+    "Date de la visite",
+    "Adresse",
+    "Ville",
+    "Code postal",
+    "Région",
+    "Pays",
+    "Détails du lieu",
+    "Employé",
+    "Entreprise",
+    "Client",
+    "Visite",
+    "Devis",
+    "Facture",
+    "Catégorie de déménagement",
+    "Prestation",
+    "Accessibilité",
+    "Meuble",
+    "Dimensions",
+    "Déménagement",
+    "Nettoyage",
+    "Client Privé",
+    "Client entreprise",
+    "Service ECO GROUPÉ",
+    "Service ECO",
+    "Service STD",
+    "Service LUX",
+    "Service PREM",
+    "Devant l’entrée",
+    "À 10m de l’entrée",
+    "À 20m de l’entrée",
+    "À 30m de l’entrée",
+    "À plus de 30m de l’entrée",
+    "ID de réference",
+    "Téléphone",
+    "Email",
+    "Site internet",
+    "Nom",
+    "Type_client",
+    "Type_de_déménagement",
+    "Type_De_nettoyage",
+    "Type_de_lieu",
+    "Type_de_bien",
+    "Montant",
+    "Bool",
+    "Demande de devis",
+    "Banque",
+    "Numéro de Compte",
+    "Site web"
+]
 
 # Initialize Doctr OCR predictor
 ocr_model = ocr_predictor(pretrained=True)
+# Pages of all new attachments share predictor batches; results are cached by content hash
+ocr_engine = OcrEngine(ocr_model)
+
+# Function to get the name of a text file on the server
+def get_server_file_name(file_path):
+    # Text files of a message folder are named after the sender and subject or the attachment, which
+    # repeat across messages; the server keys uploads and Document nodes by name, so the message id is added
+    folder_path = os.path.dirname(file_path)
+    if os.path.exists(os.path.join(folder_path, "metadata.json")):
+        return f"{os.path.basename(folder_path)}_{os.path.basename(file_path)}"
+    return os.path.basename(file_path)
 
 # Function to upload file in chunks
 def upload_file_in_chunks(file_path, server_url, model, uri, username, password, database):
     total_chunks = os.path.getsize(file_path) // chunk_size + 1
-    original_name = os.path.basename(file_path)
+    original_name = get_server_file_name(file_path)
     
     with open(file_path, 'rb') as file:
         for chunk_number in range(1, total_chunks + 1):  # Ensure chunk numbering starts from 1
@@ -52,11 +177,16 @@ def upload_file_in_chunks(file_path, server_url, model, uri, username, password,
             else:
                 print(f"Chunk {chunk_number}/{total_chunks} uploaded successfully.")
     
+    # The server answers the part that completes the file once it is merged and its Document node exists
+    if not (response_data.get('data') or {}).get('file_name'):
+        print(f"Upload of {original_name} was not acknowledged as merged: {response_data.get('message')}")
+        return False
     return True
 
 # Function to extract nodes and relations
-def extract_nodes_and_relations(server_url, model, uri, username, password, database, file_name):
+def extract_nodes_and_relations(server_url, model, uri, username, password, database, file_name, priority=0):
     data = {
+        'priority': priority,
         'uri': uri,
         'userName': username,
         'password': password,
@@ -64,113 +194,12 @@ def extract_nodes_and_relations(server_url, model, uri, username, password, data
         'model': model,
         'file_name': file_name,
         'source_type': 'local file',
-        'allowedRelationship': [
-        "Situé_à",
-        "Situé_dans",
-        "A_les_détails",
-        "A_le_statut",
-        "Est_effectuée_par",
-        "Est_la_visite_de",
-        "A_la_référence",
-        "Est_proposé_par",
-        "Est_proposé_à",
-        "Est_du_Type",
-        "A_Demandé",
-        "Est_géré_par",
-        "Est_de_la_catégorie",
-        "Concerne_adresse",
-        "A_le_volume",
-        "Est_du_type",
-        "Inclus_la_prestation",
-        "A",
-        "Travaille_pour",
-        "Employe",
-        "Necessite_réservation_de_parking",
-        "Necessite_réservation_de_monte-charges",
-        "Est_du_Type",
-        "Est_a_étage",
-        "Est_accessible",
-        "Contient",
-        "A_la_surface",
-        "A_le_poids",
-        "A_la_largeur",
-        "A_la_longueur",
-        "A_la_profondeur",
-        "A_le_volume",
-        "A_les_dimensions",
-        "Est_dans",
-        "A_le_prix",
-        "A_été_envoyé_le",
-        "Concerne_adresse_chargement",
-        "Concerne_adresse_déchargement",
-        "Concerne_adresse_départ",
-        "Concerne_adresse_arrivée",
-        "A_le_téléphone",
-        "A_le_mail",
-        "Départ_chargement_de",
-        "Arrivée_déchargement_de"
-        ],
-        'allowedNodes': [
-        "Status",
-        "Confirmé",
-        "Annulé",
-        "Non-confirmé",
-        "Date",
-        "Date de chargement",
-        "Date de déchargement",
-        "Date d’envoi du devis",
-        "Date de signature",
-        "Date d’envoi de la demande de devis",
-        "Date de la visite",
-        "Adresse",
-        "Ville",
-        "Code postal",
-        "Région",
-        "Pays",
-        "Détails du lieu",
-        "Employé",
-        "Entreprise",
-        "Client",
-        "Visite",
-        "Devis",
-        "Facture",
-        "Catégorie de déménagement",
-        "Prestation",
-        "Accessibilité",
-        "Meuble",
-        "Dimensions",
-        "Déménagement",
-        "Nettoyage",
-        "Client Privé",
-        "Client entreprise",
-        "Service ECO GROUPÉ",
-        "Service ECO",
-        "Service STD",
-        "Service LUX",
-        "Service PREM",
-        "Devant l’entrée",
-        "À 10m de l’entrée",
-        "À 20m de l’entrée",
-        "À 30m de l’entrée",
-        "À plus de 30m de l’entrée",
-        "ID de réference",
-        "Téléphone",
-        "Email",
-        "Site internet",
-        "Nom",
-        "Type_client",
-        "Type_de_déménagement",
-        "Type_De_nettoyage",
-        "Type_de_lieu",
-        "Type_de_bien",
-        "Montant",
-        "Bool",
-        "Demande de devis",
-        "Banque",
-        "Numéro de Compte",
-        "Site web"
-        ]
+        'allowedRelationship': allowed_relationships,
+        'allowedNodes': allowed_nodes
     }
+    if schema_profile:
+        del data['allowedRelationship'], data['allowedNodes']
+        data['schema_profile'] = schema_profile
     
     print(f"Sending extract request with data: {data}")
     response = requests.post(f"{server_url}/extract", data=data)
@@ -185,112 +214,128 @@ def extract_nodes_and_relations(server_url, model, uri, username, password, data
     
     return response_data
 
-# Function to process and perform OCR on pdf or image
-def process_pdf_or_image(file_path, predictor):
+# Function to create the document and extract nodes and relations from a text file in one request
+def ingest_text_file(file_path, server_url, model, uri, username, password, database):
+    with open(file_path, "r") as f:
+        text = f.read()
+    # Email headers saved by RetrieveEmail next to the text are kept with the document
+    metadata = {}
+    metadata_path = os.path.join(os.path.dirname(file_path), "metadata.json")
+    if os.path.exists(metadata_path):
+        with open(metadata_path, "r") as f:
+            email_metadata = json.load(f)
+        headers = email_metadata.get("headers", {})
+        metadata = {
+            "message_id": email_metadata.get("id"),
+            "thread_id": email_metadata.get("threadId"),
+            "date": email_metadata.get("internalDate"),
+            "from": headers.get("From"),
+            "subject": headers.get("Subject"),
+        }
+    data = {
+        'uri': uri,
+        'userName': username,
+        'password': password,
+        'database': database,
+        'model': model,
+        'file_name': get_server_file_name(file_path),
+        'text': text,
+        'metadata': json.dumps(metadata),
+        'allowedRelationship': ",".join(allowed_relationships),
+        'allowedNodes': ",".join(allowed_nodes)
+    }
+    if schema_profile:
+        del data['allowedRelationship'], data['allowedNodes']
+        data['schema_profile'] = schema_profile
+    
+    response = requests.post(f"{server_url}/ingest_text", data=data)
+    print(f"Ingestion endpoint response status: {response.status_code}")
+    
     try:
-        doc = (
-            DocumentFile.from_pdf(file_path)
-            if file_path.endswith(".pdf")
-            else DocumentFile.from_images(file_path)
-        )
-        result = predictor(doc)
-        raw_export = result.render()
-        if len(raw_export.strip()) < 20:
-            return None
-        return raw_export
-    except Exception as e:
-        print(f"Error processing {file_path}: {e}")
+        response_data = response.json()
+    except ValueError:
+        print(f"Error parsing ingestion response: {response.text}")
+        return None
+    
+    if response_data['status'] != 'Success':
+        print(f"Error ingesting {file_path}: {response_data.get('message')}")
         return None
+    return response_data
 
-# Function to process files within threads
-def process_files_in_thread(thread_path, ocr_model):
-    for root, _, files in os.walk(thread_path):
-        for file_name in files:
-            file_path = os.path.join(root, file_name)
-            if file_path.lower().endswith(('.jpg', '.png', '.pdf')):
-                print(f"Processing OCR for file: {file_path}")
-                ocr_text = process_pdf_or_image(file_path, ocr_model)
-                if ocr_text:
-                    txt_file_path = file_path.rsplit('.', 1)[0].replace(" ", "_") + ".txt"
-                    with open(txt_file_path, "w") as txt_file:
-                        txt_file.write(ocr_text)
-                    os.remove(file_path)
-                    print(f"Created {txt_file_path} and removed original file {file_path}")
-                else:
-                    print(f"No text extracted from {file_path}")
+# Function to wait for extractions queued by a backend running with EXTRACT_JOB_QUEUE_ENABLED
+# Returns the final status and error of every job by job id
+def wait_for_extract_jobs(server_url, job_ids, poll_seconds=10):
+    pending = set(job_ids)
+    final_statuses = {}
+    while pending:
+        for job_id in list(pending):
+            response_data = requests.get(f"{server_url}/extract_job_status/{job_id}").json()
+            job = response_data.get('data') or {}
+            if response_data['status'] != 'Success' or job.get('status') in ('Completed', 'Failed', 'Cancelled', 'Resubmit required'):
+                status = job.get('status') if response_data['status'] == 'Success' else 'Failed'
+                error = job.get('error') or response_data.get('message')
+                print(f"Extract job {job_id} for {job.get('file_name')}: {status}")
+                final_statuses[job_id] = (status, error)
+                pending.discard(job_id)
+        if pending:
+            sleep(poll_seconds)
+    return final_statuses
+
+# Function to send a text file to the server, directly or as an upload followed by an extraction
+def upload_and_extract(file_path):
+    print(f"Uploading and processing file: {file_path}")
+    if direct_ingestion:
+        return ingest_text_file(file_path, server_url, model, uri, username, password, database)
+    if not upload_file_in_chunks(file_path, server_url, model, uri, username, password, database):
+        print("File upload failed.")
+        return None
+    print("File uploaded successfully.")
+    return extract_nodes_and_relations(server_url, model, uri, username, password, database, get_server_file_name(file_path))
 
 def send_emails():
     # Process all files in the directory recursively
     with open("/root/one-mail-tb/gmail/new_emails", "r") as fr:
         new_emails = set(fr.read().split("\n"))
-    for file_id in os.listdir(directory_path):
-        if file_id in new_emails:
-            thread_path = os.path.join(directory_path, file_id)
-            process_files_in_thread(thread_path, ocr_model)
-            for file_name in os.listdir(thread_path):
-                file_path = os.path.join(thread_path, file_name)
-                if os.path.isfile(file_path) and file_path.endswith(".txt"):
-                    print(f"Uploading and processing file: {file_path}")
-                    if upload_file_in_chunks(file_path, server_url, model, uri, username, password, database):
-                        print("File uploaded successfully.")
-                        
-                        # Wait for a sufficient amount of time to ensure the server has time to merge the file
-                        sleep(20)
-                        
-                        # Extract nodes and relations
-                        extraction_response = extract_nodes_and_relations(server_url, model, uri, username, password, database, os.path.basename(file_path))
-                        if extraction_response:
-                            print("Extraction response:", extraction_response)
-                        else:
-                            print("Extraction failed.")
-                    else:
-                        print("File upload failed.")
+    job_ids = []
+    thread_paths = [os.path.join(directory_path, file_id) for file_id in os.listdir(directory_path) if file_id in new_emails]
+    # OCR the attachments of all new threads at once
+    ocr_files_in_directories(thread_paths, ocr_engine)
+    for thread_path in thread_paths:
+        for file_name in os.listdir(thread_path):
+            file_path = os.path.join(thread_path, file_name)
+            if os.path.isfile(file_path) and file_path.endswith(".txt"):
+                # Extract nodes and relations
+                extraction_response = upload_and_extract(file_path)
+                if extraction_response:
+                    print("Extraction response:", extraction_response)
+                    # A queued extraction returns at once, so the next file is submitted without waiting
+                    job_id = (extraction_response.get('data') or {}).get('job_id')
+                    if job_id:
+                        job_ids.append(job_id)
+                else:
+                    print("Extraction failed.")
+    
+    wait_for_extract_jobs(server_url, job_ids)
                     
     with open("/root/one-mail-tb/gmail/new_emails", "w") as fr:
         fr.write("")
 
-# Function to process files within OCR directory
-def process_files_in_ocr_directory(ocr_directory_path, ocr_model):
-    for root, _, files in os.walk(ocr_directory_path):
-        for file_name in files:
-            file_path = os.path.join(root, file_name)
-            if file_path.lower().endswith(('.jpg', '.png', '.pdf')):
-                print(f"Processing OCR for file: {file_path}")
-                ocr_text = process_pdf_or_image(file_path, ocr_model)
-                if ocr_text:
-                    txt_file_path = file_path.rsplit('.', 1)[0].replace(" ", "_") + ".txt"
-                    with open(txt_file_path, "w") as txt_file:
-                        txt_file.write(ocr_text)
-                    os.remove(file_path)
-                    print(f"Created {txt_file_path} and removed original file {file_path}")
-                else:
-                    print(f"No text extracted from {file_path}")
-
 def send_files():
     # Process all files in the OCR directory
-    process_files_in_ocr_directory(ocr_directory_path, ocr_model)
+    ocr_files_in_directories([ocr_directory_path], ocr_engine)
     
     for file_name in os.listdir(ocr_directory_path):
         file_path = os.path.join(ocr_directory_path, file_name)
         if os.path.isfile(file_path) and file_path.endswith(".txt"):
-            print(f"Uploading and processing file: {file_path}")
-            if upload_file_in_chunks(file_path, server_url, model, uri, username, password, database):
-                print("File uploaded successfully.")
-                
-                # Wait for a sufficient amount of time to ensure the server has time to merge the file
-                sleep(20)
-                
-                # Extract nodes and relations
-                extraction_response = extract_nodes_and_relations(server_url, model, uri, username, password, database, os.path.basename(file_path))
-                if extraction_response:
-                    print("Extraction response:", extraction_response)
-                    # Remove the .txt file after extraction
-                    os.remove(file_path)
-                    print(f"Removed processed text file: {file_path}")
-                else:
-                    print("Extraction failed.")
+            # Extract nodes and relations
+            extraction_response = upload_and_extract(file_path)
+            if extraction_response:
+                print("Extraction response:", extraction_response)
+                # Remove the .txt file after extraction
+                os.remove(file_path)
+                print(f"Removed processed text file: {file_path}")
             else:
-                print("File upload failed.")
+                print("Extraction failed.")
 
 if __name__ == "__main__":
     send_emails()
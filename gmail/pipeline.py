@@ -0,0 +1,199 @@
+"""
+Gmail ingestion service: fetch, OCR, upload and extract stages connected by queues.
+
+The fetch stage syncs the mailbox incrementally every GMAIL_POLL_SECONDS and hands each
+new message folder to the OCR stage; the later stages start on a message as soon as it
+arrives instead of waiting for the whole batch. The OCR stage takes every waiting
+message at once so OcrEngine batches their pages together, uploads and extractions run
+on PIPELINE_UPLOAD_WORKERS and PIPELINE_EXTRACT_WORKERS threads, and a file is sent to
+/extract as soon as the server acknowledged its upload as merged. With
+DIRECT_INGESTION, text files skip the upload stage and the extract stage sends them to
+/ingest_text, which creates the document and extracts it in one request.
+
+Every stage records its progress in the IngestionStateStore; on start, messages and
+text files are queued again at the stage they reached before the service stopped.
+
+    python pipeline.py
+"""
+import os
+import queue
+import threading
+from retrieve_emails import RetrieveEmail
+import orchestrator
+from orchestrator import (upload_file_in_chunks, extract_nodes_and_relations, wait_for_extract_jobs, ingest_text_file,
+                          get_server_file_name, direct_ingestion, server_url, model, uri, username, password, database)
+from ocr_engine import ocr_files_in_directories, OCR_EXTENSIONS
+from state_store import IngestionStateStore, FETCHED, OCR_DONE, UPLOADED, EXTRACTED, NO_TEXT, NOT_OCR, FAILED
+
+CREDENTIALS_FILE_PATH = "/root/one-mail-tb/gmail/credentials/token.pickle"
+POLL_SECONDS = int(os.getenv("GMAIL_POLL_SECONDS", 10))
+UPLOAD_WORKERS = int(os.getenv("PIPELINE_UPLOAD_WORKERS", 4))
+EXTRACT_WORKERS = int(os.getenv("PIPELINE_EXTRACT_WORKERS", 4))
+# messages or files allowed to wait for a stage before the previous stage blocks
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 100))
+
+# Put on a stage queue once per worker to stop the stage after the items queued before it
+STOP = object()
+
+
+class GmailPipeline:
+    def __init__(self, retriever_factory=None, state_store=None, ocr_engine=None):
+        self.state_store = state_store or IngestionStateStore(RetrieveEmail.STATE_DB_PATH)
+        self.retriever_factory = retriever_factory or (lambda: RetrieveEmail(new_emails_path=None, state_store=self.state_store))
+        self.ocr_engine = ocr_engine or orchestrator.ocr_engine
+        self.ocr_queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.upload_queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.extract_queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.stop_event = threading.Event()
+        self.stages = []
+
+    def start(self):
+        fetch_thread = threading.Thread(target=self.fetch_stage, name="gmail-fetch", daemon=True)
+        fetch_thread.start()
+        self.stages = [
+            (None, [fetch_thread]),
+            (self.ocr_queue, self.start_workers("gmail-ocr", self.ocr_stage, 1)),
+            (self.upload_queue, self.start_workers("gmail-upload", self.upload_stage, UPLOAD_WORKERS)),
+            (self.extract_queue, self.start_workers("gmail-extract", self.extract_stage, EXTRACT_WORKERS)),
+        ]
+
+    def start_workers(self, name, target, workers):
+        threads = [threading.Thread(target=target, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def stop(self):
+        # Stops fetching, then lets every stage finish what is already queued for it
+        self.stop_event.set()
+        for stage_queue, threads in self.stages:
+            if stage_queue is not None:
+                for _ in threads:
+                    stage_queue.put(STOP)
+            for thread in threads:
+                thread.join()
+
+    def resume(self):
+        # Work left by the last run goes first, each item to the stage after the one it completed
+        for message_id, folder_path in self.state_store.get_messages(FETCHED):
+            self.ocr_queue.put((message_id, folder_path))
+        for file_path in self.state_store.get_text_files(OCR_DONE):
+            self.upload_queue.put(file_path)
+        for file_path in self.state_store.get_text_files(UPLOADED):
+            self.extract_queue.put(file_path)
+
+    def fetch_stage(self):
+        self.resume()
+        while not self.stop_event.is_set():
+            if os.path.exists(CREDENTIALS_FILE_PATH):
+                try:
+                    for message_id in self.retriever_factory().retrieve_emails():
+                        self.ocr_queue.put((message_id, self.state_store.get_message(message_id)["folder_path"]))
+                except Exception as e:
+                    print(f"Error retrieving emails: {e}")
+            else:
+                print(f"'{CREDENTIALS_FILE_PATH}' not found. Skipping email retrieval.")
+            self.stop_event.wait(POLL_SECONDS)
+
+    def ocr_stage(self):
+        while True:
+            messages = [self.ocr_queue.get()]
+            # every message waiting now shares the OCR batches
+            while messages[-1] is not STOP:
+                try:
+                    messages.append(self.ocr_queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = messages[-1] is STOP
+            messages = [message for message in messages if message is not STOP]
+            if messages:
+                try:
+                    ocr_results = ocr_files_in_directories([folder_path for _, folder_path in messages], self.ocr_engine)
+                except Exception as e:
+                    # the messages stay fetched and are OCR'd again on the next start
+                    print(f"Error running OCR on {len(messages)} messages: {e}")
+                    ocr_results = None
+                if ocr_results is not None:
+                    for message_id, folder_path in messages:
+                        self.record_ocr_results(message_id, folder_path, ocr_results)
+            if stopping:
+                return
+
+    def record_ocr_results(self, message_id, folder_path, ocr_results):
+        attachment_stages = {}
+        for file_name in os.listdir(folder_path):
+            file_path = os.path.join(folder_path, file_name)
+            if file_path in ocr_results:
+                attachment_stages[file_name] = OCR_DONE if ocr_results[file_path] else NO_TEXT
+            elif not file_path.lower().endswith(OCR_EXTENSIONS):
+                attachment_stages[file_name] = NOT_OCR
+        # attachments missing from the folder were replaced by their text before a restart
+        for file_name in self.state_store.get_attachment_names(message_id):
+            attachment_stages.setdefault(file_name, OCR_DONE)
+        text_file_paths = [os.path.join(folder_path, file_name) for file_name in os.listdir(folder_path)
+                           if file_name.endswith(".txt") and os.path.isfile(os.path.join(folder_path, file_name))]
+        self.state_store.record_ocr_results(message_id, attachment_stages, text_file_paths)
+        for file_path in text_file_paths:
+            self.upload_queue.put(file_path)
+
+    def upload_stage(self):
+        while True:
+            file_path = self.upload_queue.get()
+            if file_path is STOP:
+                return
+            if direct_ingestion:
+                self.extract_queue.put(file_path)
+                continue
+            print(f"Uploading file: {file_path}")
+            try:
+                if upload_file_in_chunks(file_path, server_url, model, uri, username, password, database):
+                    self.state_store.set_text_file_stage(file_path, UPLOADED)
+                    self.extract_queue.put(file_path)
+                else:
+                    print(f"File upload failed: {file_path}")
+                    self.state_store.set_text_file_stage(file_path, FAILED, "upload failed")
+            except Exception as e:
+                print(f"Error uploading {file_path}: {e}")
+                self.state_store.set_text_file_stage(file_path, FAILED, str(e))
+
+    def extract_stage(self):
+        while True:
+            file_path = self.extract_queue.get()
+            if file_path is STOP:
+                return
+            file_name = get_server_file_name(file_path)
+            try:
+                if direct_ingestion:
+                    extraction_response = ingest_text_file(file_path, server_url, model, uri, username, password, database)
+                else:
+                    extraction_response = extract_nodes_and_relations(server_url, model, uri, username, password, database, file_name)
+                if not extraction_response or extraction_response.get('status') != 'Success':
+                    print(f"Extraction failed: {file_name}")
+                    self.state_store.set_text_file_stage(file_path, FAILED, "extraction failed")
+                    continue
+                # A backend with EXTRACT_JOB_QUEUE_ENABLED returns a job id at once
+                job_id = (extraction_response.get('data') or {}).get('job_id')
+                if job_id:
+                    status, error = wait_for_extract_jobs(server_url, [job_id])[job_id]
+                    if status != 'Completed':
+                        print(f"Extract job {job_id} for {file_name} ended {status}: {error}")
+                        self.state_store.set_text_file_stage(file_path, FAILED, f"{status}: {error}")
+                        continue
+                self.state_store.set_text_file_stage(file_path, EXTRACTED)
+            except Exception as e:
+                print(f"Error extracting {file_name}: {e}")
+                self.state_store.set_text_file_stage(file_path, FAILED, str(e))
+
+
+def run_pipeline():
+    pipeline = GmailPipeline()
+    pipeline.start()
+    try:
+        pipeline.stop_event.wait()
+    except KeyboardInterrupt:
+        print("Stopping the gmail pipeline after the queued messages.")
+    pipeline.stop()
+
+
+if __name__ == "__main__":
+    run_pipeline()
@@ -2,6 +2,8 @@ import os
 import base64
 import json
 import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import string
 from google.oauth2.credentials import Credentials
@@ -9,14 +11,36 @@ from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from google.auth.transport.requests import Request
 import re
+from state_store import IngestionStateStore
 
 class RetrieveEmail:
     # Constants
+    # threads_metadata.json and sync_state.json are only read once, to seed an empty state store
     JSON_FILE_PATH = "threads_metadata.json"
     THREADS_FOLDER_PATH = "threads"
+    SYNC_STATE_FILE_PATH = "sync_state.json"
+    STATE_DB_PATH = os.getenv("GMAIL_STATE_DB_PATH", "ingestion_state.db")
+    # Only threads changed since the last recorded mailbox historyId are fetched
+    INCREMENTAL_SYNC = os.getenv("GMAIL_INCREMENTAL_SYNC", "True").lower() == "true"
+    # threads().get requests sent in one batch HTTP request, at most 100
+    BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", 50))
+    ATTACHMENT_WORKERS = int(os.getenv("GMAIL_ATTACHMENT_WORKERS", 4))
+
+    # Load credentials from the token file, or use the given service (e.g. FakeGmailService)
+    # new_emails_path=None leaves recording new message ids to the caller of retrieve_emails
+    def __init__(self, service=None, new_emails_path="new_emails", state_store=None) -> None:
+        self.new_emails_path = new_emails_path
+        self.state_store = state_store or IngestionStateStore(self.STATE_DB_PATH)
+        # Threads with a message that could not be saved, fetched again on the next run
+        self.failed_thread_ids = set()
+        self.import_legacy_state()
+        # googleapiclient services are not thread safe, attachment workers build their own
+        self._local = threading.local()
+        if service is not None:
+            self.service = service
+            self._build_service = lambda: service
+            return
 
-    # Load credentials from the token file
-    def __init__(self) -> None:   
         creds = None
         if os.path.exists("/root/one-mail-tb/gmail/credentials/token.pickle"):
             with open("/root/one-mail-tb/gmail/credentials/token.pickle", "rb") as token:
@@ -30,17 +54,84 @@ class RetrieveEmail:
                 raise ValueError("No valid credentials provided.")
 
         # Build the Gmail API service
-        self.service = build("gmail", "v1", credentials=creds)
-
-    def load_threads_metadata(self):
-        if os.path.exists(self.JSON_FILE_PATH):
-            with open(self.JSON_FILE_PATH, "r") as f:
-                return json.load(f)
-        return {}
+        self._build_service = lambda: build("gmail", "v1", credentials=creds)
+        self.service = self._build_service()
+
+    def get_service(self):
+        # Gmail API service of the calling thread
+        if not hasattr(self._local, "service"):
+            self._local.service = self._build_service()
+        return self._local.service
+
+    def import_legacy_state(self):
+        if not self.state_store.is_empty() or not os.path.exists(self.JSON_FILE_PATH):
+            return
+        history_id = None
+        if os.path.exists(self.SYNC_STATE_FILE_PATH):
+            with open(self.SYNC_STATE_FILE_PATH, "r") as f:
+                history_id = json.load(f).get("historyId")
+        self.state_store.import_threads_metadata(self.JSON_FILE_PATH, history_id)
+        print(f"Imported {self.JSON_FILE_PATH} into {self.state_store.db_path}")
+
+    def load_history_id(self):
+        return self.state_store.get_value("historyId")
+
+    def save_history_id(self, history_id):
+        self.state_store.set_value("historyId", history_id)
+
+    def get_mailbox_history_id(self, user_id="me"):
+        return self.service.users().getProfile(userId=user_id).execute()["historyId"]
+
+    def get_changed_thread_ids(self, start_history_id, user_id="me"):
+        """
+        Ids of the threads with messages added or labelled since start_history_id, and the
+        current mailbox historyId. Returns None when the history is no longer available
+        (Gmail keeps it for about a week) and a full sync is needed.
+        """
+        thread_ids = []
+        page_token = None
+        try:
+            while True:
+                response = (
+                    self.service.users()
+                    .history()
+                    .list(userId=user_id, startHistoryId=start_history_id,
+                          historyTypes=["messageAdded", "labelAdded"], pageToken=page_token)
+                    .execute()
+                )
+                for record in response.get("history", []):
+                    for change in record.get("messagesAdded", []) + record.get("labelsAdded", []):
+                        thread_id = change["message"]["threadId"]
+                        if thread_id not in thread_ids:
+                            thread_ids.append(thread_id)
+                page_token = response.get("nextPageToken")
+                if not page_token:
+                    return thread_ids, response["historyId"]
+        except HttpError as error:
+            if error.resp.status == 404:
+                print(f"History {start_history_id} is no longer available, running a full sync.")
+                return None
+            raise
+
+    def fetch_threads(self, thread_ids, user_id="me"):
+        """
+        threads().get for every id, BATCH_SIZE requests per batch HTTP request.
+        Returns the fetched threads by id; failed fetches are reported and left out.
+        """
+        threads = {}
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                print(f"An error occurred fetching thread {request_id}: {exception}")
+            else:
+                threads[request_id] = response
 
-    def save_threads_metadata(self, threads_metadata):
-        with open(self.JSON_FILE_PATH, "w") as f:
-            json.dump(threads_metadata, f, indent=4)
+        for i in range(0, len(thread_ids), self.BATCH_SIZE):
+            batch = self.service.new_batch_http_request(callback=callback)
+            for thread_id in thread_ids[i:i + self.BATCH_SIZE]:
+                batch.add(self.service.users().threads().get(userId=user_id, id=thread_id), request_id=thread_id)
+            batch.execute()
+        return threads
 
     def get_threads(self, user_id="me", label_ids=[], max_results=10):
         try:
@@ -71,27 +162,62 @@ class RetrieveEmail:
     #         os.makedirs(email_folder_path)
     #     return email_folder_path
 
-    def get_thread_details(self, thread_id, threads_metadata, user_id="me"):
+    def get_thread_details(self, thread_id, user_id="me", thread=None, attachment_pool=None):
+        """
+        Processes the new messages of a thread. With an attachment_pool, attachment
+        downloads are submitted to it and the (message, futures) of every processed
+        message are returned for mark_messages_processed; otherwise messages are marked
+        as processed here.
+        """
+        processed = []
         try:
-            thread = self.service.users().threads().get(userId=user_id, id=thread_id).execute()
+            if thread is None:
+                thread = self.service.users().threads().get(userId=user_id, id=thread_id).execute()
             messages = thread.get("messages", [])
 
             for message in messages:
                 message_id = message["id"]
 
-                # Check if message_id is already in the mail_ids list
-                if message_id not in threads_metadata[thread_id].get("mail_ids", []):
+                # Check if message_id is already in the state store
+                if not self.state_store.is_message_known(message_id):
                     # Process the message
-                    success = self.process_message(message, thread_id, threads_metadata)
+                    attachment_futures = [] if attachment_pool is not None else None
+                    success = self.process_message(message, thread_id, attachment_pool, attachment_futures)
 
                     if success:
-                        # Add the message_id to the mail_ids list
-                        threads_metadata[thread_id]["mail_ids"].append(message_id)
-                        with open("new_emails", "a") as f:
-                            f.write("\n" + message["id"])
+                        processed.append((message, attachment_futures or []))
+                    elif success is False:
+                        self.failed_thread_ids.add(thread_id)
 
         except HttpError as error:
             print(f"An error occurred: {error}")
+            self.failed_thread_ids.add(thread_id)
+
+        if attachment_pool is None:
+            self.mark_messages_processed(thread_id, processed)
+        return processed
+
+    def mark_messages_processed(self, thread_id, processed):
+        marked = []
+        for message, attachment_futures in processed:
+            message_id = message["id"]
+            try:
+                for future in attachment_futures:
+                    future.result()
+            except HttpError as error:
+                # not marked, and its thread is fetched again on the next run
+                print(f"An error occurred: {error}")
+                self.failed_thread_ids.add(thread_id)
+                continue
+            # Record the message with its attachments as fetched
+            attachment_names = [part["filename"] for part in message["payload"].get("parts", []) if part["filename"]]
+            folder_path = os.path.abspath(os.path.join(self.THREADS_FOLDER_PATH, message_id))
+            self.state_store.record_fetched_message(message_id, thread_id, folder_path, attachment_names)
+            marked.append(message_id)
+            if self.new_emails_path:
+                with open(self.new_emails_path, "a") as f:
+                    f.write("\n" + message_id)
+        return marked
 
     def extract_sender_email(self, sender_info):
         # Extract the email address from the 'From' field
@@ -101,7 +227,7 @@ class RetrieveEmail:
         # Extract the subject line
         return subject_info.replace(' ', '_')  # Replace spaces with underscores for filenames
 
-    def process_message(self, message, thread_id, threads_metadata):
+    def process_message(self, message, thread_id, attachment_pool=None, attachment_futures=None):
         try:
             headers = {
                 header["name"]: header["value"] for header in message["payload"]["headers"]
@@ -160,7 +286,9 @@ class RetrieveEmail:
                 json.dump(metadata, f, indent=4)
 
             # Download and save attachments
-            self.get_attachments(message, email_folder_path)
+            futures = self.get_attachments(message, email_folder_path, attachment_pool)
+            if attachment_futures is not None:
+                attachment_futures.extend(futures)
             
             return True
             
@@ -207,48 +335,82 @@ class RetrieveEmail:
 
         return "\n".join(new_lines)
 
-    def get_attachments(self, message, folder_name):
+    def get_attachments(self, message, folder_name, attachment_pool=None):
+        # Downloads in the calling thread, or submits the downloads to attachment_pool and returns their futures
+        futures = []
         if "parts" in message["payload"]:
             for part in message["payload"]["parts"]:
                 if part["filename"]:
-                    attachment_id = part["body"]["attachmentId"]
-                    attachment = (
-                        self.service.users()
-                        .messages()
-                        .attachments()
-                        .get(userId="me", messageId=message["id"], id=attachment_id)
-                        .execute()
-                    )
-                    data = base64.urlsafe_b64decode(attachment["data"].encode("UTF-8"))
-                    path = os.path.join(folder_name, part["filename"])
-                    with open(path, "wb") as f:
-                        f.write(data)
-                        print(f'Attachment {part["filename"]} downloaded.')
+                    if attachment_pool is None:
+                        self.download_attachment(message["id"], part, folder_name)
+                    else:
+                        futures.append(attachment_pool.submit(self.download_attachment, message["id"], part, folder_name))
+        return futures
+
+    def download_attachment(self, message_id, part, folder_name):
+        attachment_id = part["body"]["attachmentId"]
+        attachment = (
+            self.get_service().users()
+            .messages()
+            .attachments()
+            .get(userId="me", messageId=message_id, id=attachment_id)
+            .execute()
+        )
+        data = base64.urlsafe_b64decode(attachment["data"].encode("UTF-8"))
+        path = os.path.join(folder_name, part["filename"])
+        with open(path, "wb") as f:
+            f.write(data)
+            print(f'Attachment {part["filename"]} downloaded.')
 
     def retrieve_emails(self):
-        threads_metadata = self.load_threads_metadata()
-        threads = self.get_threads(max_results=60)  # Retrieve the 30 latest threads
-
-        if threads:
-            for thread in threads:
-                thread_id = thread["id"]
+        # Returns the ids of the messages saved in this run
+        new_message_ids = []
+
+        thread_ids = None
+        history_id = self.load_history_id() if self.INCREMENTAL_SYNC else None
+        if history_id:
+            changes = self.get_changed_thread_ids(history_id)
+            if changes is not None:
+                thread_ids, history_id = changes
+        if thread_ids is None:
+            # Full sync; the historyId is read first so changes made meanwhile are seen on the next run
+            history_id = self.get_mailbox_history_id() if self.INCREMENTAL_SYNC else None
+            threads = self.get_threads(max_results=60)  # Retrieve the 60 latest threads
+            if threads is None:
+                return new_message_ids
+            thread_ids = [thread["id"] for thread in threads]
+
+        # The historyId moves past the changes of threads whose messages failed, so they are kept apart
+        retry_thread_ids = self.state_store.get_retry_thread_ids()
+        thread_ids = list(dict.fromkeys(thread_ids + retry_thread_ids))
+        self.failed_thread_ids = set()
+        fetched_threads = self.fetch_threads(thread_ids)
+
+        with ThreadPoolExecutor(max_workers=self.ATTACHMENT_WORKERS) as attachment_pool:
+            processed_threads = []
+            for thread_id in thread_ids:
+                if thread_id not in fetched_threads:
+                    continue
                 current_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-                if thread_id not in threads_metadata:
-                    # New thread, create a new entry in the JSON file
-                    threads_metadata[thread_id] = {
-                        "id": thread_id,
-                        "mail_ids": [],
-                        "created_at": current_datetime,
-                    }
-                else:
-                    # Existing thread, update the "created_at" value with the current time
-                    threads_metadata[thread_id]["created_at"] = current_datetime
+                # New or existing thread, the "created_at" value is the time it was last fetched
+                self.state_store.record_thread(thread_id, current_datetime)
 
                 # Process thread details only if it's not already processed
-                self.get_thread_details(thread_id, threads_metadata)
-
-        self.save_threads_metadata(threads_metadata)
+                processed = self.get_thread_details(thread_id, thread=fetched_threads[thread_id],
+                                                    attachment_pool=attachment_pool)
+                processed_threads.append((thread_id, processed))
+
+            for thread_id, processed in processed_threads:
+                new_message_ids.extend(self.mark_messages_processed(thread_id, processed))
+
+        # Threads that could not be fetched are fetched again from the same historyId next time,
+        # with the retried threads that were not fetched either
+        self.state_store.set_retry_thread_ids(sorted(
+            self.failed_thread_ids | {thread_id for thread_id in retry_thread_ids if thread_id not in fetched_threads}))
+        if history_id and len(fetched_threads) == len(thread_ids):
+            self.save_history_id(history_id)
+        return new_message_ids
 
 if __name__ == "__main__":
     email_retriever = RetrieveEmail()
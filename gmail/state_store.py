@@ -0,0 +1,187 @@
+import json
+import os
+import sqlite3
+import time
+
+# Stages of a message: its text and attachments are saved (fetched), its attachments went
+# through OCR (ocr_done), all its text files are uploaded (uploaded) and extracted (extracted)
+FETCHED = "fetched"
+OCR_DONE = "ocr_done"
+UPLOADED = "uploaded"
+EXTRACTED = "extracted"
+# attachment stages besides fetched and ocr_done
+NO_TEXT = "no_text"
+NOT_OCR = "not_ocr"
+# a text file that could not be uploaded or extracted; it is not retried automatically
+FAILED = "failed"
+
+CREATE_TABLE_QUERIES = [
+    """CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS threads (
+        thread_id TEXT PRIMARY KEY,
+        created_at TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS messages (
+        message_id TEXT PRIMARY KEY,
+        thread_id TEXT NOT NULL,
+        folder_path TEXT,
+        stage TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS attachments (
+        message_id TEXT NOT NULL,
+        file_name TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (message_id, file_name)
+    )""",
+    """CREATE TABLE IF NOT EXISTS text_files (
+        file_path TEXT PRIMARY KEY,
+        message_id TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        error TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_messages_stage ON messages (stage)",
+    "CREATE INDEX IF NOT EXISTS idx_text_files_stage ON text_files (stage)",
+    "CREATE INDEX IF NOT EXISTS idx_text_files_message ON text_files (message_id)",
+]
+
+
+class IngestionStateStore:
+    """
+    Ingestion state of the gmail pipeline in SQLite (WAL mode), one row per thread,
+    message, attachment and uploaded text file with its stage. Every stage change is one
+    transaction, so after a crash the pipeline resumes each message at the stage it
+    reached, and lookups use the primary key or stage indexes whatever the mailbox size.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            for query in CREATE_TABLE_QUERIES:
+                connection.execute(query)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get_value(self, key):
+        with self._connect() as connection:
+            row = connection.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_value(self, key, value):
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, value))
+
+    def get_retry_thread_ids(self):
+        value = self.get_value("retry_thread_ids")
+        return json.loads(value) if value else []
+
+    def set_retry_thread_ids(self, thread_ids):
+        self.set_value("retry_thread_ids", json.dumps(thread_ids))
+
+    def is_empty(self):
+        with self._connect() as connection:
+            return connection.execute("SELECT 1 FROM messages LIMIT 1").fetchone() is None
+
+    def import_threads_metadata(self, json_file_path, history_id=None):
+        # Messages listed in threads_metadata.json were handled by the previous orchestrator run
+        with open(json_file_path, "r") as f:
+            threads_metadata = json.load(f)
+        now = time.time()
+        with self._connect() as connection:
+            for thread_id, thread in threads_metadata.items():
+                connection.execute("INSERT OR IGNORE INTO threads (thread_id, created_at) VALUES (?, ?)",
+                                   (thread_id, thread.get("created_at", "")))
+                connection.executemany(
+                    "INSERT OR IGNORE INTO messages (message_id, thread_id, stage, updated_at) VALUES (?, ?, ?, ?)",
+                    [(message_id, thread_id, EXTRACTED, now) for message_id in thread.get("mail_ids", [])],
+                )
+            if history_id:
+                connection.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('historyId', ?)", (history_id,))
+
+    def record_thread(self, thread_id, created_at):
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO threads (thread_id, created_at) VALUES (?, ?)", (thread_id, created_at))
+
+    def is_message_known(self, message_id):
+        with self._connect() as connection:
+            return connection.execute("SELECT 1 FROM messages WHERE message_id = ?", (message_id,)).fetchone() is not None
+
+    def get_message(self, message_id):
+        with self._connect() as connection:
+            connection.row_factory = sqlite3.Row
+            row = connection.execute("SELECT * FROM messages WHERE message_id = ?", (message_id,)).fetchone()
+        return dict(row) if row else None
+
+    def record_fetched_message(self, message_id, thread_id, folder_path, attachment_names):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO messages (message_id, thread_id, folder_path, stage, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (message_id, thread_id, folder_path, FETCHED, now),
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO attachments (message_id, file_name, stage, updated_at) VALUES (?, ?, ?, ?)",
+                [(message_id, file_name, FETCHED, now) for file_name in attachment_names],
+            )
+
+    def get_attachment_names(self, message_id):
+        with self._connect() as connection:
+            return [row[0] for row in connection.execute("SELECT file_name FROM attachments WHERE message_id = ?", (message_id,))]
+
+    def get_messages(self, stage):
+        with self._connect() as connection:
+            return connection.execute("SELECT message_id, folder_path FROM messages WHERE stage = ?", (stage,)).fetchall()
+
+    def record_ocr_results(self, message_id, attachment_stages, text_file_paths):
+        """Stores the OCR outcome of every attachment and the text files to upload, in one transaction."""
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                "UPDATE attachments SET stage = ?, updated_at = ? WHERE message_id = ? AND file_name = ?",
+                [(stage, now, message_id, file_name) for file_name, stage in attachment_stages.items()],
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO text_files (file_path, message_id, stage, updated_at) VALUES (?, ?, ?, ?)",
+                [(file_path, message_id, OCR_DONE, now) for file_path in text_file_paths],
+            )
+            connection.execute("UPDATE messages SET stage = ?, updated_at = ? WHERE message_id = ?",
+                               (OCR_DONE if text_file_paths else EXTRACTED, now, message_id))
+
+    def get_text_files(self, stage):
+        with self._connect() as connection:
+            return [row[0] for row in connection.execute("SELECT file_path FROM text_files WHERE stage = ?", (stage,))]
+
+    def set_text_file_stage(self, file_path, stage, error=None):
+        # The message moves on once none of its text files is behind the new stage
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute("SELECT message_id FROM text_files WHERE file_path = ?", (file_path,)).fetchone()
+            if row is None:
+                return
+            connection.execute("UPDATE text_files SET stage = ?, updated_at = ?, error = ? WHERE file_path = ?",
+                               (stage, now, error, file_path))
+            for message_stage, done_stages in ((UPLOADED, (UPLOADED, EXTRACTED)), (EXTRACTED, (EXTRACTED,))):
+                if stage not in done_stages:
+                    continue
+                connection.execute(
+                    f"""UPDATE messages SET stage = ?, updated_at = ? WHERE message_id = ? AND NOT EXISTS (
+                        SELECT 1 FROM text_files WHERE message_id = ? AND stage NOT IN ({", ".join("?" for _ in done_stages)}))""",
+                    (message_stage, now, row[0], row[0], *done_stages),
+                )
+
+    def get_stage_counts(self):
+        with self._connect() as connection:
+            return {
+                "messages": dict(connection.execute("SELECT stage, count(*) FROM messages GROUP BY stage").fetchall()),
+                "attachments": dict(connection.execute("SELECT stage, count(*) FROM attachments GROUP BY stage").fetchall()),
+                "text_files": dict(connection.execute("SELECT stage, count(*) FROM text_files GROUP BY stage").fetchall()),
+            }